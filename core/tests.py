@@ -1,3 +1,131 @@
-from django.test import TestCase
+import json
+import logging
+import queue
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from portfolio import admin_dashboard, logs
+from portfolio.admin_dashboard import KPI_KEY, MONEY_KEYS, dashboard_callback, get_kpis
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LogPipelineTests(SimpleTestCase):
+    def record(self, msg="m", level=logging.INFO, **extra):
+        record = logging.LogRecord("test", level, __file__, 1, msg, (), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = logs._RoutingQueueHandler(queue.Queue(1), ())
+        before = logs._RoutingQueueHandler.dropped
+        t0 = time.monotonic()
+        for _ in range(3):
+            handler.handle(self.record())
+        self.assertLess(time.monotonic() - t0, 1)
+        self.assertEqual(logs._RoutingQueueHandler.dropped - before, 2)
+
+    def test_listener_writes_to_the_logger_handlers_by_level(self):
+        q, info, errors = queue.Queue(), _ListHandler(), _ListHandler(logging.ERROR)
+        listener = logs._RoutingListener(q)
+        listener.start()
+        handler = logs._RoutingQueueHandler(q, (info, errors))
+        handler.handle(self.record("a %s"))
+        handler.handle(self.record("boom", logging.ERROR))
+        listener.stop()  # vacía la cola antes de parar
+
+        self.assertEqual([r.getMessage() for r in info.records], ["a %s", "boom"])
+        self.assertEqual([r.getMessage() for r in errors.records], ["boom"])
+
+    def test_child_process_gets_a_new_queue_and_listener(self):
+        self.assertIsNotNone(logs._queue)  # settings.LOGGING usa la cola por defecto
+        old_queue, old_listener = logs._queue, logs._listener
+        self.addCleanup(old_listener.stop)
+
+        logs._restart_after_fork()
+
+        self.assertIsNot(logs._queue, old_queue)
+        self.assertEqual(logs._queue.maxsize, old_queue.maxsize)
+        handlers = list(logs._queue_handlers())
+        self.assertTrue(handlers and all(h.queue is logs._queue for h in handlers))
+        self.assertTrue(logs._listener._thread.is_alive())
+
+    def test_json_lines_are_truncated_and_sampling_keeps_warnings(self):
+        line = json.loads(logs.JsonFormatter(max_str=5).format(
+            self.record("x" * 10, event="e", data={"body": "y" * 10, "items": list(range(30))})
+        ))
+        self.assertEqual((line["msg"], line["event"], line["data"]["body"]), ("xxxxx…(+5)", "e", "yyyyy…(+5)"))
+        self.assertEqual(line["data"]["items"][-1], "…(+10)")
+
+        sampler = logs.SamplingFilter({"noisy": 0})
+        self.assertFalse(sampler.filter(self.record(event="noisy")))
+        self.assertTrue(sampler.filter(self.record(level=logging.WARNING, event="noisy")))
+        self.assertTrue(sampler.filter(self.record(event="other")))
+
+
+class KpiCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def compute(self, **data):
+        return mock.patch.object(admin_dashboard, "compute_kpis", return_value=data)
+
+    def test_fresh_value_is_served_from_cache(self):
+        with self.compute(kpi_users=1) as compute:
+            get_kpis()
+            self.assertEqual(get_kpis(), {"kpi_users": 1})
+        compute.assert_called_once()
+
+    def test_stale_value_is_served_while_another_process_recomputes(self):
+        cache.set(KPI_KEY, {"data": {"kpi_users": 1}, "fresh_until": time.time() - 1})
+        cache.add(f"{KPI_KEY}:lock", 1)
+        with self.compute(kpi_users=2) as compute:
+            self.assertEqual(get_kpis(), {"kpi_users": 1})
+        compute.assert_not_called()
+
+    def test_stale_value_is_replaced_by_the_lock_holder(self):
+        cache.set(KPI_KEY, {"data": {"kpi_users": 1}, "fresh_until": time.time() - 1})
+        with self.compute(kpi_users=2):
+            self.assertEqual(get_kpis(), {"kpi_users": 2})
+        self.assertIsNone(cache.get(f"{KPI_KEY}:lock"))
+
+    def test_cold_cache_without_the_lock_gets_a_placeholder(self):
+        cache.add(f"{KPI_KEY}:lock", 1)
+        with self.compute(kpi_users=3) as compute:
+            data = get_kpis()
+        compute.assert_not_called()
+        self.assertTrue(data["kpi_pending"])
+        self.assertNotIn("kpi_users", data)
+        self.assertIsNone(cache.get(KPI_KEY))
+
+    def test_dashboard_renders_the_placeholder(self):
+        cache.add(f"{KPI_KEY}:lock", 1)
+        self.client.force_login(get_user_model().objects.create_superuser("root"))
+        response = self.client.get(reverse("admin:index"))
+        self.assertContains(response, "Metrics are being calculated")
+
+    def test_money_is_hidden_from_staff(self):
+        User = get_user_model()
+        staff = User.objects.create_user("staff", is_staff=True)
+        admin = User.objects.create_superuser("root")
+        data = {"kpi_users": 2, **dict.fromkeys(MONEY_KEYS, 5)}
+        with self.compute(**data):
+            for user, visible in ((staff, False), (admin, True)):
+                request = RequestFactory().get("/admin/")
+                request.user = user
+                context = dashboard_callback(request, {})
+                self.assertEqual(all(key in context for key in MONEY_KEYS), visible)
+                self.assertEqual(context["kpi_users"], 2)
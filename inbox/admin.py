@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Thread, Message
+from .models import ArchivedMessage, Thread, Message
+from .utils import recount_unread
 
 class MessageInline(admin.TabularInline):
     model = Message
@@ -7,16 +8,59 @@ class MessageInline(admin.TabularInline):
     readonly_fields = ("sender_type", "sender_user", "body", "is_read", "created_at")
     can_delete = False
 
+class RecountOnDeleteMixin:
+    """Borrar mensajes (o hilos, en cascada) descuadra los no leídos: se recalculan después."""
+    user_field = "user_id"
+
+    def _user_ids(self, queryset) -> set:
+        return set(queryset.values_list(self.user_field, flat=True))
+
+    def delete_model(self, request, obj):
+        user_ids = self._user_ids(type(obj).objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        recount_unread(user_ids)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = self._user_ids(queryset)
+        super().delete_queryset(request, queryset)
+        recount_unread(user_ids)
+
 @admin.register(Thread)
-class ThreadAdmin(admin.ModelAdmin):
-    list_display = ("order", "user", "subject", "last_message_at", "updated_at")
+class ThreadAdmin(RecountOnDeleteMixin, admin.ModelAdmin):
+    list_display = ("order", "user", "subject", "unread_count", "has_archived", "last_message_at", "updated_at")
     search_fields = ("order__number", "user__username", "user__email", "subject")
-    readonly_fields = ("created_at", "updated_at", "last_message_at")
+    readonly_fields = ("created_at", "updated_at", "last_message_at", "unread_count", "has_archived")
     inlines = [MessageInline]
+    actions = ["recount_unread"]
+
+    @admin.action(description="Recalcular no leídos de los usuarios seleccionados")
+    def recount_unread(self, request, queryset):
+        user_ids = set(queryset.values_list("user_id", flat=True))
+        recount_unread(user_ids)
+        self.message_user(request, f"Contadores recalculados para {len(user_ids)} usuario(s).")
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(RecountOnDeleteMixin, admin.ModelAdmin):
     list_display = ("thread", "sender_type", "sender_user", "is_read", "created_at")
     list_filter = ("sender_type", "is_read")
     search_fields = ("thread__order__number", "body")
-    readonly_fields = ("created_at",)
+    # is_read solo cambia por las vistas: llevan los contadores de no leídos con F()
+    readonly_fields = ("is_read", "created_at")
+    user_field = "thread__user_id"
+
+    def get_readonly_fields(self, request, obj=None):
+        # El alta (Message.save) suma al contador; mover de hilo o cambiar sender_type después no
+        if obj is not None:
+            return (*self.readonly_fields, "thread", "sender_type")
+        return self.readonly_fields
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ("thread", "sender_type", "sender_user", "created_at", "archived_at")
+    list_filter = ("sender_type",)
+    search_fields = ("thread__order__number",)
+    readonly_fields = [f.name for f in ArchivedMessage._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
@@ -1,12 +1,22 @@
-from .models import Message 
+from django.conf import settings
+
+from .models import UnreadCounter
 
 
 def inbox_unread(request):
-    if not request.user.is_authenticated:
-        return {}
-
-    count = Message.objects.filter(
-        thread__user=request.user,
-        is_read=False,
-    ).exclude(sender_type="user").count()
-    return {"inbox_unread_count": count}
+    """
+    Perezoso: la plantilla llama al callable solo si usa inbox_unread_count,
+    y el valor sale del contador desnormalizado (cacheado), no de un COUNT.
+    """
+    memo = []
+
+    def count():
+        if not memo:
+            user = request.user
+            memo.append(UnreadCounter.get_for(user.pk) if user.is_authenticated else 0)
+        return memo[0]
+
+    return {
+        "inbox_unread_count": count,
+        "inbox_stream": getattr(settings, "INBOX_STREAM", False),
+    }
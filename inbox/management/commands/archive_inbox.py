@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inbox.utils import ARCHIVE_CHUNK, archivable_messages, archive_messages
+from orders.models import Order
+
+CLOSED_STATUSES = (Order.PAID, Order.CANCELLED, Order.REFUNDED)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve a la tabla de archivo los mensajes del inbox más antiguos que la retención "
+        "(INBOX_RETENTION_DAYS) de pedidos pagados o cerrados, ya leídos, por bloques cortos. "
+        "thread_detail los sigue mostrando. Pensado para cron (p. ej. diario)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="Retención en días (por defecto INBOX_RETENTION_DAYS).")
+        parser.add_argument("--chunk", type=int, default=ARCHIVE_CHUNK, help="Mensajes por transacción.")
+        parser.add_argument("--pause", type=float, default=0.1, help="Segundos de pausa entre bloques.")
+        parser.add_argument("--limit", type=int, default=None, help="Máximo de mensajes a mover en esta ejecución.")
+        parser.add_argument("--statuses", default=",".join(CLOSED_STATUSES),
+                            help="Estados de pedido archivables, separados por comas.")
+        parser.add_argument("--dry-run", action="store_true", help="Solo cuenta los candidatos.")
+
+    def handle(self, *args, **opts):
+        days = opts["days"] if opts["days"] is not None else int(getattr(settings, "INBOX_RETENTION_DAYS", 365))
+        if days < 1 or opts["chunk"] < 1:
+            raise CommandError("--days y --chunk deben ser >= 1")
+        statuses = [s.strip() for s in opts["statuses"].split(",") if s.strip()]
+        valid = {value for value, _ in Order.STATUS_CHOICES}
+        if not statuses or set(statuses) - valid:
+            raise CommandError(f"Estados no válidos: {sorted(set(statuses) - valid) or '(vacío)'}")
+        cutoff = timezone.now() - timedelta(days=days)
+
+        if opts["dry_run"]:
+            n = archivable_messages(cutoff, statuses).count()
+            self.stdout.write(f"{n} mensajes anteriores a {cutoff:%Y-%m-%d} se archivarían.")
+            return
+
+        self.stdout.write(f"Archivando mensajes anteriores a {cutoff:%Y-%m-%d} ({', '.join(statuses)})…")
+        stats = archive_messages(
+            cutoff, statuses,
+            chunk=opts["chunk"], pause=opts["pause"], limit=opts["limit"],
+            log=self.stdout.write if opts["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['messages']} mensajes archivados en {stats['chunks']} bloques "
+            f"({stats['threads']} hilos con archivo nuevo)."
+        ))
@@ -0,0 +1,53 @@
+from django.db import migrations, transaction
+from django.db.models import Count, Sum
+
+CHUNK = 500
+
+
+def backfill(apps, schema_editor):
+    """Calcula Thread.unread_count y UnreadCounter a partir de Message, por rangos de pk."""
+    Thread = apps.get_model("inbox", "Thread")
+    Message = apps.get_model("inbox", "Message")
+    UnreadCounter = apps.get_model("inbox", "UnreadCounter")
+    alias = schema_editor.connection.alias
+
+    last_pk = 0
+    while True:
+        threads = list(Thread.objects.filter(pk__gt=last_pk).order_by("pk").only("pk")[:CHUNK])
+        if not threads:
+            break
+        last_pk = threads[-1].pk
+        counts = dict(
+            Message.objects
+            .filter(thread_id__in=[t.pk for t in threads], is_read=False)
+            .exclude(sender_type="user")
+            .values_list("thread_id")
+            .annotate(n=Count("id"))
+        )
+        for t in threads:
+            t.unread_count = counts.get(t.pk, 0)
+        with transaction.atomic(using=alias):
+            Thread.objects.bulk_update(threads, ["unread_count"])
+
+    totals = (
+        Thread.objects.filter(unread_count__gt=0)
+        .values_list("user_id")
+        .annotate(n=Sum("unread_count"))
+    )
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=user_id, unread=n) for user_id, n in totals],
+        batch_size=CHUNK,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("inbox", "0002_unread_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
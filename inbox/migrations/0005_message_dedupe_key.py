@@ -0,0 +1,71 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:04
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+CHUNK = 500
+TXID_RE = re.compile(r"TXID:\s*(\S+)")
+CONFIRMED_PREFIX = "Pago confirmado para el pedido"
+
+
+def backfill(apps, schema_editor):
+    """
+    Claves para los mensajes de pago confirmado ya existentes, las mismas que usa la
+    señal (el primero de cada hilo; repeticiones antiguas quedan sin clave):
+    - con "TXID:" en el cuerpo → txid:<txid>;
+    - sin txid → payment:<pk> del pago del pedido del hilo (Order.payment). Si el
+      pago ya no existe, el mensaje queda sin clave.
+    """
+    Message = apps.get_model("inbox", "Message")
+    alias = schema_editor.connection.alias
+    seen = set()
+
+    last_pk = 0
+    while True:
+        rows = list(
+            Message.objects.filter(pk__gt=last_pk, sender_type="system", body__startswith=CONFIRMED_PREFIX)
+            .order_by("pk").values("pk", "thread_id", "body", "thread__order__payment__pk")[:CHUNK]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1]["pk"]
+        changed = []
+        for row in rows:
+            match = TXID_RE.search(row["body"])
+            payment_pk = row["thread__order__payment__pk"]
+            if match:
+                key = f"txid:{match.group(1)}"[:160]
+            elif payment_pk is not None:
+                key = f"payment:{payment_pk}"
+            else:
+                continue
+            if (row["thread_id"], key) not in seen:
+                seen.add((row["thread_id"], key))
+                changed.append(Message(pk=row["pk"], dedupe_key=key))
+        with transaction.atomic(using=alias):
+            Message.objects.bulk_update(changed, ["dedupe_key"])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('inbox', '0004_message_indexes'),
+        ('pi_payments', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='dedupe_key',
+            field=models.CharField(blank=True, max_length=160, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('thread', 'dedupe_key'), name='uniq_inbox_msg_thread_dedupe'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_last_message_at(apps, schema_editor):
+    """Los hilos sin mensajes pasan a ordenarse por su fecha de creación (el cursor no admite NULL)."""
+    Thread = apps.get_model("inbox", "Thread")
+    Thread.objects.filter(last_message_at__isnull=True).update(last_message_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0005_message_dedupe_key'),
+        ('orders', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='thread',
+            options={'ordering': ('-last_message_at', '-id')},
+        ),
+        migrations.RunPython(fill_last_message_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='inbox_thread_user_last_idx'),
+        ),
+    ]
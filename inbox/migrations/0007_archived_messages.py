@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0006_thread_list_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='has_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sender_type', models.CharField(choices=[('system', 'System'), ('user', 'User'), ('admin', 'Admin')], max_length=12)),
+                ('body', models.TextField()),
+                ('is_read', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField()),
+                ('dedupe_key', models.CharField(blank=True, max_length=160, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('sender_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='inbox.thread')),
+            ],
+            options={
+                'ordering': ('created_at',),
+                'indexes': [models.Index(fields=['thread', 'created_at', 'id'], name='inbox_arch_thread_created_idx')],
+            },
+        ),
+    ]
@@ -1,7 +1,27 @@
+from collections import defaultdict
+
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Coalesce, Greatest
 from django.utils import timezone
 
+from .notify import notifier
+
+UNREAD_CACHE_TTL = 300
+# Con LocMemCache (sin CACHE_URL) la invalidación on_commit solo llega al proceso que
+# escribe: los demás ven un contador viejo como mucho estos segundos
+UNREAD_LOCAL_TTL = 5
+
+
+def _unread_cache_ttl() -> int:
+    return UNREAD_CACHE_TTL if getattr(settings, "SHARED_CACHE", False) else UNREAD_LOCAL_TTL
+
+
+def _unread_cache_key(user_id) -> str:
+    return f"inbox_unread:{user_id}"
+
 class Thread(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="inbox_threads")
     order = models.OneToOneField("orders.Order", on_delete=models.CASCADE, related_name="inbox_thread")
@@ -9,17 +29,116 @@ class Thread(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     last_message_at = models.DateTimeField(null=True, blank=True)
+    # Mensajes no leídos que no envió el propio usuario (desnormalizado, ver UnreadCounter)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Tiene mensajes movidos a ArchivedMessage (archive_inbox): solo entonces se consulta el archivo
+    has_archived = models.BooleanField(default=False)
 
     class Meta:
-        ordering = ("-last_message_at", "-updated_at", "-id")
+        ordering = ("-last_message_at", "-id")
+        indexes = [
+            # listado del inbox (cursor por last_message_at, id)
+            models.Index(fields=["user", "-last_message_at", "-id"], name="inbox_thread_user_last_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.subject or f"Inbox · Pedido {self.order.number}"
 
+    def save(self, *args, **kwargs):
+        # El listado pagina por (last_message_at, id): nunca NULL
+        if self.last_message_at is None:
+            self.last_message_at = timezone.now()
+        super().save(*args, **kwargs)
+
     def touch(self, when=None):
         self.last_message_at = when or timezone.now()
         self.save(update_fields=["last_message_at", "updated_at"])
 
+    @classmethod
+    def register_messages(cls, unread_by_thread: dict[int, int], when) -> None:
+        """
+        Refleja mensajes recién insertados: last_message_at = max(actual, when) y
+        unread_count += n, con un UPDATE por cada n distinto (normalmente uno).
+        """
+        by_n = defaultdict(list)
+        for pk, n in unread_by_thread.items():
+            by_n[n].append(pk)
+        last = Greatest(Coalesce(F("last_message_at"), Value(when)), Value(when))
+        for n, pks in by_n.items():
+            fields = {"last_message_at": last, "updated_at": timezone.now()}
+            if n:
+                fields["unread_count"] = F("unread_count") + n
+            cls.objects.filter(pk__in=pks).update(**fields)
+
+    def mark_read(self, upto_id: int | None = None) -> int:
+        """
+        Marca como leídos los mensajes de admin/sistema (hasta upto_id, el último que
+        se ha mostrado) y ajusta los contadores. Devuelve cuántos.
+        Usa el índice (thread, is_read, sender_type): solo toca las filas no leídas.
+        """
+        if not self.unread_count:
+            return 0
+        qs = Message.objects.filter(
+            thread=self, is_read=False,
+            sender_type__in=[Message.SENDER_SYSTEM, Message.SENDER_ADMIN],
+        )
+        if upto_id is not None:
+            qs = qs.filter(id__lte=upto_id)
+        with transaction.atomic():
+            n = qs.update(is_read=True)
+            if n:
+                Thread.objects.filter(pk=self.pk).update(unread_count=Greatest(F("unread_count") - n, 0))
+                UnreadCounter.bump(self.user_id, -n)
+        self.unread_count = max(self.unread_count - n, 0)
+        return n
+
+
+class UnreadCounter(models.Model):
+    """Total de no leídos por usuario (suma de Thread.unread_count), para el badge del navbar."""
+    user   = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                                  primary_key=True, related_name="inbox_unread")
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.user_id}: {self.unread}"
+
+    @classmethod
+    def bump(cls, user_id, delta: int) -> None:
+        """Suma delta (puede ser negativo) con un UPDATE atómico; crea la fila si falta."""
+        if delta > 0 and not cls.objects.filter(user_id=user_id).update(unread=F("unread") + delta):
+            cls.objects.bulk_create([cls(user_id=user_id, unread=0)], ignore_conflicts=True)
+            cls.objects.filter(user_id=user_id).update(unread=F("unread") + delta)
+        elif delta < 0:
+            cls.objects.filter(user_id=user_id).update(unread=Greatest(F("unread") + delta, 0))
+        transaction.on_commit(lambda: cache.delete(_unread_cache_key(user_id)))
+
+    @classmethod
+    def bump_many(cls, deltas: dict[int, int]) -> None:
+        """Como bump() para varios usuarios (deltas positivos): un UPDATE por delta distinto."""
+        deltas = {uid: d for uid, d in deltas.items() if d > 0}
+        if not deltas:
+            return
+        by_delta = defaultdict(list)
+        for uid, d in deltas.items():
+            by_delta[d].append(uid)
+        for d, uids in by_delta.items():
+            if cls.objects.filter(user_id__in=uids).update(unread=F("unread") + d) < len(uids):
+                # Faltaban filas: se crean a 0 y se suma solo a esas
+                missing = set(uids) - set(cls.objects.filter(user_id__in=uids).values_list("user_id", flat=True))
+                cls.objects.bulk_create([cls(user_id=uid, unread=0) for uid in missing], ignore_conflicts=True)
+                cls.objects.filter(user_id__in=missing).update(unread=F("unread") + d)
+        keys = [_unread_cache_key(uid) for uid in deltas]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    @classmethod
+    def get_for(cls, user_id) -> int:
+        key = _unread_cache_key(user_id)
+        value = cache.get(key)
+        if value is None:
+            value = cls.objects.filter(user_id=user_id).values_list("unread", flat=True).first() or 0
+            cache.set(key, value, _unread_cache_ttl())
+        return value
+
 
 class Message(models.Model):
     SENDER_SYSTEM = "system"
@@ -37,15 +156,168 @@ class Message(models.Model):
     body = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Idempotencia de mensajes automáticos (p. ej. "txid:<txid>"); único por hilo, NULL = sin clave
+    dedupe_key = models.CharField(max_length=160, null=True, blank=True)
 
     class Meta:
         ordering = ("created_at",)
+        constraints = [
+            models.UniqueConstraint(fields=["thread", "dedupe_key"], name="uniq_inbox_msg_thread_dedupe"),
+        ]
+        indexes = [
+            # páginas de la conversación (cursor por created_at, id)
+            models.Index(fields=["thread", "created_at", "id"], name="inbox_msg_thread_created_idx"),
+            # marcar como leído / contar no leídos
+            models.Index(fields=["thread", "is_read", "sender_type"], name="inbox_msg_thread_unread_idx"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.get_sender_type_display()} · {self.created_at:%Y-%m-%d %H:%M}"  # type: ignore[attr-defined]
 
 
+    @property
+    def counts_as_unread(self) -> bool:
+        return not self.is_read and self.sender_type != self.SENDER_USER
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Usa el objeto relacionado directamente; nada de pk=self.thread_id
-        self.thread.touch(self.created_at)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # Alta: INSERT + un único UPDATE del hilo (+ el contador del usuario si cuenta como no leído)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._after_insert([self])
+
+    @classmethod
+    def post_once(cls, dedupe_key: str, **fields) -> "Message | None":
+        """
+        INSERT-or-ignore por (thread, dedupe_key): crea el mensaje o devuelve None si
+        ya existía. No hay SELECT previo: decide el índice único en el propio INSERT.
+        """
+        try:
+            with transaction.atomic():
+                return cls.objects.create(dedupe_key=dedupe_key, **fields)
+        except IntegrityError:
+            thread = fields.get("thread") or fields.get("thread_id")
+            if cls.objects.filter(thread=thread, dedupe_key=dedupe_key).exists():
+                return None
+            raise
+
+    @classmethod
+    def post_many(cls, messages, batch_size: int = 500) -> list["Message"]:
+        """
+        Alta en bloque (p. ej. mensajes de sistema): bulk_create sin save() por fila y
+        los hilos/contadores actualizados en conjunto, todo en una transacción.
+        """
+        messages = list(messages)
+        if not messages:
+            return messages
+        with transaction.atomic():
+            cls.objects.bulk_create(messages, batch_size=batch_size)
+            cls._after_insert(messages)
+        return messages
+
+    @classmethod
+    def broadcast(cls, threads: dict[int, int], body: str, dedupe_key: str | None = None) -> int:
+        """
+        El mismo mensaje de sistema a muchos hilos ({thread_id: user_id}): un único
+        INSERT … SELECT (sin instanciar modelos ni compilar N filas) más los UPDATE
+        por conjuntos de hilos y contadores. Devuelve cuántos mensajes creó.
+        """
+        if not threads:
+            return 0
+        when = timezone.now()
+        qn = connection.ops.quote_name
+        values = {
+            "sender_type": cls.SENDER_SYSTEM, "body": body, "is_read": False,
+            "created_at": when, "dedupe_key": dedupe_key,
+        }
+        select_sql, params = cls._broadcast_select(list(threads), values, connection)
+        columns = [cls._meta.get_field(name).column for name in ("thread", *values)]
+        sql = f"INSERT INTO {qn(cls._meta.db_table)} ({', '.join(qn(c) for c in columns)}) {select_sql}"
+        unread_by_user: dict[int, int] = defaultdict(int)
+        for user_id in threads.values():
+            unread_by_user[user_id] += 1
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+            cls._register_new(dict.fromkeys(threads, 1), unread_by_user, when)
+        return len(threads)
+
+    @classmethod
+    def _broadcast_select(cls, thread_ids: list[int], values: dict, conn) -> tuple[str, tuple]:
+        """SELECT (thread_id, constantes…) del INSERT de broadcast(), compilado por el ORM para `conn`."""
+        def constant(name, value):
+            field = cls._meta.get_field(name)
+            if conn.vendor == "postgresql":
+                # Postgres no deduce el tipo de un parámetro suelto en la lista del SELECT
+                return Cast(Value(value, output_field=field), output_field=field)
+            if isinstance(value, bool):
+                # MySQL no admite CAST(… AS bool): 0/1 sirve para su BOOL (tinyint) y para SQLite
+                return Value(int(value), output_field=models.IntegerField())
+            # Sin CAST: en SQLite el de fechas perdería los microsegundos
+            return Value(value, output_field=field)
+
+        select = (
+            Thread.objects.filter(pk__in=thread_ids).order_by()
+            .annotate(**{f"_{name}": constant(name, value) for name, value in values.items()})
+            .values_list("pk", *(f"_{name}" for name in values))
+        )
+        return select.query.get_compiler(connection=conn).as_sql()
+
+    @classmethod
+    def _after_insert(cls, messages: list["Message"]) -> None:
+        missing = {m.thread_id for m in messages if not cls.thread.is_cached(m)}
+        owners = dict(Thread.objects.filter(pk__in=missing).values_list("pk", "user_id")) if missing else {}
+
+        unread_by_thread: dict[int, int] = {}
+        unread_by_user: dict[int, int] = defaultdict(int)
+        for m in messages:
+            user_id = m.thread.user_id if cls.thread.is_cached(m) else owners[m.thread_id]
+            n = 1 if m.counts_as_unread else 0
+            unread_by_thread[m.thread_id] = unread_by_thread.get(m.thread_id, 0) + n
+            unread_by_user[user_id] += n
+        when = max(m.created_at for m in messages)
+        cls._register_new(unread_by_thread, unread_by_user, when)
+
+        # Mantiene coherentes los Thread ya cargados (p. ej. el de la vista)
+        for t in {id(m.thread): m.thread for m in messages if cls.thread.is_cached(m)}.values():
+            t.last_message_at = max(t.last_message_at or when, when)
+            t.unread_count += unread_by_thread.get(t.pk, 0)
+
+    @staticmethod
+    def _register_new(unread_by_thread: dict[int, int], unread_by_user: dict[int, int], when) -> None:
+        Thread.register_messages(unread_by_thread, when)
+        UnreadCounter.bump_many(unread_by_user)
+        # Despierta los streams abiertos de este proceso (los demás lo verán al sondear)
+        user_ids = set(unread_by_user)
+        transaction.on_commit(lambda: notifier.publish(user_ids))
+
+
+class ArchivedMessage(models.Model):
+    """
+    Mensajes antiguos y ya leídos de pedidos cerrados, movidos por `manage.py archive_inbox`
+    para que la tabla caliente (Message) no crezca sin fin. Conserva el id original;
+    thread_detail los mezcla de forma transparente si Thread.has_archived.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="archived_messages")
+    sender_type = models.CharField(max_length=12, choices=Message.SENDER_CHOICES)
+    sender_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    body = models.TextField()
+    is_read = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    dedupe_key = models.CharField(max_length=160, null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Columnas que se copian tal cual desde Message
+    COPY_FIELDS = ("id", "thread", "sender_type", "sender_user", "body", "is_read", "created_at", "dedupe_key")
+
+    class Meta:
+        ordering = ("created_at",)
+        indexes = [
+            models.Index(fields=["thread", "created_at", "id"], name="inbox_arch_thread_created_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_sender_type_display()} · {self.created_at:%Y-%m-%d %H:%M}"  # type: ignore[attr-defined]
+
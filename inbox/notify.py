@@ -0,0 +1,121 @@
+"""
+Aviso en proceso de mensajes nuevos para el stream del inbox (views.stream).
+
+- Cada conexión abierta se suscribe por user_id con un asyncio.Event de su bucle;
+  mientras espera no consume nada (ni hilo ni consulta).
+- Message.save publica en on_commit: despierta las conexiones de ese usuario en
+  este proceso (call_soon_threadsafe, porque save corre en otro hilo).
+- Mensajes creados en otro proceso (worker de eventos, otro worker web…): un único
+  hilo por proceso, vivo solo mientras haya suscriptores, consulta cada
+  INBOX_POLL_INTERVAL s los ids nuevos y despierta a sus destinatarios. Es una
+  consulta por proceso, no una por conexión.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Iterable
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Max
+
+log = logging.getLogger(__name__)
+
+POLL_BATCH = 1000
+
+
+class Notifier:
+    def __init__(self):
+        self._subs: dict[int, dict[asyncio.Event, asyncio.AbstractEventLoop]] = {}
+        self._lock = threading.Lock()
+        self._poller: threading.Thread | None = None
+        self._pid: int | None = None
+        self._last_id: int | None = None
+
+    # ---------- conexiones (bucle asyncio) ----------
+    def subscribe(self, user_id: int) -> asyncio.Event:
+        """
+        Registra una conexión (sin tocar la BD). Suscribirse antes de leer desde qué id
+        servir evita perder mensajes creados entre medias.
+        """
+        ev = asyncio.Event()
+        with self._lock:
+            self._subs.setdefault(user_id, {})[ev] = asyncio.get_running_loop()
+            self._ensure_poller()
+        return ev
+
+    def unsubscribe(self, user_id: int, ev: asyncio.Event) -> None:
+        with self._lock:
+            subs = self._subs.get(user_id)
+            if subs is not None:
+                subs.pop(ev, None)
+                if not subs:
+                    del self._subs[user_id]
+
+    # ---------- productores (cualquier hilo) ----------
+    def publish(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            targets = [item for uid in set(user_ids) for item in self._subs.get(uid, {}).items()]
+        for ev, loop in targets:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass  # bucle ya cerrado
+
+    # ---------- respaldo: sondeo de la BD ----------
+    def _ensure_poller(self) -> None:
+        # Con el lock tomado. Tras un fork el hilo del padre no existe en el hijo.
+        if self._poller is not None and self._pid == os.getpid():
+            return
+        self._last_id = None  # lo fija el primer sondeo del hilo
+        self._pid = os.getpid()
+        self._poller = threading.Thread(target=self._poll_loop, name="inbox-notify", daemon=True)
+        self._poller.start()
+
+    def _poll_loop(self) -> None:
+        interval = float(getattr(settings, "INBOX_POLL_INTERVAL", 2))
+        try:
+            try:
+                self.poll_once()  # fija el punto de partida cuanto antes
+            except Exception:
+                log.exception("inbox: fallo sondeando mensajes nuevos")
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    if not self._subs:
+                        self._poller = None
+                        return
+                try:
+                    self.poll_once()
+                except Exception:
+                    log.exception("inbox: fallo sondeando mensajes nuevos")
+        finally:
+            connection.close()
+
+    def poll_once(self) -> None:
+        from .models import Message
+
+        close_old_connections()
+        if self._last_id is None:
+            # Arranque del hilo: un único Max(id) por proceso (no por conexión). Despierta a
+            # todos para que relean lo creado entre su conexión y este punto de partida.
+            self._last_id = Message.objects.aggregate(m=Max("id"))["m"] or 0
+            with self._lock:
+                user_ids = list(self._subs)
+            self.publish(user_ids)
+            return
+        rows = list(
+            Message.objects.filter(id__gt=self._last_id or 0)
+            .order_by("id")
+            .values_list("id", "thread__user_id")[:POLL_BATCH]
+        )
+        if rows:
+            self._last_id = rows[-1][0]
+            self.publish(uid for _, uid in rows)
+
+
+notifier = Notifier()
@@ -1,21 +1,20 @@
-from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
 from pi_payments.models import Payment
+from pi_payments.signals import payment_transitioned
 from .models import Thread, Message
 
 def _safe_get_txid(payment: Payment) -> str | None:
-    raw = payment.raw_payload or {}
-    return raw.get("txid") or (raw.get("transaction") or {}).get("txid")
+    return payment.txid or None
 
-@receiver(post_save, sender=Payment)
-def on_payment_confirmed_create_thread_message(sender, instance: Payment, created, **kwargs):
-    # Solo cuando está confirmado
-    if instance.status != Payment.CONFIRMED:
+@receiver(payment_transitioned, sender=Payment)
+def on_payment_confirmed_create_thread_message(sender, payment: Payment, status: str, **kwargs):
+    # Solo en la transición a confirmado (no en cada save del Payment)
+    if status != Payment.CONFIRMED:
         return
 
-    order = instance.order
+    order = payment.order
     # Hilo para ese pedido (uno a uno)
     thread, _ = Thread.objects.get_or_create(
         order=order,
@@ -26,22 +25,14 @@ def on_payment_confirmed_create_thread_message(sender, instance: Payment, create
         },
     )
 
-    # Idempotencia por txid (o por “marca” si no hay txid)
-    txid = _safe_get_txid(instance)
+    # Idempotencia por txid (o por pago si no hay txid): índice único (thread, dedupe_key)
+    txid = _safe_get_txid(payment)
     body = f"Pago confirmado para el pedido {order.number}."
     if txid:
         body = f"{body} TXID: {txid}"
 
-    # Si ya existe un mensaje de sistema con ese txid (o mismo cuerpo), no duplicamos
-    exists = Message.objects.filter(
-        thread=thread,
-        sender_type=Message.SENDER_SYSTEM,
-        body__icontains=(txid or body) 
-    ).exists()
-    if exists:
-        return
-
-    Message.objects.create(
+    Message.post_once(
+        f"txid:{txid}" if txid else f"payment:{payment.pk}",
         thread=thread,
         sender_type=Message.SENDER_SYSTEM,
         body=body,
@@ -1,3 +1,326 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from orders.models import Order
+from pi_payments.models import Payment
+
+from .models import ArchivedMessage, Message, Thread, UnreadCounter
+from .utils import archive_messages, broadcast_system_message, get_or_create_thread, recount_unread
+from .views import _latest_id, _message_page, _parse_cursor
+
+
+class InboxTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user("buyer")
+        self.order = self.new_order()
+        self.thread = get_or_create_thread(self.order)
+
+    def new_order(self, user=None, **fields) -> Order:
+        return Order.objects.create(user=user or self.user, total=Decimal("10.00"), **fields)
+
+    def system(self, body="hola", thread=None) -> Message:
+        return Message.objects.create(thread=thread or self.thread, sender_type=Message.SENDER_SYSTEM, body=body)
+
+
+class UnreadCounterTests(InboxTestCase):
+    def test_system_messages_bump_counters_and_user_messages_do_not(self):
+        self.system()
+        self.system()
+        Message.objects.create(thread=self.thread, sender_type=Message.SENDER_USER, sender_user=self.user, body="yo")
+
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.unread_count, 2)
+        self.assertEqual(UnreadCounter.get_for(self.user.pk), 2)
+
+    def test_mark_read_upto_id_only_reads_what_was_shown(self):
+        first = self.system()
+        self.system()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Thread.objects.get(pk=self.thread.pk).mark_read(upto_id=first.pk), 1)
+
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).unread_count, 1)
+        self.assertEqual(UnreadCounter.get_for(self.user.pk), 1)
+
+    def test_recount_repairs_drifted_counters(self):
+        self.system()
+        Thread.objects.filter(pk=self.thread.pk).update(unread_count=7)
+        UnreadCounter.objects.filter(user=self.user).update(unread=7)
+
+        recount_unread([self.user.pk])
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).unread_count, 1)
+        self.assertEqual(UnreadCounter.get_for(self.user.pk), 1)
+
+
+    @override_settings(SHARED_CACHE=False)
+    def test_local_cache_ttl_is_short(self):
+        with mock.patch("inbox.models.cache.set") as cache_set:
+            UnreadCounter.get_for(self.user.pk)
+        self.assertEqual(cache_set.call_args.args[2], 5)
+
+
+class AdminTests(InboxTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        self.admin = site._registry[Message]
+
+    def test_counters_cannot_be_edited_on_an_existing_message(self):
+        msg = self.system()
+        readonly = self.admin.get_readonly_fields(self.request, msg)
+        for field in ("is_read", "thread", "sender_type"):
+            self.assertIn(field, readonly)
+        self.assertNotIn("sender_type", self.admin.get_readonly_fields(self.request))
+
+    def test_delete_recounts_unread(self):
+        one, two = self.system(), self.system()
+        self.admin.delete_model(self.request, one)
+        self.assertEqual(UnreadCounter.get_for(self.user.pk), 1)
+
+        self.admin.delete_queryset(self.request, Message.objects.filter(pk=two.pk))
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).unread_count, 0)
+        self.assertEqual(UnreadCounter.get_for(self.user.pk), 0)
+
+
+@override_settings(INBOX_PAGE_SIZE=2)
+class ThreadPaginationTests(InboxTestCase):
+    def test_detail_shows_last_page_and_older_walks_back(self):
+        for i in range(5):
+            self.system(f"m{i}")
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("inbox:thread_detail", args=[self.thread.pk]))
+        self.assertEqual([m.body for m in response.context["thread_messages"]], ["m3", "m4"])
+        # Marca leído hasta el último mensaje mostrado
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).unread_count, 0)
+
+        pages, cursor = [], response.context["older_cursor"]
+        while cursor:
+            response = self.client.get(reverse("inbox:thread_older", args=[self.thread.pk]), {"before": cursor})
+            pages.insert(0, [m.body for m in response.context["thread_messages"]])
+            cursor = response.context["older_cursor"]
+        self.assertEqual(pages, [["m0"], ["m1", "m2"]])
+
+    def test_older_requires_a_valid_cursor_and_own_thread(self):
+        self.client.force_login(self.user)
+        url = reverse("inbox:thread_older", args=[self.thread.pk])
+        self.assertEqual(self.client.get(url, {"before": "x"}).status_code, 400)
+
+        other = get_user_model().objects.create_user("other")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url, {"before": "x"}).status_code, 404)
+
+
+class RealtimeTests(InboxTestCase):
+    def test_latest_id_is_scoped_to_the_user(self):
+        mine = self.system()
+        other = get_user_model().objects.create_user("other")
+        self.system(thread=get_or_create_thread(self.new_order(other)))
+
+        self.assertEqual(_latest_id(self.user.pk), mine.pk)
+
+    def test_poll_over_wsgi_is_refused(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("inbox:poll")).status_code, 503)
+
+    @mock.patch("inbox.notify.notifier._ensure_poller")  # sin hilo de sondeo contra la BD de test
+    async def test_poll_over_asgi_returns_new_messages(self, _poller):
+        msg = await sync_to_async(self.system)("hola")
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get(reverse("inbox:poll"), {"after": msg.pk - 1})
+        data = response.json()
+        self.assertEqual(([m["id"] for m in data["messages"]], data["after"]), ([msg.pk], msg.pk))
+
+
+class ThreadTouchTests(InboxTestCase):
+    def test_new_message_updates_the_thread_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            msg = self.system()
+        updates = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('UPDATE "inbox_thread"')]
+        self.assertEqual(len(updates), 1)
+
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertEqual((thread.last_message_at, thread.unread_count), (msg.created_at, 1))
+        # El Thread cargado en memoria queda coherente sin releerlo
+        self.assertEqual((self.thread.last_message_at, self.thread.unread_count), (msg.created_at, 1))
+
+
+class DedupeTests(InboxTestCase):
+    def test_post_once_ignores_a_repeated_key(self):
+        fields = {"thread": self.thread, "sender_type": Message.SENDER_SYSTEM, "body": "x"}
+        self.assertIsNotNone(Message.post_once("k", **fields))
+        self.assertIsNone(Message.post_once("k", **fields))
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).unread_count, 1)
+
+    def test_confirmed_payment_posts_one_message(self):
+        pay = Payment.objects.create(order=self.order, amount=self.order.total, nonce="n1", provider_payment_id="p1")
+        with self.captureOnCommitCallbacks(execute=True):
+            pay.mark_confirmed(txid="tx1")
+        # Una segunda confirmación (webhook repetido) ya no transiciona ni publica
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.get(pk=pay.pk).mark_confirmed(txid="tx1")
+
+        self.assertEqual(list(self.thread.messages.values_list("dedupe_key", flat=True)), ["txid:tx1"])
+
+
+class BackfillDedupeKeyTests(TransactionTestCase):
+    """0005 da a los avisos de pago existentes la clave que usa la señal (txid o pago)."""
+
+    before = [("inbox", "0004_message_indexes"), ("pi_payments", "0001_initial")]
+    after = [("inbox", "0005_message_dedupe_key"), ("pi_payments", "0001_initial")]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.addCleanup(self._migrate_to_latest)
+
+    def _migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_keys_come_from_the_txid_or_the_linked_payment(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        user = apps.get_model(settings.AUTH_USER_MODEL).objects.create(username="buyer")
+        Order = apps.get_model("orders", "Order")
+        Thread = apps.get_model("inbox", "Thread")
+        Message = apps.get_model("inbox", "Message")
+        Payment = apps.get_model("pi_payments", "Payment")
+
+        def confirmed_thread(n, body):
+            order = Order.objects.create(user_id=user.pk)
+            thread = Thread.objects.create(user_id=user.pk, order=order)
+            msgs = [Message.objects.create(thread=thread, sender_type="system", body=body) for _ in range(n)]
+            return order, msgs
+
+        _, (with_txid, repeated) = confirmed_thread(2, "Pago confirmado para el pedido A. TXID: tx1")
+        order, (without_txid,) = confirmed_thread(1, "Pago confirmado para el pedido B.")
+        pay = Payment.objects.create(order=order, nonce="b")
+        _, (orphan,) = confirmed_thread(1, "Pago confirmado para el pedido C.")
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        Message = executor.loader.project_state(self.after).apps.get_model("inbox", "Message")
+
+        keys = dict(Message.objects.values_list("pk", "dedupe_key"))
+        self.assertEqual(keys[with_txid.pk], "txid:tx1")
+        self.assertEqual(keys[without_txid.pk], f"payment:{pay.pk}")
+        self.assertIsNone(keys[repeated.pk])
+        self.assertIsNone(keys[orphan.pk])
+
+
+@override_settings(INBOX_PAGE_SIZE=2)
+class ThreadListTests(InboxTestCase):
+    def test_thread_list_pages_by_cursor_without_gaps(self):
+        for _ in range(4):
+            self.system(thread=get_or_create_thread(self.new_order()))
+        self.client.force_login(self.user)
+
+        seen, url = [], reverse("inbox:thread_list")
+        while url:
+            response = self.client.get(url)
+            seen += [t.pk for t in response.context["threads"]]
+            cursor = response.context["older_cursor"]
+            url = f"{reverse('inbox:thread_list')}?before={cursor}" if cursor else None
+
+        expected = Thread.objects.filter(user=self.user).order_by("-last_message_at", "-id")
+        self.assertEqual(seen, list(expected.values_list("pk", flat=True)))
+
+    def test_bad_cursor_is_rejected(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("inbox:thread_list"), {"before": "x"}).status_code, 400)
+
+
+class BroadcastTests(InboxTestCase):
+    def test_broadcast_creates_threads_and_reruns_only_fill_gaps(self):
+        other = get_user_model().objects.create_user("other")
+        self.new_order(other)
+        orders = Order.objects.all()
+
+        stats = broadcast_system_message(orders, "aviso", key="k1", chunk=1)
+        self.assertEqual(stats, {"orders": 2, "threads_created": 1, "messages": 2, "skipped": 0})
+        again = broadcast_system_message(orders, "aviso", key="k1")
+        self.assertEqual((again["messages"], again["skipped"]), (0, 2))
+
+        msg = Message.objects.get(thread=self.thread)
+        self.assertEqual((msg.body, msg.dedupe_key, msg.sender_type), ("aviso", "broadcast:k1", Message.SENDER_SYSTEM))
+        self.assertFalse(msg.is_read)
+        self.assertEqual(UnreadCounter.get_for(other.pk), 1)
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).last_message_at, msg.created_at)
+
+
+class BroadcastSqlTests(SimpleTestCase):
+    """El SELECT de Message.broadcast compilado para cada backend."""
+
+    values = {"sender_type": "system", "body": "aviso", "is_read": False, "created_at": None, "dedupe_key": "k"}
+
+    def setUp(self):
+        self.values = {**self.values, "created_at": timezone.now()}
+
+    def test_mysql_has_no_casts_and_sends_booleans_as_integers(self):
+        from django.db.backends.mysql.base import DatabaseWrapper
+
+        mysql = DatabaseWrapper({**connection.settings_dict, "ENGINE": "django.db.backends.mysql"}, alias="mysql")
+        sql, params = Message._broadcast_select([1], self.values, mysql)
+        self.assertNotIn("CAST", sql)
+        self.assertIn("%s AS `_is_read`", sql)
+        self.assertIs(type(params[2]), int)
+        self.assertEqual(params[2], 0)
+
+    def test_postgresql_casts_every_constant(self):
+        # Sin psycopg aquí: dialecto Postgres (vendor) con los tipos de la conexión de test
+        with mock.patch.object(connection, "vendor", "postgresql"):
+            sql, _ = Message._broadcast_select([1], self.values, connection)
+        self.assertEqual(sql.count("(%s)::"), len(self.values))
+        self.assertIn("(%s)::bool AS", sql)
+
+    def test_sqlite_keeps_microseconds(self):
+        sql, params = Message._broadcast_select([1], self.values, connection)
+        self.assertNotIn("CAST", sql)
+        self.assertIn(f".{self.values['created_at']:%f}", params[3])
+
+
+@override_settings(INBOX_PAGE_SIZE=2)
+class ArchiveTests(InboxTestCase):
+    def test_archived_messages_are_read_back_in_order(self):
+        msgs = [self.system(f"m{i}") for i in range(5)]
+        Message.objects.update(is_read=True, created_at=timezone.now() - timedelta(days=400))
+        Order.objects.filter(pk=self.order.pk).update(status=Order.PAID)
+        Message.objects.filter(pk=msgs[4].pk).update(created_at=timezone.now())  # reciente: no se archiva
+
+        stats = archive_messages(timezone.now() - timedelta(days=365), [Order.PAID], chunk=2)
+        self.assertEqual((stats["messages"], stats["chunks"]), (4, 2))
+        self.assertEqual(ArchivedMessage.objects.count(), 4)
+
+        thread = Thread.objects.get(pk=self.thread.pk)
+        self.assertTrue(thread.has_archived)
+        pages, before = [], None
+        while True:
+            rows, before = _message_page(thread, before and _parse_cursor(before))
+            pages.insert(0, [m.body for m in rows])
+            if not before:
+                break
+        self.assertEqual(pages, [["m0"], ["m1", "m2"], ["m3", "m4"]])
+
+    def test_unread_messages_are_not_archived(self):
+        self.system()
+        Message.objects.update(created_at=timezone.now() - timedelta(days=400))
+        Order.objects.filter(pk=self.order.pk).update(status=Order.PAID)
+
+        stats = archive_messages(timezone.now() - timedelta(days=365), [Order.PAID])
+        self.assertEqual(stats["messages"], 0)
+        self.assertEqual(Message.objects.count(), 1)
@@ -6,4 +6,7 @@ app_name = "inbox"
 urlpatterns = [
     path("", views.thread_list, name="thread_list"),
     path("<int:thread_id>/", views.thread_detail, name="thread_detail"),
+    path("stream/", views.stream, name="stream"),
+    path("poll/", views.poll, name="poll"),
+    path("<int:thread_id>/older/", views.thread_older, name="thread_older"),
 ]
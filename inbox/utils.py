@@ -1,5 +1,13 @@
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q, Sum
 from django.utils import timezone
-from .models import Thread, Message
+from .models import ArchivedMessage, Thread, Message, UnreadCounter, _unread_cache_key
+
+BROADCAST_CHUNK = 2000
+ARCHIVE_CHUNK = 1000
 
 def get_or_create_thread(order) -> Thread:
     thread = getattr(order, "inbox_thread", None)
@@ -16,3 +24,139 @@ def post_system_message(order, text: str) -> Message:
         sender_user=None,
         body=text,
     )
+
+def post_system_messages(items) -> list[Message]:
+    """Versión en bloque de post_system_message: items = [(thread, texto), ...]."""
+    return Message.post_many(
+        Message(thread=thread, sender_type=Message.SENDER_SYSTEM, sender_user=None, body=text)
+        for thread, text in items
+    )
+
+def broadcast_system_message(orders, text: str, key: str | None = None, chunk: int = BROADCAST_CHUNK) -> dict:
+    """
+    Envía el mismo mensaje de sistema al hilo de cada pedido de `orders` (queryset).
+
+    Por bloques de `chunk` pedidos, cada uno en su transacción: crea con bulk_create
+    los hilos que faltan, inserta los mensajes con un INSERT … SELECT y actualiza
+    last_message_at y contadores con UPDATE por conjuntos (Message.broadcast).
+    Con `key` es idempotente (dedupe_key "broadcast:<key>"): relanzarlo tras un
+    fallo solo envía a los pedidos que faltaban.
+    """
+    dedupe_key = f"broadcast:{key}"[:160] if key else None
+    stats = {"orders": 0, "threads_created": 0, "messages": 0, "skipped": 0}
+    rows = orders.order_by("pk").values_list("pk", "user_id", "number")
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:chunk])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        stats["orders"] += len(batch)
+        with transaction.atomic():
+            threads = _ensure_threads(batch, stats)
+            if dedupe_key:
+                done = set(
+                    Message.objects.filter(thread_id__in=list(threads), dedupe_key=dedupe_key)
+                    .values_list("thread_id", flat=True)
+                )
+                stats["skipped"] += len(done)
+                threads = {pk: uid for pk, uid in threads.items() if pk not in done}
+            stats["messages"] += Message.broadcast(threads, text, dedupe_key)
+    return stats
+
+def _ensure_threads(batch, stats: dict) -> dict[int, int]:
+    """{thread_id: user_id} de los pedidos del bloque, creando en bloque los hilos que falten."""
+    order_ids = [pk for pk, _, _ in batch]
+    existing = dict(Thread.objects.filter(order_id__in=order_ids).values_list("order_id", "pk"))
+    missing = [(pk, user_id, number) for pk, user_id, number in batch if pk not in existing]
+    if missing:
+        now = timezone.now()
+        Thread.objects.bulk_create(
+            [Thread(order_id=pk, user_id=user_id, subject=f"Pedido {number}", last_message_at=now)
+             for pk, user_id, number in missing],
+            ignore_conflicts=True,  # un hilo creado a la vez por la señal de pago
+        )
+        stats["threads_created"] += len(missing)
+        existing.update(
+            Thread.objects.filter(order_id__in=[pk for pk, _, _ in missing]).values_list("order_id", "pk")
+        )
+    return {existing[pk]: user_id for pk, user_id, _ in batch}
+
+def recount_unread(user_ids) -> None:
+    """Recalcula desde Message los contadores de no leídos de esos usuarios (reparación)."""
+    user_ids = list(user_ids)
+    unread = Q(messages__is_read=False) & ~Q(messages__sender_type=Message.SENDER_USER)
+    with transaction.atomic():
+        threads = list(
+            Thread.objects.filter(user_id__in=user_ids)
+            .annotate(n=Count("messages", filter=unread))
+            .only("pk", "unread_count")
+        )
+        for t in threads:
+            t.unread_count = t.n
+        Thread.objects.bulk_update(threads, ["unread_count"], batch_size=500)
+        totals = dict(
+            Thread.objects.filter(user_id__in=user_ids)
+            .values_list("user_id").annotate(n=Sum("unread_count"))
+        )
+        UnreadCounter.objects.bulk_create(
+            [UnreadCounter(user_id=uid, unread=totals.get(uid) or 0) for uid in user_ids],
+            update_conflicts=True, unique_fields=["user"], update_fields=["unread"],
+        )
+    cache.delete_many([_unread_cache_key(uid) for uid in user_ids])
+
+def archivable_messages(cutoff, order_statuses):
+    """Mensajes anteriores a `cutoff` de pedidos en esos estados que ya no cuentan como no leídos."""
+    return (
+        Message.objects
+        .filter(created_at__lt=cutoff, thread__order__status__in=list(order_statuses))
+        .filter(Q(is_read=True) | Q(sender_type=Message.SENDER_USER))
+    )
+
+def archive_messages(cutoff, order_statuses, chunk: int = ARCHIVE_CHUNK, pause: float = 0.0,
+                     limit: int | None = None, log=None) -> dict:
+    """
+    Mueve a ArchivedMessage los mensajes de archivable_messages() por bloques de `chunk`,
+    recorriendo por pk. Cada bloque es una transacción corta (INSERT … SELECT + DELETE
+    por id + marca has_archived en sus hilos) y entre bloques se espera `pause` s para
+    no acaparar la tabla caliente ni la réplica.
+    """
+    qs = archivable_messages(cutoff, order_statuses)
+    # Cota superior por pk: lo posterior al corte nunca es candidato
+    upper = Message.objects.filter(created_at__lt=cutoff).aggregate(m=Max("id"))["m"]
+    stats = {"messages": 0, "threads": 0, "chunks": 0}
+    if upper is None:
+        return stats
+
+    qn = connection.ops.quote_name
+    fields = [ArchivedMessage._meta.get_field(name) for name in ArchivedMessage.COPY_FIELDS]
+    cols = ", ".join(qn(f.column) for f in fields)
+    archived_at = ArchivedMessage._meta.get_field("archived_at")
+
+    last_pk = 0
+    while limit is None or stats["messages"] < limit:
+        size = chunk if limit is None else min(chunk, limit - stats["messages"])
+        rows = list(qs.filter(pk__gt=last_pk, pk__lte=upper).order_by("pk").values_list("pk", "thread_id")[:size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        ids = [pk for pk, _ in rows]
+        thread_ids = {tid for _, tid in rows}
+        sql = (
+            f"INSERT INTO {qn(ArchivedMessage._meta.db_table)} ({cols}, {qn(archived_at.column)}) "
+            f"SELECT {cols}, %s FROM {qn(Message._meta.db_table)} "
+            f"WHERE {qn(Message._meta.pk.column)} IN ({', '.join(['%s'] * len(ids))})"
+        )
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [archived_at.get_db_prep_save(timezone.now(), connection), *ids])
+            Message.objects.filter(pk__in=ids).delete()
+            stats["threads"] += Thread.objects.filter(pk__in=thread_ids, has_archived=False).update(has_archived=True)
+        stats["messages"] += len(ids)
+        stats["chunks"] += 1
+        if log:
+            log(f"  bloque {stats['chunks']}: {len(ids)} mensajes (hasta id {last_pk})")
+        if pause:
+            time.sleep(pause)
+    return stats
+
@@ -1,23 +1,100 @@
 from __future__ import annotations
 
+import asyncio
+import json
+from datetime import datetime, timezone as dt_timezone
 from typing import Any
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest, HttpResponse
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.db.models.functions import Substr
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_GET, require_http_methods
 
-from .models import Thread, Message
+from .models import ArchivedMessage, Thread, Message, UnreadCounter
+from .notify import notifier
+
+STREAM_BATCH = 100
+
+
+def _page_size() -> int:
+    return int(getattr(settings, "INBOX_PAGE_SIZE", 50))
+
+
+def _cursor(ts: datetime, pk: int) -> str:
+    """Cursor opaco "<epoch µs>.<id>" de la fila más antigua mostrada."""
+    return f"{int(ts.timestamp() * 1_000_000)}.{pk}"
+
+
+def _parse_cursor(value: str) -> tuple[datetime, int] | None:
+    try:
+        us, pk = value.split(".", 1)
+        return datetime.fromtimestamp(int(us) / 1_000_000, dt_timezone.utc), int(pk)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+def _newest(qs, before: tuple[datetime, int] | None, limit: int) -> list:
+    if before:
+        ts, pk = before
+        qs = qs.filter(Q(created_at__lt=ts) | Q(created_at=ts, id__lt=pk))
+    return list(qs.select_related("sender_user").order_by("-created_at", "-id")[:limit])
+
+
+def _message_page(thread: Thread, before: tuple[datetime, int] | None = None):
+    """
+    Los N mensajes más recientes (anteriores al cursor, si lo hay) en orden cronológico,
+    más el cursor para la página anterior (None si no hay más). Usa el índice
+    (thread, created_at, id): nunca recorre la conversación entera. Si el hilo tiene
+    mensajes archivados, se mezclan con los de la tabla caliente (mismo cursor).
+    """
+    size = _page_size()
+    rows = _newest(Message.objects.filter(thread=thread), before, size + 1)
+    if thread.has_archived:
+        rows += _newest(ArchivedMessage.objects.filter(thread=thread), before, size + 1)
+        rows = sorted(rows, key=lambda m: (m.created_at, m.pk), reverse=True)[:size + 1]
+    has_older = len(rows) > size
+    rows = rows[:size][::-1]
+    return rows, (_cursor(rows[0].created_at, rows[0].pk) if has_older and rows else None)
 
 
 @login_required
 def thread_list(request: HttpRequest) -> HttpResponse:
+    """
+    Una sola consulta por página: no leídos desde la columna desnormalizada y el
+    último mensaje (extracto + remitente) con subconsultas correlacionadas sobre
+    el índice (thread, created_at, id). Cursor ?before= por (last_message_at, id).
+    """
+    last = Message.objects.filter(thread=OuterRef("pk")).order_by("-created_at", "-id")
     threads = (
         Thread.objects
         .filter(user=request.user)
         .select_related("order")
-        .order_by("-last_message_at", "-updated_at", "-id")
+        .only("id", "subject", "last_message_at", "unread_count", "order__number")
+        .annotate(
+            last_body=Subquery(last.annotate(excerpt=Substr("body", 1, 140)).values("excerpt")[:1]),
+            last_sender=Subquery(last.values("sender_type")[:1]),
+        )
+        .order_by("-last_message_at", "-id")
     )
-    return render(request, "inbox/thread_list.html", {"threads": threads})
+    before = None
+    if request.GET.get("before"):
+        before = _parse_cursor(request.GET["before"])
+        if before is None:
+            return HttpResponseBadRequest("invalid cursor")
+        ts, pk = before
+        threads = threads.filter(Q(last_message_at__lt=ts) | Q(last_message_at=ts, id__lt=pk))
+
+    size = _page_size()
+    rows = list(threads[:size + 1])
+    older_cursor = _cursor(rows[size - 1].last_message_at, rows[size - 1].pk) if len(rows) > size else None
+    return render(request, "inbox/thread_list.html", {
+        "threads": rows[:size],
+        "older_cursor": older_cursor,
+        "is_first_page": before is None,
+    })
 
 
 @login_required
@@ -37,28 +114,159 @@ def thread_detail(request: HttpRequest, thread_id: int) -> HttpResponse:
                 sender_type=Message.SENDER_USER,
                 sender_user=request.user,
                 body=body,
-            )
-            thread.touch()
+            )  # save() ya actualiza last_message_at del hilo
 
         return redirect("inbox:thread_detail", thread_id=thread.pk)
 
-    # GET: marcar como leídos (mensajes no del propio usuario)
-    Message.objects.filter(
-        thread=thread
-    ).exclude(
-        sender_type=Message.SENDER_USER
-    ).filter(
-        is_read=False
-    ).update(is_read=True)
-
-    messages_qs = (
-        Message.objects
-        .filter(thread=thread)
-        .select_related("sender_user")
-        .order_by("created_at")
-    )
+    # GET: solo la última página; marca como leído hasta el último mensaje mostrado
+    messages_page, older_cursor = _message_page(thread)
+    if messages_page:
+        thread.mark_read(upto_id=max(m.pk for m in messages_page))
 
     return render(request, "inbox/thread_detail.html", {
         "thread": thread,
-        "thread_messages": messages_qs,
+        "thread_messages": messages_page,
+        "older_cursor": older_cursor,
+    })
+
+
+@login_required
+@require_GET
+def thread_older(request: HttpRequest, thread_id: int) -> HttpResponse:
+    """Fragmento HTML con la página anterior al cursor ?before= (botón "Cargar anteriores")."""
+    thread = get_object_or_404(Thread, pk=thread_id, user=request.user)
+    before = _parse_cursor(request.GET.get("before", ""))
+    if before is None:
+        return HttpResponseBadRequest("before required")
+    messages_page, older_cursor = _message_page(thread, before)
+    return render(request, "inbox/_messages.html", {
+        "thread": thread,
+        "thread_messages": messages_page,
+        "older_cursor": older_cursor,
+    })
+
+
+# ---------- tiempo real (ASGI) ----------
+def _new_messages(user_id: int, after: int) -> tuple[list[dict[str, Any]], int | None]:
+    """Mensajes de los hilos del usuario con id > after (como mucho STREAM_BATCH) y su total de no leídos."""
+    rows = list(
+        Message.objects.filter(thread__user_id=user_id, id__gt=after)
+        .order_by("id")
+        .values("id", "thread_id", "sender_type", "body", "created_at")[:STREAM_BATCH]
+    )
+    for r in rows:
+        r["created_at"] = r["created_at"].isoformat()
+    return rows, (UnreadCounter.get_for(user_id) if rows else None)
+
+
+def _latest_id(user_id: int) -> int:
+    """Último mensaje de los hilos del usuario (no de toda la tabla)."""
+    return Message.objects.filter(thread__user_id=user_id).aggregate(m=Max("id"))["m"] or 0
+
+
+async def _connect(request: HttpRequest) -> tuple[int, int, asyncio.Event] | HttpResponse:
+    if "wsgi.version" in request.META:
+        # Bajo WSGI cada conexión abierta retendría un worker síncrono entero
+        return HttpResponse("The inbox stream requires an ASGI server.", status=503)
+    user = await request.auser()
+    raw = request.headers.get("Last-Event-ID") or request.GET.get("after") or ""
+    try:
+        after = max(int(raw), 0) if raw else None
+    except ValueError:
+        return HttpResponseBadRequest("after must be an integer")
+    wake = notifier.subscribe(user.pk)
+    if after is None:
+        try:
+            after = await sync_to_async(_latest_id)(user.pk)
+        except Exception:
+            notifier.unsubscribe(user.pk, wake)
+            raise
+    return user.pk, after, wake
+
+
+def _sse(event: str, data: Any, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@login_required
+@require_GET
+async def stream(request: HttpRequest) -> HttpResponse:
+    """
+    Server-Sent Events con los mensajes nuevos (id > ?after= o Last-Event-ID) de los
+    hilos del usuario, más un evento "unread" con el total para el badge. La conexión
+    espera en el notificador sin tocar la BD; se cierra a los INBOX_STREAM_MAX_SECONDS
+    y EventSource reconecta solo desde el último id recibido.
+    """
+    conn = await _connect(request)
+    if isinstance(conn, HttpResponse):
+        return conn
+    user_id, after, wake = conn
+    keepalive = float(getattr(settings, "INBOX_STREAM_KEEPALIVE", 25))
+    max_seconds = float(getattr(settings, "INBOX_STREAM_MAX_SECONDS", 300))
+
+    async def events():
+        nonlocal after
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_seconds
+        fetch = True
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if fetch:
+                    wake.clear()
+                    rows, unread = await sync_to_async(_new_messages)(user_id, after)
+                    for r in rows:
+                        after = r["id"]
+                        yield _sse("message", r, r["id"])
+                    if rows:
+                        yield _sse("unread", {"count": unread})
+                    if len(rows) == STREAM_BATCH:
+                        continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(wake.wait(), min(keepalive, remaining))
+                    fetch = True
+                except asyncio.TimeoutError:
+                    fetch = False
+                    yield ": ping\n\n"  # mantiene viva la conexión a través de proxies
+        finally:
+            notifier.unsubscribe(user_id, wake)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: no bufferizar
+    return response
+
+
+@login_required
+@require_GET
+async def poll(request: HttpRequest) -> HttpResponse:
+    """Long-poll para clientes sin EventSource: responde en cuanto hay mensajes nuevos o a los INBOX_STREAM_KEEPALIVE s."""
+    conn = await _connect(request)
+    if isinstance(conn, HttpResponse):
+        return conn
+    user_id, after, wake = conn
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + float(getattr(settings, "INBOX_STREAM_KEEPALIVE", 25))
+    try:
+        while True:
+            wake.clear()
+            rows, unread = await sync_to_async(_new_messages)(user_id, after)
+            remaining = deadline - loop.time()
+            if rows or remaining <= 0:
+                break
+            try:
+                # Un aviso puede no traer nada para este cliente: se vuelve a esperar
+                await asyncio.wait_for(wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+    finally:
+        notifier.unsubscribe(user_id, wake)
+    return JsonResponse({
+        "messages": rows,
+        "unread": unread,
+        "after": rows[-1]["id"] if rows else after,
     })
@@ -1,11 +1,17 @@
+import uuid
+
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from django.urls import reverse
 
 from unfold.admin import ModelAdmin
 from unfold.contrib.filters.admin import RangeDateTimeFilter
 
-from .models import Order, OrderItem
+from inbox.utils import broadcast_system_message
+
+from .models import Order, OrderDailyRollup, OrderItem
 
 
 # ---------- Inlines ----------
@@ -38,6 +44,7 @@ class OrderAdmin(ModelAdmin):
     ordering = ("-created_at",)
     list_per_page = 25
     inlines = [OrderItemInline]
+    actions = ["broadcast_inbox"]
 
     @admin.display(description="User")
     def user_link(self, obj):
@@ -58,3 +65,45 @@ class OrderAdmin(ModelAdmin):
             "<span style='padding:2px 8px;border-radius:12px;background:{};color:#fff'>{}</span>",
             color, obj.get_status_display()
         )
+
+    @admin.action(description="Enviar aviso al inbox de los pedidos seleccionados")
+    def broadcast_inbox(self, request, queryset):
+        body = (request.POST.get("body") or "").strip()
+        if request.POST.get("apply") and body:
+            stats = broadcast_system_message(queryset, body, key=request.POST.get("key") or None)
+            self.message_user(
+                request,
+                f"Aviso enviado a {stats['messages']} hilo(s) "
+                f"({stats['threads_created']} creado(s), {stats['skipped']} ya lo tenían).",
+            )
+            return None
+
+        # Paso intermedio: pedir el texto (conserva selección / "seleccionar todos")
+        return TemplateResponse(request, "admin/orders/order/broadcast_inbox.html", {
+            **self.admin_site.each_context(request),
+            "title": "Enviar aviso al inbox",
+            "opts": self.model._meta,
+            "count": queryset.count(),
+            "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            "select_across": request.POST.get("select_across"),
+            "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+            "key": request.POST.get("key") or uuid.uuid4().hex,
+            "body": body,
+        })
+
+
+@admin.register(OrderDailyRollup)
+class OrderDailyRollupAdmin(ModelAdmin):
+    list_display = ("day", "status", "currency", "orders", "total")
+    list_filter = ("status", "currency")
+    date_hierarchy = "day"
+
+    def has_add_permission(self, request):
+        return False  # los recalcula rebuild_rollups
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from orders.rollups import rebuild, refresh_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula los resúmenes diarios de pedidos y pagos (OrderDailyRollup, PaymentDailyRollup). "
+        "Sin opciones procesa los días anotados como pendientes tras cada cambio: pensado para "
+        "cron cada minuto. --all recalcula todo el histórico (tras el primer despliegue)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recalcula todo el histórico.")
+        parser.add_argument("--days", type=int, default=None, help="Recalcula los últimos N días.")
+        parser.add_argument("--limit", type=int, default=None, help="Máximo de días pendientes por ejecución.")
+
+    def handle(self, *args, **opts):
+        log = self.stdout.write if opts["verbosity"] > 1 else None
+        if opts["all"] and opts["days"] is not None:
+            raise CommandError("--all y --days son incompatibles")
+        if (opts["days"] is not None and opts["days"] < 1) or (opts["limit"] is not None and opts["limit"] < 1):
+            raise CommandError("--days y --limit deben ser >= 1")
+
+        if opts["all"]:
+            n = rebuild(log=log)
+        elif opts["days"] is not None:
+            today = timezone.localdate()
+            n = rebuild([today - timedelta(days=i) for i in range(opts["days"])], log=log)
+        else:
+            n = refresh_pending(limit=opts["limit"], log=log)
+        self.stdout.write(self.style.SUCCESS(f"{n} día(s) recalculado(s)."))
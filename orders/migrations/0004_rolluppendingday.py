@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_orderdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupPendingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('marked_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('day',),
+            },
+        ),
+    ]
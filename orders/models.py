@@ -65,3 +65,33 @@ class OrderItem(models.Model):
 
     def __str__(self) -> str:
         return f"{self.service} x{self.quantity} ({self.order})"
+
+
+class OrderDailyRollup(models.Model):
+    """Pedidos por día de creación, estado actual y moneda; mantenido por orders/rollups.py."""
+    day      = models.DateField()
+    status   = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    currency = models.CharField(max_length=10)
+    orders   = models.IntegerField(default=0)
+    total    = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ("-day", "status", "currency")
+        constraints = [
+            models.UniqueConstraint(fields=["day", "status", "currency"], name="uniq_order_rollup_day_status_cur"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.day} · {self.status} · {self.currency}: {self.orders}"
+
+
+class RollupPendingDay(models.Model):
+    """Días cuyos resúmenes hay que recalcular (los marca orders/signals.py tras el commit)."""
+    day       = models.DateField(unique=True)
+    marked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ("day",)
+
+    def __str__(self) -> str:
+        return str(self.day)
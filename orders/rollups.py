@@ -0,0 +1,138 @@
+"""
+Resúmenes diarios de pedidos y pagos (OrderDailyRollup, PaymentDailyRollup).
+
+Son "de estado": cada pedido cuenta en (día de creación, estado actual, moneda) y cada
+pago en (día de creación, estado actual, tipo de fallo). No se mantienen con deltas en
+la transacción del cambio (eso bloquearía filas compartidas en cada pago):
+
+- orders/signals.py, tras el commit, solo anota el día afectado en RollupPendingDay.
+- refresh_pending() (`manage.py rebuild_rollups`, por cron) recalcula cada día anotado
+  desde la BD ya confirmada: agregado y sustitución en una misma transacción corta.
+- rebuild() recalcula todo el histórico, día a día (solo desde el comando).
+"""
+from __future__ import annotations
+
+from datetime import datetime, time, timedelta
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Case, Count, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Motivo (texto libre de mark_failed) → tipo de fallo fijo del resumen
+REASON_BUCKETS = {
+    "user_cancelled": "user_cancelled",
+    "insufficient_balance": "insufficient_balance",
+    "approve rejected by Pi": "pi_rejected",
+    "complete rejected by Pi": "pi_rejected",
+    "cancelled": "pi_cancelled",
+    "failed": "pi_cancelled",
+    "rejected": "pi_cancelled",
+    "declined": "pi_cancelled",
+    "cancelled on Pi (reconcile)": "pi_cancelled",
+    "cannot fetch payment before complete": "server_check",
+    "amount mismatch": "server_check",
+}
+
+ORDER_KEY = ("day", "status", "currency")
+PAYMENT_KEY = ("day", "status", "reason")
+
+
+def _models():
+    from orders.models import Order, OrderDailyRollup, RollupPendingDay
+    from pi_payments.models import Payment, PaymentDailyRollup, PaymentEvent
+    return Order, OrderDailyRollup, RollupPendingDay, Payment, PaymentDailyRollup, PaymentEvent
+
+
+def mark_days(days: Iterable) -> None:
+    """Anota días pendientes de recalcular (idempotente; sin leer ni bloquear resúmenes)."""
+    RollupPendingDay = _models()[2]
+    days = {d for d in days if d}
+    if days:
+        RollupPendingDay.objects.bulk_create([RollupPendingDay(day=d) for d in days], ignore_conflicts=True)
+
+
+def _bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _rows(day) -> tuple[list, list]:
+    Order, OrderDailyRollup, _, Payment, PaymentDailyRollup, PaymentEvent = _models()
+    start, end = _bounds(day)
+    orders = (
+        Order.objects.filter(created_at__gte=start, created_at__lt=end)
+        .values("status", "currency").annotate(orders=Count("id"), total=Sum("total")).order_by()
+    )
+    last_reason = (
+        PaymentEvent.objects.filter(payment=OuterRef("pk"), kind=PaymentEvent.FAILED)
+        .order_by("-created_at", "-id").values("reason")[:1]
+    )
+    failed = {"status": Payment.FAILED}
+    payments = (
+        Payment.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(last_reason=Subquery(last_reason))
+        .annotate(reason=Case(
+            *[When(last_reason=raw, then=Value(bucket), **failed) for raw, bucket in REASON_BUCKETS.items()],
+            When(then=Value(PaymentDailyRollup.OTHER), **failed),
+            default=Value(""),
+        ))
+        .values("status", "reason")
+        .annotate(payments=Count("id"), amount=Sum("amount"), amount_pi=Sum("amount_pi")).order_by()
+    )
+    return (
+        [OrderDailyRollup(day=day, status=row["status"], currency=row["currency"],
+                          orders=row["orders"], total=row["total"] or 0) for row in orders],
+        [PaymentDailyRollup(day=day, status=row["status"], reason=row["reason"], payments=row["payments"],
+                            amount=row["amount"] or 0, amount_pi=row["amount_pi"] or 0) for row in payments],
+    )
+
+
+def refresh_day(day) -> None:
+    """Agrega un día y sustituye sus filas en la misma transacción."""
+    _, OrderDailyRollup, _, _, PaymentDailyRollup, _ = _models()
+    with transaction.atomic():
+        order_rows, payment_rows = _rows(day)
+        for model, rows, key, values in (
+            (OrderDailyRollup, order_rows, ORDER_KEY, ["orders", "total"]),
+            (PaymentDailyRollup, payment_rows, PAYMENT_KEY, ["payments", "amount", "amount_pi"]),
+        ):
+            model.objects.filter(day=day).delete()
+            # update_conflicts: otra ejecución concurrente puede haber insertado ya el día
+            model.objects.bulk_create(rows, update_conflicts=True, unique_fields=list(key), update_fields=values)
+
+
+def refresh_pending(limit: int | None = None, log=None) -> int:
+    """Recalcula los días anotados en RollupPendingDay; devuelve cuántos."""
+    RollupPendingDay = _models()[2]
+    days = list(RollupPendingDay.objects.values_list("day", flat=True)[:limit])
+    done = 0
+    for day in days:
+        with transaction.atomic():
+            # Quitar la marca dentro de la transacción: un cambio confirmado después la
+            # vuelve a poner y lo recoge la siguiente ejecución
+            if not RollupPendingDay.objects.filter(day=day).delete()[0]:
+                continue  # otra ejecución se ha adelantado
+            refresh_day(day)
+        done += 1
+        if log:
+            log(f"  {day}: recalculado")
+    return done
+
+
+def rebuild(days: Iterable | None = None, log=None) -> int:
+    """Recalcula `days` (o todo el histórico, incluidos días que ya no tienen filas), día a día."""
+    Order, OrderDailyRollup, _, Payment, PaymentDailyRollup, _ = _models()
+    if days is None:
+        days = set()
+        for qs in (Order.objects, Payment.objects):
+            days.update(qs.annotate(d=TruncDate("created_at")).values_list("d", flat=True).distinct().order_by())
+        for model in (OrderDailyRollup, PaymentDailyRollup):
+            days.update(model.objects.values_list("day", flat=True).distinct().order_by())
+    days = sorted(set(days))
+    for day in days:
+        refresh_day(day)
+        if log:
+            log(f"  {day}: recalculado")
+    return len(days)
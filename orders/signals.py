@@ -0,0 +1,41 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from pi_payments.models import Payment
+from pi_payments.signals import payment_transitioned
+
+from .models import Order
+from .rollups import mark_days
+
+# Campos que cambian la fila de un pedido/pago en su resumen diario
+ROLLUP_FIELDS = {"status", "currency", "total", "amount", "amount_pi", "created_at"}
+
+
+def _mark_after_commit(*created_at) -> None:
+    # Fuera de la transacción del cambio: no bloquea nada en el camino caliente
+    days = [timezone.localdate(ts) for ts in created_at if ts]
+    transaction.on_commit(partial(mark_days, days))
+
+
+@receiver(post_save, sender=Order, dispatch_uid="orders_rollup_order_save")
+@receiver(post_save, sender=Payment, dispatch_uid="orders_rollup_payment_save")
+def rollup_row_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or ROLLUP_FIELDS & set(update_fields):
+        _mark_after_commit(instance.created_at)
+
+
+@receiver(post_delete, sender=Order, dispatch_uid="orders_rollup_order_delete")
+@receiver(post_delete, sender=Payment, dispatch_uid="orders_rollup_payment_delete")
+def rollup_row_deleted(sender, instance, **kwargs):
+    _mark_after_commit(instance.created_at)
+
+
+@receiver(payment_transitioned, dispatch_uid="orders_rollup_payment_transitioned")
+def rollup_payment_transitioned(sender, payment, **kwargs):
+    # Ya se emite tras el commit; la transición puede haber cambiado también el pedido
+    order_created = Order.objects.filter(pk=payment.order_id).values_list("created_at", flat=True).first()
+    _mark_after_commit(payment.created_at, order_created)
@@ -1,3 +1,91 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from pi_payments.models import Payment, PaymentDailyRollup
+
+from .models import Order, OrderDailyRollup, RollupPendingDay
+from .rollups import rebuild, refresh_pending
+
+
+def snapshot() -> tuple[list, list]:
+    return (
+        sorted(OrderDailyRollup.objects.values_list("day", "status", "currency", "orders", "total")),
+        sorted(PaymentDailyRollup.objects.values_list("day", "status", "reason", "payments", "amount", "amount_pi")),
+    )
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("buyer")
+        self.today = timezone.localdate()
+
+    def new_payment(self, n=0) -> Payment:
+        order = Order.objects.create(user=self.user, status=Order.AWAITING, total=Decimal("10.00"))
+        return Payment.objects.create(order=order, amount=order.total, amount_pi=Decimal("2"), nonce=f"n{n}")
+
+    def test_changes_only_mark_the_day_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.new_payment()
+            self.assertFalse(RollupPendingDay.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(list(RollupPendingDay.objects.values_list("day", flat=True)), [self.today])
+
+    def test_transition_does_not_touch_rollup_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pay = self.new_payment()
+        refresh_pending()
+        before = snapshot()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pay.mark_confirmed(txid="tx1")
+        self.assertEqual(snapshot(), before)
+        self.assertTrue(RollupPendingDay.objects.filter(day=self.today).exists())
+
+        self.assertEqual(refresh_pending(), 1)
+        self.assertFalse(RollupPendingDay.objects.exists())
+        orders, payments = snapshot()
+        self.assertEqual(orders, [(self.today, Order.PAID, "EUR", 1, Decimal("10.00"))])
+        self.assertEqual([row[:4] for row in payments], [(self.today, Payment.CONFIRMED, "", 1)])
+
+    def test_refresh_pending_matches_a_full_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pays = [self.new_payment(i) for i in range(4)]
+            Payment.objects.filter(pk=pays[0].pk).update(created_at=timezone.now() - timedelta(days=3))
+            Order.objects.filter(pk=pays[0].order_id).update(created_at=timezone.now() - timedelta(days=3))
+        with self.captureOnCommitCallbacks(execute=True):
+            pays[0].refresh_from_db()
+            pays[0].mark_failed("user_cancelled")
+            pays[1].mark_confirmed(txid="tx1")
+            pays[2].mark_failed("something unexpected")
+        refresh_pending()
+        incremental = snapshot()
+
+        rebuild()
+        self.assertEqual(snapshot(), incremental)
+
+    def test_failure_reasons_are_bucketed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.new_payment(0).mark_failed("approve rejected by Pi")
+            self.new_payment(1).mark_failed("free text from a webhook")
+            self.new_payment(2).mark_failed("user_cancelled")
+        call_command("rebuild_rollups", stdout=StringIO())
+
+        reasons = dict(PaymentDailyRollup.objects.filter(status=Payment.FAILED).values_list("reason", "payments"))
+        self.assertEqual(reasons, {
+            PaymentDailyRollup.PI_REJECTED: 1, PaymentDailyRollup.OTHER: 1, PaymentDailyRollup.USER_CANCELLED: 1,
+        })
+
+    def test_admin_bulk_status_marks_the_days(self):
+        pay = self.new_payment()
+        RollupPendingDay.objects.all().delete()
 
-# Create your tests here.
+        site._registry[Payment]._bulk_status(Payment.objects.filter(pk=pay.pk), Payment.FAILED)
+        self.assertEqual(list(RollupPendingDay.objects.values_list("day", flat=True)), [self.today])
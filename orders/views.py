@@ -1,5 +1,5 @@
 import secrets
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 from django.conf import settings
 from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
@@ -9,25 +9,30 @@ from django.db.models import Prefetch
 from django.core.paginator import Paginator
 from .models import Order, OrderItem
 from pi_payments.models import Payment
+from pi_payments.rates import get_rate, pi_price, to_pi
 
 
 @login_required
 def checkout_service(request, slug):
-    service = get_object_or_404(Service, slug=slug, is_active=True)
+    service = get_object_or_404(Service.objects.select_related("pi_price"), slug=slug, is_active=True)
 
     # 1) crea pedido en EUR como ya haces
     order = Order.objects.create(user=request.user, status=Order.AWAITING, currency="EUR")
     OrderItem.objects.create(order=order, service=service, unit_price=service.price, quantity=1)
     order.recalc()  # deja total/subtotal en €
 
-    # 2) ratio EUR por π
-    eur_per_pi = getattr(settings, "PI_EUR_PER_PI", Decimal("0"))
-    if eur_per_pi <= 0:
+    # 2) ratio EUR por π (versión vigente, cacheada)
+    rate = get_rate()
+    if rate is None or rate.eur_per_pi <= 0:
         return JsonResponse({"ok": False, "error": "PI_EUR_PER_PI not configured"}, status=500)
+    eur_per_pi = rate.eur_per_pi
 
-    # 3) calcula amount en π con 4 decimales
+    # 3) amount en π con 4 decimales: el precalculado del servicio si el total es su precio
     amount_eur = Decimal(str(order.total))
-    amount_pi  = (amount_eur / eur_per_pi).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+    if amount_eur == service.price:
+        amount_pi = pi_price(service, rate)
+    else:
+        amount_pi = to_pi(amount_eur, eur_per_pi)
 
     # 4) pago "initiated" con nonce
     nonce = secrets.token_hex(16)
@@ -35,17 +40,19 @@ def checkout_service(request, slug):
         order=order,
         nonce=nonce,
         amount=amount_eur,     # seguimos guardando el € aquí (tu modelo actual)
-        currency=order.currency # "EUR"
+        currency=order.currency, # "EUR"
+        eur_per_pi=eur_per_pi,
+        amount_pi=amount_pi,
+        # Guarda también la conversión para auditoría
+        raw_payload={
+            "pricing": {
+                "price_eur": str(amount_eur),
+                "eur_per_pi": str(eur_per_pi),
+                "amount_pi": str(amount_pi),
+                "rate_version": rate.version,
+            }
+        },
     )
-    # Guarda también la conversión para auditoría
-    payment.raw_payload = {
-        "pricing": {
-            "price_eur": str(amount_eur),
-            "eur_per_pi": str(eur_per_pi),
-            "amount_pi": str(amount_pi),
-        }
-    }
-    payment.save(update_fields=["raw_payload"])
 
     # 5) payload para Pi SDK: ¡IMPORTANTE! 'amount' es en π
     payload = {
@@ -71,6 +78,7 @@ def my_orders(request):
         Order.objects
         .filter(user=request.user)
         .select_related("payment")
+        .defer("payment__raw_payload")
         .prefetch_related(Prefetch("items", queryset=OrderItem.objects.select_related("service")))
         .order_by("-id")
     )
@@ -78,20 +86,17 @@ def my_orders(request):
 
 @login_required
 def order_detail(request, number):
-    order = get_object_or_404(request.user.order_set, number=number)
-
-    eur_per_pi = None
-    try:
-        eur_per_pi = (
-            order.payment.raw_payload.get("pricing", {}).get("eur_per_pi")
-            if order.payment and order.payment.raw_payload
-            else None
-        )
-    except Exception:
-        eur_per_pi = None
+    order = get_object_or_404(
+        request.user.order_set.select_related("payment").defer("payment__raw_payload"),
+        number=number,
+    )
+
+    payment = getattr(order, "payment", None)
+    eur_per_pi = payment.eur_per_pi if payment else None
 
     if eur_per_pi is None:
-        eur_per_pi = getattr(settings, "DEFAULT_EUR_PER_PI", Decimal("1"))
+        rate = get_rate()
+        eur_per_pi = rate.eur_per_pi if rate else getattr(settings, "DEFAULT_EUR_PER_PI", Decimal("1"))
 
     return render(request, "orders/detail.html", {
         "order": order,
@@ -112,5 +117,5 @@ def order_list(request):
         "orders": orders,
         "is_paginated": orders.has_other_pages(),
         "page_obj": orders,
-        "eur_per_pi": getattr(settings, "DEFAULT_EUR_PER_PI", None),  # ej: Decimal("0.10")
+        "eur_per_pi": getattr(get_rate(), "eur_per_pi", None),
     })
\ No newline at end of file
@@ -1,7 +1,7 @@
 import json
-import requests
 from django.conf import settings
 from django.contrib import admin
+from django.db.models.functions import TruncDate
 from django.urls import reverse
 from django.utils.html import format_html
 
@@ -10,19 +10,10 @@ from unfold.contrib.filters.admin import RangeDateTimeFilter
 from unfold.decorators import action
 from unfold.enums import ActionVariant
 
-from .models import Payment
+from orders.rollups import mark_days as mark_rollup_days
 
-
-def _pi_headers():
-    key = getattr(settings, "PI_API_KEY", None)
-    return {"Authorization": f"Key {key}", "Content-Type": "application/json"}
-
-def _fetch_pi_payment(pid: str):
-    base = "https://api.minepi.com"
-    r = requests.get(f"{base}/v2/payments/{pid}", headers=_pi_headers(), timeout=20)
-    if not r.ok:
-        return False, {"status_code": r.status_code, "text": r.text}
-    return True, r.json()
+from .models import ExchangeRate, Payment, PaymentDailyRollup, PaymentEvent, PiSyncJob, PiWebhookEvent
+from .sync import resumable, start_job, sync_payments
 
 
 # Conveniencia por si algún día cambias a TextChoices
@@ -31,6 +22,18 @@ S_CONFIRMED = getattr(Payment, "CONFIRMED", "confirmed")
 S_FAILED    = getattr(Payment, "FAILED",    "failed")
 
 
+class PaymentEventInline(admin.TabularInline):
+    model = PaymentEvent
+    extra = 0
+    fields = ("created_at", "kind", "reason", "data")
+    readonly_fields = ("created_at", "kind", "reason", "data")
+    can_delete = False
+    ordering = ("-created_at", "-id")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Payment)
 class PaymentAdmin(ModelAdmin):
     compressed_fields = True
@@ -43,15 +46,17 @@ class PaymentAdmin(ModelAdmin):
         "user_email",
         "short_pid",
         "status_badge",
+        "pi_status",
         "amount",
         "currency",
         "created_at",
         "completed_at",
     )
     list_display_links = ("order_link",)
-    search_fields = ("provider_payment_id", "order__number", "order__user__username", "order__user__email")
+    search_fields = ("provider_payment_id", "txid", "order__number", "order__user__username", "order__user__email")
     list_filter = (
         "status",
+        "pi_status",
         "provider",
         "currency",
         ("created_at", RangeDateTimeFilter),
@@ -59,6 +64,7 @@ class PaymentAdmin(ModelAdmin):
     )
     ordering = ("-created_at",)
     list_per_page = 25
+    inlines = [PaymentEventInline]
 
     readonly_fields = (
         "order",
@@ -67,6 +73,10 @@ class PaymentAdmin(ModelAdmin):
         "amount",
         "currency",
         "nonce",
+        "txid",
+        "pi_status",
+        "eur_per_pi",
+        "amount_pi",
         "created_at",
         "completed_at",
         "raw_payload_pretty",
@@ -78,53 +88,58 @@ class PaymentAdmin(ModelAdmin):
         "provider_payment_id",
         ("amount", "currency"),
         ("status", "nonce"),
+        ("txid", "pi_status"),
+        ("eur_per_pi", "amount_pi"),
         ("created_at", "completed_at"),
         "raw_payload_pretty",
     )
 
+    def get_queryset(self, request):
+        # El changelist no necesita el JSON; la ficha lo carga bajo demanda
+        return super().get_queryset(request).select_related("order__user").defer("raw_payload")
+
     # ---- acciones ----
     actions = ["sync_from_pi", "mark_failed", "mark_initiated", "mark_confirmed"]
 
     @action(description="Sync from Pi", icon="sync", variant=ActionVariant.INFO)
     def sync_from_pi(self, request, queryset):
-        ok_n, fail_n = 0, 0
-        for p in queryset:
-            pid = getattr(p, "provider_payment_id", None)
-            if not pid:
-                fail_n += 1
-                continue
-            try:
-                ok, info = _fetch_pi_payment(pid)
-                if not ok:
-                    fail_n += 1
-                    continue
-                # auditoría
-                p.raw_payload = info
-
-                status = (info.get("status") or "").lower()
-                txid = (info.get("transaction") or {}).get("txid") or info.get("txid")
-                if status == "completed" or txid:
-                    p.status = S_CONFIRMED
-
-                p.save(update_fields=["raw_payload", "status"])
-                ok_n += 1
-            except Exception:
-                fail_n += 1
-        self.message_user(request, f"Sync OK: {ok_n} | errors: {fail_n}")
+        ids = list(queryset.order_by().values_list("pk", flat=True))
+        inline_max = int(getattr(settings, "PI_SYNC_INLINE_MAX", 25))
+
+        if len(ids) <= inline_max:
+            ok_n, fail_n = sync_payments(list(queryset))
+            self.message_user(request, f"Sync OK: {ok_n} | errors: {fail_n}")
+            return
+
+        # Selección grande: en segundo plano, con progreso en PiSyncJob
+        job = PiSyncJob.objects.create(created_by=request.user, payment_ids=ids, total=len(ids))
+        start_job(job)
+        url = reverse("admin:pi_payments_pisyncjob_change", args=[job.pk])
+        self.message_user(
+            request,
+            format_html("Sync de {} pagos lanzado en segundo plano: <a href='{}'>ver progreso</a>", len(ids), url),
+        )
+
+    def _bulk_status(self, queryset, status):
+        # UPDATE masivo (sin save ni _transition): anota los días tocados para rebuild_rollups
+        days = list(queryset.annotate(day=TruncDate("created_at")).values_list("day", flat=True).distinct().order_by())
+        n = queryset.update(status=status)
+        mark_rollup_days(days)
+        return n
 
     @action(description="Mark failed", icon="error", variant=ActionVariant.DANGER)
     def mark_failed(self, request, queryset):
-        n = queryset.update(status=S_FAILED)
+        n = self._bulk_status(queryset, S_FAILED)
         self.message_user(request, f"Marked failed: {n}")
 
     @action(description="Mark initiated", icon="play_arrow", variant=ActionVariant.WARNING)
     def mark_initiated(self, request, queryset):
-        n = queryset.update(status=S_INITIATED)
+        n = self._bulk_status(queryset, S_INITIATED)
         self.message_user(request, f"Marked initiated: {n}")
 
     @action(description="Mark confirmed", icon="check_circle", variant=ActionVariant.SUCCESS)
     def mark_confirmed(self, request, queryset):
-        n = queryset.update(status=S_CONFIRMED)
+        n = self._bulk_status(queryset, S_CONFIRMED)
         self.message_user(request, f"Marked confirmed: {n}")
 
     # ---- helpers visuales ----
@@ -171,3 +186,78 @@ class PaymentAdmin(ModelAdmin):
             return format_html("<pre style='white-space:pre-wrap;max-height:320px;overflow:auto'>{}</pre>", raw)
         except Exception:
             return format_html("<pre>{}</pre>", data)
+
+
+@admin.register(PiWebhookEvent)
+class PiWebhookEventAdmin(ModelAdmin):
+    list_display = ("pid", "event", "received_at", "processed_at", "attempts", "last_error")
+    list_filter = ("event", ("received_at", RangeDateTimeFilter))
+    search_fields = ("pid",)
+    readonly_fields = ("pid", "event", "payload", "received_at", "processed_at", "locked_until", "attempts", "last_error")
+    ordering = ("-received_at",)
+    list_per_page = 50
+
+
+@admin.register(PiSyncJob)
+class PiSyncJobAdmin(ModelAdmin):
+    list_display = ("id", "status", "progress_bar", "ok", "errors", "created_by", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = (
+        "status", "progress_bar", "total", "done", "ok", "errors", "last_error",
+        "created_by", "created_at", "started_at", "heartbeat_at", "finished_at",
+    )
+    exclude = ("payment_ids",)
+    ordering = ("-created_at",)
+    actions = ["resume"]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Progress")
+    def progress_bar(self, obj):
+        return format_html(
+            "<div style='width:140px;background:#e9ecef;border-radius:6px'>"
+            "<div style='width:{}%;background:#198754;color:#fff;border-radius:6px;padding:0 6px'>{}%</div></div>",
+            obj.progress, obj.progress,
+        )
+
+    @action(description="Resume", icon="play_arrow", variant=ActionVariant.WARNING)
+    def resume(self, request, queryset):
+        # run_job() reclama el job con un UPDATE condicional: uno que sigue avanzando no se duplica
+        n = 0
+        for job in queryset.filter(resumable()):
+            start_job(job)
+            n += 1
+        self.message_user(
+            request,
+            f"Resumed: {n}. Los jobs corren como hilo del worker web: si el worker se recicla se "
+            f"detienen y quedan 'running' sin progreso; se pueden reanudar pasados "
+            f"{getattr(settings, 'PI_SYNC_JOB_STALE', 300)} s.",
+        )
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(ModelAdmin):
+    list_display = ("version", "eur_per_pi", "source", "created_at")
+    readonly_fields = ("version", "eur_per_pi", "source", "created_at")
+    ordering = ("-version",)
+
+    def has_add_permission(self, request):
+        return False  # las versiones las crea refresh_rate()
+
+
+@admin.register(PaymentDailyRollup)
+class PaymentDailyRollupAdmin(ModelAdmin):
+    list_display = ("day", "status", "reason", "payments", "amount", "amount_pi")
+    list_filter = ("status", "reason")
+    date_hierarchy = "day"
+
+    def has_add_permission(self, request):
+        return False  # los recalcula rebuild_rollups
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
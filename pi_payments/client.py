@@ -0,0 +1,256 @@
+"""
+Cliente HTTP único para la API de Pi Network.
+
+- Una requests.Session por proceso (keep-alive): se reutiliza la conexión TLS
+  entre llamadas en vez de abrir una nueva en cada request.
+- Pool dimensionado a los hilos de gunicorn (PI_HTTP_POOL_SIZE).
+- Reintentos acotados con backoff + jitter, solo para GET (idempotentes). me()
+  (login) va por una sesión sin reintentos: su timeout es el límite real.
+- Timeout (connect, read) en todas las llamadas, ajustable por llamada.
+- Métricas de latencia en memoria por operación (ver PiClient.metrics()).
+- fetch_payment(): caché por pid de TTL corto con single-flight, de modo que
+  callbacks concurrentes (webhook + cliente) comparten un solo GET a Pi.
+- submit(): pequeño pool de hilos para solapar llamadas a Pi con otro trabajo
+  (solo HTTP; nada de ORM dentro de las tareas).
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BASE = "https://api.minepi.com"
+
+
+class _Call:
+    __slots__ = ("event", "value", "error", "stale")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: BaseException | None = None
+        self.stale = False
+
+
+class SingleFlightCache:
+    """
+    Caché en memoria con TTL y coalescencia de peticiones: si varios hilos piden
+    la misma clave a la vez, solo uno ejecuta loader() y el resto espera su resultado.
+    invalidate() descarta el valor y cualquier carga en vuelo iniciada antes.
+    """
+
+    max_entries = 1024
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: dict[str, tuple[float, object]] = {}
+        self._inflight: dict[str, _Call] = {}
+
+    def get(self, key: str, loader, cacheable=lambda value: True):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and hit[0] > time.monotonic():
+                return hit[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+                if call.error is None and not call.stale and self.ttl > 0 and cacheable(call.value):
+                    self._store(key, call.value)
+            call.event.set()
+        return call.value
+
+    def _store(self, key: str, value) -> None:
+        now = time.monotonic()
+        if len(self._data) >= self.max_entries:
+            self._data = {k: v for k, v in self._data.items() if v[0] > now}
+        self._data[key] = (now + self.ttl, value)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            call = self._inflight.pop(key, None)
+            if call is not None:
+                call.stale = True
+
+
+class PiClient:
+    def __init__(
+        self,
+        base: str | None = None,
+        api_key: str | None = None,
+        pool_size: int | None = None,
+        retries: int | None = None,
+        timeout: tuple[float, float] | None = None,
+    ):
+        self.base = (base or getattr(settings, "PI_API_BASE", DEFAULT_BASE)).rstrip("/")
+        self.api_key = api_key if api_key is not None else getattr(settings, "PI_API_KEY", "")
+        self.pool_size = pool_size or int(getattr(settings, "PI_HTTP_POOL_SIZE", 4))
+        self.retries = retries if retries is not None else int(getattr(settings, "PI_HTTP_RETRIES", 2))
+        self.timeout = timeout or (
+            float(getattr(settings, "PI_HTTP_CONNECT_TIMEOUT", 3.05)),
+            float(getattr(settings, "PI_HTTP_READ_TIMEOUT", 20)),
+        )
+        self._sessions: dict[bool, requests.Session] = {}  # con / sin reintentos
+        self._session_pid: int | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_pid: int | None = None
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, float]] = {}
+        self._payments = SingleFlightCache(float(getattr(settings, "PI_PAYMENT_CACHE_TTL", 3)))
+
+    # ---------- sesión ----------
+    def _build_session(self, retries: int) -> requests.Session:
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            allowed_methods=frozenset({"GET"}),
+            status_forcelist=(429, 500, 502, 503, 504),
+            backoff_factor=0.2,
+            backoff_jitter=0.2,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=self.pool_size,
+            pool_block=False,
+            max_retries=retry,
+        )
+        s = requests.Session()
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    def _session_for(self, retry: bool) -> requests.Session:
+        # Tras un fork (gunicorn --preload) cada worker necesita su propio pool
+        pid = os.getpid()
+        if self._session_pid != pid or retry not in self._sessions:
+            with self._lock:
+                if self._session_pid != pid:
+                    self._sessions, self._session_pid = {}, pid
+                if retry not in self._sessions:
+                    self._sessions[retry] = self._build_session(self.retries if retry else 0)
+        return self._sessions[retry]
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session_for(retry=True)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Ejecuta fn(*args) en el pool del cliente (mismo tamaño que el pool HTTP)."""
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="pi-client")
+                    self._executor_pid = pid
+        return self._executor.submit(fn, *args, **kwargs)
+
+    # ---------- métricas ----------
+    def _observe(self, op: str, elapsed_ms: float, ok: bool) -> None:
+        with self._lock:
+            st = self._stats.setdefault(op, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            st["count"] += 1
+            st["total_ms"] += elapsed_ms
+            st["max_ms"] = max(st["max_ms"], elapsed_ms)
+            if not ok:
+                st["errors"] += 1
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            out = {}
+            for op, st in self._stats.items():
+                out[op] = dict(st, avg_ms=(st["total_ms"] / st["count"]) if st["count"] else 0.0)
+            return out
+
+    # ---------- núcleo ----------
+    def _key_headers(self) -> dict[str, str]:
+        return {"Authorization": f"Key {self.api_key}", "Content-Type": "application/json"}
+
+    def request(self, method: str, path: str, *, op: str, timeout=None, retry: bool = True,
+                **kwargs) -> requests.Response:
+        url = f"{self.base}{path}"
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            r = self._session_for(retry).request(method, url, timeout=timeout or self.timeout, **kwargs)
+            ok = r.ok
+            return r
+        finally:
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            self._observe(op, elapsed_ms, ok)
+            log.debug("pi.%s %s %s %.1fms ok=%s", op, method, path, elapsed_ms, ok)
+
+    # ---------- endpoints ----------
+    def get_payment(self, pid: str, timeout=None) -> requests.Response:
+        return self.request("GET", f"/v2/payments/{pid}", op="get_payment",
+                            headers=self._key_headers(), timeout=timeout)
+
+    def fetch_payment(self, pid: str) -> requests.Response:
+        """get_payment() con caché corta + single-flight. Solo se cachean respuestas OK."""
+        return self._payments.get(pid, lambda: self.get_payment(pid), cacheable=lambda r: r.ok)
+
+    def invalidate_payment(self, pid: str) -> None:
+        self._payments.invalidate(pid)
+
+    def approve(self, pid: str, timeout=None) -> requests.Response:
+        try:
+            return self.request("POST", f"/v2/payments/{pid}/approve", op="approve",
+                                headers=self._key_headers(), timeout=timeout)
+        finally:
+            self.invalidate_payment(pid)  # el estado remoto ha cambiado
+
+    def complete(self, pid: str, txid: str, timeout=None) -> requests.Response:
+        try:
+            return self.request("POST", f"/v2/payments/{pid}/complete", op="complete",
+                                headers=self._key_headers(), json={"txid": txid}, timeout=timeout)
+        finally:
+            self.invalidate_payment(pid)
+
+    def me(self, access_token: str, timeout=None) -> requests.Response:
+        # Un solo intento: el login tiene su propio plan B (verificación en caché)
+        return self.request("GET", "/v2/me", op="me", retry=False,
+                            headers={"Authorization": f"Bearer {access_token}"}, timeout=timeout)
+
+
+_client: PiClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> PiClient:
+    """Devuelve el PiClient compartido del proceso."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PiClient()
+    return _client
@@ -1,4 +1,9 @@
-from django.conf import settings
+from pi_payments.rates import get_rate
 
 def pi_pricing(request):
-    return {"PI_EUR_PER_PI": getattr(settings, "PI_EUR_PER_PI", None)}
+    # get_rate() sale de la caché del proceso; no toca la BD en cada request
+    rate = get_rate()
+    return {
+        "PI_EUR_PER_PI": rate.eur_per_pi if rate else None,
+        "PI_RATE_VERSION": rate.version if rate else None,
+    }
@@ -0,0 +1,214 @@
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.models import Order
+from pi_payments.client import PiClient
+from pi_payments.models import Payment
+from pi_payments.sync import fetch_many
+from services.models import Service
+
+
+class FlowError(Exception):
+    def __init__(self, step: str, detail: str = ""):
+        super().__init__(f"{step}: {detail}")
+        self.step = step
+
+
+def _pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del flujo de pago de extremo a extremo contra una app en marcha "
+        "que usa el stub de Pi (pi_stub_server). Mide throughput/latencias y comprueba "
+        "la consistencia de estados (Payment/Order en BD vs. Pi) al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="URL de la app Django.")
+        parser.add_argument("--stub-url", default="http://127.0.0.1:8765", help="URL del stub de Pi.")
+        parser.add_argument("--payments", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--users", type=int, default=20, help="Usuarios Pi distintos (tokens del stub).")
+        parser.add_argument("--service", default=None, help="Slug del servicio (por defecto, el primero activo).")
+        parser.add_argument("--cancel-rate", type=float, default=0.0,
+                            help="Fracción de pagos que el usuario cancela tras aprobar.")
+        parser.add_argument("--settle", type=float, default=5.0,
+                            help="Segundos de espera (webhooks/worker) antes de comprobar consistencia.")
+
+    def handle(self, *args, **opts):
+        base = opts["base_url"].rstrip("/")
+        stub = opts["stub_url"].rstrip("/")
+        slug = opts["service"] or Service.objects.filter(is_active=True).values_list("slug", flat=True).first()
+        if not slug:
+            raise CommandError("No hay ningún servicio activo para el checkout.")
+
+        local = threading.local()
+        sessions_lock = threading.Lock()
+        sessions_made = [0]
+
+        def session() -> requests.Session:
+            s = getattr(local, "session", None)
+            if s is None:
+                with sessions_lock:
+                    n = sessions_made[0]
+                    sessions_made[0] += 1
+                s = local.session = self.login(base, f"load-user-{n % opts['users']}")
+            return s
+
+        timings: dict[str, list[float]] = defaultdict(list)
+        timings_lock = threading.Lock()
+
+        def timed(step: str, fn, *a, **kw) -> requests.Response:
+            t0 = time.perf_counter()
+            r = fn(*a, **kw)
+            with timings_lock:
+                timings[step].append((time.perf_counter() - t0) * 1000)
+            return r
+
+        def flow(i: int) -> dict:
+            # reparto uniforme: exactamente cancel_rate * N pagos cancelados
+            cancel = int((i + 1) * opts["cancel_rate"]) > int(i * opts["cancel_rate"])
+            try:
+                s = session()
+                t0 = time.perf_counter()
+                r = timed("checkout", s.get, f"{base}/orders/checkout/{slug}/")
+                if not r.ok or "json" not in r.headers.get("Content-Type", ""):
+                    raise FlowError("checkout", f"{r.status_code} {r.url}")
+                order_number = r.json()["order_number"]
+                sdk = r.json()["payment"]
+
+                # Lo que hace el Pi SDK en el navegador: crea el pago en Pi
+                r = requests.post(f"{stub}/_stub/payments", json=dict(sdk, uid=s.pi_uid), timeout=10)
+                pid = r.json()["identifier"]
+
+                r = timed("approve", self.post, s, f"{base}/pi/approve/", {"paymentId": pid})
+                if not r.ok:
+                    raise FlowError("approve", str(r.status_code))
+
+                if cancel:
+                    requests.post(f"{stub}/_stub/payments/{pid}/cancel", timeout=10)
+                    r = timed("cancel", self.post, s, f"{base}/pi/cancel/",
+                              {"paymentId": pid, "reason": "user_cancelled"})
+                    if not r.ok:
+                        raise FlowError("cancel", str(r.status_code))
+                    return {"order": order_number, "pid": pid, "expect": "failed",
+                            "ms": (time.perf_counter() - t0) * 1000}
+
+                # El usuario firma en la wallet → txid
+                r = requests.post(f"{stub}/_stub/payments/{pid}/submit", timeout=10)
+                if not r.ok:
+                    raise FlowError("submit", r.text[:100])
+                txid = r.json()["transaction"]["txid"]
+
+                r = timed("complete", self.post, s, f"{base}/pi/complete/", {"paymentId": pid, "txid": txid})
+                if not r.ok:
+                    raise FlowError("complete", str(r.status_code))
+                return {"order": order_number, "pid": pid, "txid": txid, "expect": "confirmed",
+                        "ms": (time.perf_counter() - t0) * 1000}
+            except FlowError as e:
+                return {"error": e.step, "detail": str(e)}
+            except (requests.RequestException, ValueError, KeyError) as e:
+                return {"error": "http", "detail": repr(e)}
+
+        self.stdout.write(f"Lanzando {opts['payments']} pagos con concurrencia {opts['concurrency']}…")
+        t_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=opts["concurrency"], thread_name_prefix="pi-load") as ex:
+            results = list(ex.map(flow, range(opts["payments"])))
+        elapsed = time.perf_counter() - t_start
+
+        done = [r for r in results if "error" not in r]
+        errors = Counter(r["error"] for r in results if "error" in r)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(done)}/{len(results)} flujos OK en {elapsed:.1f}s → {len(done) / elapsed:.1f} pagos/s"
+        ))
+        for step in ("checkout", "approve", "complete", "cancel"):
+            v = timings.get(step)
+            if v:
+                self.stdout.write(
+                    f"  {step:<9} n={len(v):<6} p50={statistics.median(v):7.1f}ms "
+                    f"p95={_pct(v, 95):7.1f}ms p99={_pct(v, 99):7.1f}ms max={max(v):7.1f}ms"
+                )
+        if errors:
+            self.stdout.write(self.style.WARNING(f"  errores por paso: {dict(errors)}"))
+            for r in [r for r in results if "error" in r][:5]:
+                self.stdout.write(f"    {r['detail']}")
+
+        if opts["settle"]:
+            time.sleep(opts["settle"])
+        violations = self.check_consistency(done, stub)
+        if violations:
+            self.stdout.write(self.style.ERROR(f"{len(violations)} violaciones de consistencia:"))
+            for v in violations[:20]:
+                self.stdout.write(f"  {v}")
+        else:
+            self.stdout.write(self.style.SUCCESS("Consistencia OK: BD y Pi coinciden para todos los pagos."))
+
+    # ---------- helpers ----------
+    def login(self, base: str, token: str) -> requests.Session:
+        """Inicia sesión vía /users/pi/login/ con un token del stub (CSRF incluido)."""
+        s = requests.Session()
+        s.get(f"{base}/users/login/", timeout=10)
+        r = self.post(s, f"{base}/users/pi/login/", {"accessToken": token})
+        if not r.ok:
+            raise FlowError("login", f"{r.status_code} {r.text[:100]}")
+        s.pi_uid = token
+        return s
+
+    @staticmethod
+    def post(s: requests.Session, url: str, body: dict) -> requests.Response:
+        return s.post(url, json=body, timeout=30, headers={
+            "X-CSRFToken": s.cookies.get("csrftoken", ""),
+            "Referer": url,
+        })
+
+    def check_consistency(self, done: list[dict], stub: str) -> list[str]:
+        """
+        Invariantes tras la carga:
+        - Payment confirmado ⇔ Order pagada; fallido ⇒ Order cancelada.
+        - El estado final es el esperado por el flujo y el txid coincide.
+        - Pi (stub) dice completed ⇔ Payment confirmado.
+        """
+        by_order = {r["order"]: r for r in done}
+        payments = {
+            p.order.number: p
+            for p in Payment.objects.select_related("order").defer("raw_payload")
+            .filter(order__number__in=list(by_order))
+        }
+        remote = {
+            pid: info for pid, ok, info in
+            fetch_many([r["pid"] for r in done], rate=0, client=PiClient(base=stub, api_key="load-test"))
+            if ok
+        }
+
+        violations = []
+        for number, r in by_order.items():
+            p = payments.get(number)
+            if p is None:
+                violations.append(f"{number}: sin Payment local")
+                continue
+            if p.status != r["expect"]:
+                violations.append(f"{number}: Payment {p.status}, esperado {r['expect']}")
+            if (p.status == Payment.CONFIRMED) != (p.order.status == Order.PAID):
+                violations.append(f"{number}: Payment {p.status} pero Order {p.order.status}")
+            if p.status == Payment.FAILED and p.order.status != Order.CANCELLED:
+                violations.append(f"{number}: Payment failed pero Order {p.order.status}")
+            if r.get("txid") and p.txid != r["txid"]:
+                violations.append(f"{number}: txid {p.txid!r} ≠ {r['txid']!r}")
+            info = remote.get(r["pid"])
+            if info is None:
+                violations.append(f"{number}: no se pudo leer {r['pid']} del stub")
+            elif info["status"]["developer_completed"] != (p.status == Payment.CONFIRMED):
+                violations.append(f"{number}: Pi completed={info['status']['developer_completed']} "
+                                  f"pero Payment {p.status}")
+        return violations
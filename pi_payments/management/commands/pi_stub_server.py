@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from pi_payments.stub import StubConfig, make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Arranca un servidor local que imita la API de Pi (/v2/me, /v2/payments/...). "
+        "Apunta la app con PI_API_BASE=http://<host>:<port>. Solo para desarrollo/pruebas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia base por petición.")
+        parser.add_argument("--jitter-ms", type=float, default=0.0, help="Latencia extra aleatoria (0..N ms).")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de responder 503 (0..1).")
+        parser.add_argument("--webhook-url", default="", help="URL de /pi/webhook/ de la app (vacío = sin webhooks).")
+        parser.add_argument("--webhook-delay-ms", type=float, default=0.0)
+        parser.add_argument("--webhook-duplicate-rate", type=float, default=0.0,
+                            help="Probabilidad de enviar cada webhook dos veces.")
+
+    def handle(self, *args, **opts):
+        config = StubConfig(
+            latency_ms=opts["latency_ms"],
+            jitter_ms=opts["jitter_ms"],
+            error_rate=opts["error_rate"],
+            webhook_url=opts["webhook_url"],
+            webhook_delay_ms=opts["webhook_delay_ms"],
+            webhook_duplicate_rate=opts["webhook_duplicate_rate"],
+        )
+        server = make_server(opts["host"], opts["port"], config)
+        self.stdout.write(self.style.SUCCESS(
+            f"Pi API stub en http://{opts['host']}:{opts['port']} "
+            f"(latencia {config.latency_ms}+{config.jitter_ms}ms, errores {config.error_rate:.0%})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
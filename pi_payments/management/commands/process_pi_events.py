@@ -0,0 +1,113 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from pi_payments.models import PiWebhookEvent
+from pi_payments.utils import LocalPaymentNotFound, apply_webhook, fetch_pi_payment, log_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa la bandeja de webhooks de Pi (PiWebhookEvent) en orden por pago. "
+        "Se pueden lanzar varios workers a la vez (select_for_update skip_locked + lease)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=50, help="Eventos reclamados por lote.")
+        parser.add_argument("--lease", type=int, default=120, help="Segundos que un lote queda reservado.")
+        parser.add_argument("--max-attempts", type=int, default=5, help="Reintentos antes de descartar un evento.")
+        parser.add_argument("--sleep", type=float, default=1.0, help="Pausa cuando la bandeja está vacía.")
+        parser.add_argument("--once", action="store_true", help="Vacía la bandeja una vez y termina.")
+
+    def handle(self, *args, **opts):
+        total = 0
+        while True:
+            # Worker de larga duración: descarta conexiones caducadas (p. ej. wait_timeout de MySQL)
+            close_old_connections()
+            events = self.claim(opts["batch"], opts["lease"])
+            if not events:
+                if opts["once"]:
+                    break
+                time.sleep(opts["sleep"])
+                continue
+            total += self.process(events, opts["max_attempts"])
+        self.stdout.write(self.style.SUCCESS(f"Eventos procesados: {total}"))
+
+    def claim(self, batch: int, lease: int) -> list[PiWebhookEvent]:
+        """
+        Reserva (lease) un lote de eventos pendientes, los más antiguos primero.
+        Un pid cuyo evento anterior está en manos de otro worker se deja para
+        más tarde, así cada pago se aplica siempre en orden.
+        """
+        now = timezone.now()
+        free = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+        with transaction.atomic():
+            events = list(
+                PiWebhookEvent.objects
+                .select_for_update(skip_locked=True)
+                .filter(free, processed_at__isnull=True)
+                .order_by("received_at", "id")[:batch]
+            )
+            if not events:
+                return []
+
+            first_seen: dict[str, object] = {}
+            for e in events:
+                first_seen.setdefault(e.pid, e.received_at)
+            busy = (
+                PiWebhookEvent.objects
+                .filter(processed_at__isnull=True, pid__in=list(first_seen))
+                .exclude(pk__in=[e.pk for e in events])
+                .values("pid")
+                .annotate(oldest=Min("received_at"))
+            )
+            blocked = {row["pid"] for row in busy if row["oldest"] < first_seen[row["pid"]]}
+            events = [e for e in events if e.pid not in blocked]
+
+            PiWebhookEvent.objects.filter(pk__in=[e.pk for e in events]).update(
+                locked_until=now + timedelta(seconds=lease)
+            )
+        return events
+
+    def process(self, events: list[PiWebhookEvent], max_attempts: int) -> int:
+        done = 0
+        stalled: set[str] = set()  # pids con un evento fallido: no adelantar los siguientes
+        for e in events:
+            if e.pid in stalled:
+                PiWebhookEvent.objects.filter(pk=e.pk).update(locked_until=None)
+                continue
+
+            data = e.payload or {}
+            reason = (data.get("reason") or data.get("error") or "").strip()
+            try:
+                # La llamada a Pi va fuera de la transacción: no retiene bloqueos de Payment/Order
+                _, info = fetch_pi_payment(e.pid)
+                with transaction.atomic():
+                    outcome = apply_webhook(e.pid, e.event, reason, data, info=info)
+                    PiWebhookEvent.objects.filter(pk=e.pk).update(
+                        processed_at=timezone.now(), locked_until=None,
+                        attempts=e.attempts + 1, last_error="",
+                    )
+                done += 1
+                log_event("webhook.processed", {"pid": e.pid, "event": e.event, "outcome": outcome})
+            except Exception as exc:
+                attempts = e.attempts + 1
+                give_up = attempts >= max_attempts
+                error = "local payment not found" if isinstance(exc, LocalPaymentNotFound) else repr(exc)
+                PiWebhookEvent.objects.filter(pk=e.pk).update(
+                    attempts=attempts,
+                    last_error=error[:255],
+                    # backoff lineal antes del siguiente intento
+                    locked_until=None if give_up else timezone.now() + timedelta(seconds=30 * attempts),
+                    processed_at=timezone.now() if give_up else None,
+                )
+                if not give_up:
+                    stalled.add(e.pid)
+                log_event("webhook.process_error", {"pid": e.pid, "event": e.event, "error": error, "gave_up": give_up},
+                          logging.ERROR if give_up else logging.WARNING)
+        return done
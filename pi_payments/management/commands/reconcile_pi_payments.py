@@ -0,0 +1,79 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from django.utils import timezone
+
+from pi_payments.client import PiClient
+from pi_payments.models import Payment, ReconcileCheckpoint
+from pi_payments.sync import sync_payments
+from pi_payments.utils import log_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcilia pagos 'initiated' atascados consultando su estado en Pi. "
+        "Recorre por lotes de pk con checkpoint (reanudable) y se puede repartir "
+        "entre varias máquinas con --shard/--shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stale-minutes", type=int, default=15,
+                            help="Solo pagos iniciados hace más de N minutos.")
+        parser.add_argument("--batch", type=int, default=200, help="Pagos leídos de BD por lote.")
+        parser.add_argument("--shard", type=int, default=0, help="Índice de este shard (0..shards-1).")
+        parser.add_argument("--shards", type=int, default=1, help="Número total de shards.")
+        parser.add_argument("--workers", type=int, default=None, help="Consultas concurrentes a Pi (PI_SYNC_WORKERS).")
+        parser.add_argument("--rate", type=float, default=None, help="Peticiones/s máximas a Pi (PI_SYNC_RATE).")
+        parser.add_argument("--api-base", default=None, help="Otra URL de la API de Pi (p. ej. un stub local).")
+        parser.add_argument("--restart", action="store_true", help="Ignora el checkpoint y empieza desde el principio.")
+
+    def handle(self, *args, **opts):
+        shards, shard = opts["shards"], opts["shard"]
+        if shards < 1 or not 0 <= shard < shards:
+            raise CommandError("--shard debe estar entre 0 y --shards - 1")
+
+        checkpoint, _ = ReconcileCheckpoint.objects.get_or_create(name=f"reconcile:{shard}/{shards}")
+        last_pk = 0 if opts["restart"] else checkpoint.last_pk
+        cutoff = timezone.now() - timedelta(minutes=opts["stale_minutes"])
+
+        fetch_opts = {"workers": opts["workers"], "rate": opts["rate"]}
+        if opts["api_base"]:
+            fetch_opts["client"] = PiClient(base=opts["api_base"])
+
+        scanned = ok = errors = 0
+        stats: dict[str, int] = {}
+        while True:
+            # Usa el índice (status, id): el lote siguiente empieza donde acabó el anterior.
+            # El reparto (pk % shards) se filtra en SQL: cada shard solo lee sus filas.
+            qs = Payment.objects.filter(status=Payment.INITIATED, pk__gt=last_pk, created_at__lt=cutoff)
+            if shards > 1:
+                qs = qs.alias(shard=F("pk") % shards).filter(shard=shard)
+            rows = list(
+                qs
+                .exclude(provider_payment_id__isnull=True)
+                .exclude(provider_payment_id="")
+                .order_by("pk")[:opts["batch"]]  # con raw_payload: sync_payments lo fusiona
+            )
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+            scanned += len(rows)
+
+            ok_n, fail_n = sync_payments(rows, fail_cancelled=True, stats=stats, **fetch_opts)
+            ok += ok_n
+            errors += fail_n
+
+            # Tras aplicar el lote: si el proceso muere, se reanuda desde aquí
+            ReconcileCheckpoint.objects.filter(pk=checkpoint.pk).update(last_pk=last_pk, updated_at=timezone.now())
+
+        # Pasada completa: la siguiente ejecución vuelve a empezar desde el principio
+        ReconcileCheckpoint.objects.filter(pk=checkpoint.pk).update(last_pk=0, updated_at=timezone.now())
+
+        summary = {"shard": f"{shard}/{shards}", "scanned": scanned, "ok": ok, "errors": errors, **stats}
+        log_event("reconcile.done", summary)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciliados {scanned} pagos (shard {shard}/{shards}): "
+            f"{stats.get('confirmed', 0)} confirmados, {stats.get('failed', 0)} fallidos, "
+            f"{stats.get('not_found', 0)} no encontrados en Pi, {errors} errores."
+        ))
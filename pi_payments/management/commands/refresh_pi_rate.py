@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from pi_payments.rates import precompute_prices, refresh_rate
+
+
+class Command(BaseCommand):
+    help = (
+        "Lee el tipo EUR/π de la fuente configurada (PI_RATE_SOURCE); si cambió crea una "
+        "versión nueva y recalcula los precios en π de los servicios activos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default=None, help="Ruta a otra fuente (callable), p. ej. pi_payments.rates.url_source.")
+        parser.add_argument("--reprice", action="store_true", help="Recalcula los precios aunque el tipo no haya cambiado.")
+
+    def handle(self, *args, **opts):
+        rate = refresh_rate(opts["source"])
+        if rate is None:
+            self.stdout.write(self.style.WARNING("No hay tipo EUR/π válido."))
+            return
+        if opts["reprice"]:
+            n = precompute_prices(rate)
+            self.stdout.write(f"Precios recalculados: {n}")
+        self.stdout.write(self.style.SUCCESS(f"Tipo vigente v{rate.version}: {rate.eur_per_pi} €/π"))
@@ -0,0 +1,77 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+
+CHUNK = 500
+
+
+def _dec(value):
+    if value in (None, ""):
+        return None
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError, TypeError):
+        return None
+
+
+def _pi_status(info):
+    status = (info or {}).get("status")
+    if isinstance(status, str):
+        return status.strip().lower()[:32]
+    if not isinstance(status, dict):
+        return ""
+    if status.get("cancelled") or status.get("user_cancelled"):
+        return "cancelled"
+    if status.get("developer_completed"):
+        return "completed"
+    if status.get("transaction_verified"):
+        return "verified"
+    if status.get("developer_approved"):
+        return "approved"
+    return "created"
+
+
+def backfill(apps, schema_editor):
+    """
+    Recorre Payment por rangos de pk (streaming, sin cargar la tabla entera)
+    y copia txid / pricing / estado Pi de raw_payload a sus columnas.
+    """
+    Payment = apps.get_model("pi_payments", "Payment")
+    last_pk = 0
+    while True:
+        rows = list(
+            Payment.objects
+            .filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "raw_payload")[:CHUNK]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+
+        batch = []
+        for p in rows:
+            raw = p.raw_payload or {}
+            info = raw.get("pi_info_at_complete") or raw.get("pi_last_info") or raw
+            pricing = raw.get("pricing") or {}
+            txid = raw.get("txid") or (info.get("transaction") or {}).get("txid") or info.get("txid")
+
+            p.txid = (txid or None) and str(txid)[:128]
+            p.pi_status = _pi_status(info)
+            p.eur_per_pi = _dec(pricing.get("eur_per_pi"))
+            p.amount_pi = _dec(pricing.get("amount_pi"))
+            batch.append(p)
+
+        Payment.objects.bulk_update(batch, ["txid", "pi_status", "eur_per_pi", "amount_pi"])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("pi_payments", "0002_payment_hot_columns"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-19 12:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pi_payments', '0003_backfill_payment_hot_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('webhook', 'Webhook'), ('failed', 'Failed')], max_length=20)),
+                ('reason', models.CharField(blank=True, default='', max_length=255)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='pi_payments.payment')),
+            ],
+            options={
+                'ordering': ('created_at', 'id'),
+                'indexes': [models.Index(fields=['payment', 'created_at'], name='pi_payments_payment_53efb3_idx')],
+            },
+        ),
+    ]
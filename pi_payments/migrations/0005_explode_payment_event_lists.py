@@ -0,0 +1,75 @@
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+CHUNK = 500
+
+
+def _at(value):
+    dt = parse_datetime(value) if isinstance(value, str) else None
+    if dt is None:
+        return timezone.now()
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, dt_timezone.utc)
+    return dt
+
+
+def explode(apps, schema_editor):
+    """
+    Convierte raw_payload["webhooks"] y raw_payload["fail_reasons"] en filas
+    PaymentEvent y elimina esas listas del JSON. Recorre Payment por rangos de pk.
+    """
+    Payment = apps.get_model("pi_payments", "Payment")
+    PaymentEvent = apps.get_model("pi_payments", "PaymentEvent")
+    last_pk = 0
+    while True:
+        rows = list(
+            Payment.objects
+            .filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "raw_payload")[:CHUNK]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+
+        events, touched = [], []
+        for p in rows:
+            raw = p.raw_payload or {}
+            webhooks = raw.pop("webhooks", None) or []
+            fails = raw.pop("fail_reasons", None) or []
+            if not (webhooks or fails):
+                continue
+            for w in webhooks:
+                data = (w or {}).get("data") or {}
+                event = (data.get("event") or data.get("status") or "")
+                events.append(PaymentEvent(
+                    payment_id=p.pk, kind="webhook", reason=str(event).strip().lower()[:255],
+                    data=data, created_at=_at((w or {}).get("at")),
+                ))
+            for f in fails:
+                events.append(PaymentEvent(
+                    payment_id=p.pk, kind="failed", reason=str((f or {}).get("reason") or "")[:255],
+                    created_at=_at((f or {}).get("at")),
+                ))
+            p.raw_payload = raw
+            touched.append(p)
+
+        # Cada lote en su transacción: si se corta, no duplica eventos al reanudar
+        with transaction.atomic(using=schema_editor.connection.alias):
+            PaymentEvent.objects.bulk_create(events, batch_size=CHUNK)
+            Payment.objects.bulk_update(touched, ["raw_payload"])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("pi_payments", "0004_paymentevent"),
+    ]
+
+    operations = [
+        migrations.RunPython(explode, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-19 12:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pi_payments', '0005_explode_payment_event_lists'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PiWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pid', models.CharField(max_length=100)),
+                ('event', models.CharField(blank=True, default='', max_length=32)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'ordering': ('received_at', 'id'),
+                'indexes': [models.Index(fields=['processed_at', 'received_at'], name='pi_payments_process_5d4c39_idx')],
+                'constraints': [models.UniqueConstraint(fields=('pid', 'event'), name='uniq_pi_webhook_pid_event')],
+            },
+        ),
+    ]
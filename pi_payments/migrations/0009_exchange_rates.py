@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-19 12:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pi_payments', '0008_reconcile'),
+        ('services', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(unique=True)),
+                ('eur_per_pi', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('source', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-version'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ServicePiPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rate_version', models.PositiveIntegerField()),
+                ('eur_per_pi', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('amount_pi', models.DecimalField(decimal_places=4, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pi_price', to='services.service')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-19 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pi_payments', '0009_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('initiated', 'Initiated'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], max_length=20)),
+                ('reason', models.CharField(blank=True, choices=[('', '-'), ('user_cancelled', 'User cancelled'), ('insufficient_balance', 'Insufficient balance'), ('pi_rejected', 'Rejected by Pi'), ('pi_cancelled', 'Cancelled/failed on Pi'), ('server_check', 'Server-side check failed'), ('other', 'Other')], default='', max_length=20)),
+                ('payments', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_pi', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+            ],
+            options={
+                'ordering': ('-day', 'status', 'reason'),
+                'constraints': [models.UniqueConstraint(fields=('day', 'status', 'reason'), name='uniq_payment_rollup_day_status_reason')],
+            },
+        ),
+    ]
@@ -1,7 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+
+from .signals import payment_transitioned
 
 class Payment(models.Model):
     INITIATED = "initiated"
@@ -22,49 +25,286 @@ class Payment(models.Model):
     currency            = models.CharField(max_length=10, default="EUR")
     nonce               = models.CharField(max_length=64, unique=True)
 
+    # Campos "calientes" promovidos desde raw_payload (consultables e indexados)
+    txid                = models.CharField(max_length=128, null=True, blank=True, db_index=True)
+    pi_status           = models.CharField(max_length=32, blank=True, default="", db_index=True)
+    eur_per_pi          = models.DecimalField(max_digits=18, decimal_places=8, null=True, blank=True)
+    amount_pi           = models.DecimalField(max_digits=18, decimal_places=6, null=True, blank=True)
+
     raw_payload         = models.JSONField(default=dict, blank=True)
     created_at          = models.DateTimeField(auto_now_add=True)
     completed_at        = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # escaneo por lotes de pagos atascados (reconcile_pi_payments)
+            models.Index(fields=["status", "id"], name="pi_payment_status_id_idx"),
+        ]
+
     def __str__(self) -> str:
         return f"Payment({self.provider} · {self.provider_payment_id or '-'})"
 
-    def mark_confirmed(self, tx_time=None, save_order=True):
-        self.status = self.CONFIRMED
-        self.completed_at = tx_time or timezone.now()
-        self.save(update_fields=["status", "completed_at"])
-        if save_order:
-            o = self.order
-            if getattr(o, "status", None) != getattr(o, "PAID", "paid"):
-                o.status = getattr(o, "PAID", "paid")
-                o.paid_at = o.paid_at or self.completed_at
-                o.save(update_fields=["status", "paid_at"])
-
-    def mark_failed(self, reason: str | None = None, save_order: bool = True):
-        raw = self.raw_payload or {}
-        if reason:
-            raw.setdefault("fail_reasons", []).append(
-                {"reason": reason, "at": timezone.now().isoformat()}
+    @staticmethod
+    def pi_status_from_info(info: dict | None) -> str:
+        """
+        Normaliza el estado remoto de Pi a una etiqueta corta.
+        La API devuelve 'status' como dict de flags (developer_approved, ...);
+        los webhooks lo mandan como string.
+        """
+        status = (info or {}).get("status")
+        if isinstance(status, str):
+            return status.strip().lower()[:32]
+        if not isinstance(status, dict):
+            return ""
+        if status.get("cancelled") or status.get("user_cancelled"):
+            return "cancelled"
+        if status.get("developer_completed"):
+            return "completed"
+        if status.get("transaction_verified"):
+            return "verified"
+        if status.get("developer_approved"):
+            return "approved"
+        return "created"
+
+    @staticmethod
+    def txid_from_info(info: dict | None) -> str | None:
+        info = info or {}
+        return (info.get("transaction") or {}).get("txid") or info.get("txid") or None
+
+    # ---------- transiciones de estado (compare-and-set) ----------
+    #
+    # Cada transición es un único UPDATE ... WHERE status IN (...) sobre Payment
+    # más, en la misma transacción, un UPDATE condicional sobre Order. Si el
+    # UPDATE no toca filas, otro proceso (webhook/complete) ya hizo la transición
+    # y no se hace nada más: idempotente sin bloquear filas durante llamadas HTTP.
+    # payment_transitioned se emite una sola vez, tras el commit.
+
+    def _transition(self, to: str, from_states, fields: dict, order_update=None, reason: str = "") -> bool:
+        Order = self._meta.get_field("order").related_model
+        with transaction.atomic():
+            changed = (
+                Payment.objects
+                .filter(pk=self.pk, status__in=list(from_states))
+                .update(status=to, **fields)
             )
-        self.raw_payload = raw
-        self.status = self.FAILED
-        self.completed_at = None
-        self.save(update_fields=["status", "raw_payload", "completed_at"])
+            if not changed:
+                return False
+            if order_update:
+                exclude_status, values = order_update
+                Order.objects.filter(pk=self.order_id).exclude(status=exclude_status).update(**values)
+            if reason and to == self.FAILED:
+                PaymentEvent.record(self, PaymentEvent.FAILED, reason=reason)
 
+            self.status = to
+            for name, value in fields.items():
+                setattr(self, name, value)
+            # el Order cacheado (si lo hay) ya no refleja la BD
+            if "order" in self._state.fields_cache:
+                del self._state.fields_cache["order"]
+            transaction.on_commit(
+                lambda: payment_transitioned.send(sender=Payment, payment=self, status=to, reason=reason)
+            )
+        return True
+
+    def mark_confirmed(self, tx_time=None, save_order=True, txid: str | None = None, extra: dict | None = None) -> bool:
+        """INITIATED/FAILED → CONFIRMED y Order → paid (conserva paid_at si ya lo tenía)."""
+        completed_at = tx_time or timezone.now()
+        fields = {"completed_at": completed_at, **(extra or {})}
+        if txid:
+            fields["txid"] = txid
+        order_update = None
         if save_order:
-            o = self.order
-            # Solo cancela si aún no está pagado
-            if o.status not in (getattr(o, "PAID", "paid"),):
-                o.status = getattr(o, "CANCELLED", "cancelled")
-                o.paid_at = None
-                o.save(update_fields=["status", "paid_at"])
-
-
-@receiver(post_save, sender=Payment)
-def _sync_order_status_on_payment(sender, instance: Payment, **kwargs):
-    if instance.status == Payment.CONFIRMED:
-        o = instance.order
-        if o.status != getattr(o, "PAID", "paid"):
-            o.status = getattr(o, "PAID", "paid")
-            o.paid_at = o.paid_at or (instance.completed_at or timezone.now())
-            o.save(update_fields=["status", "paid_at"])
+            order_update = ("paid", {"status": "paid", "paid_at": Coalesce("paid_at", Value(completed_at))})
+        return self._transition(self.CONFIRMED, (self.INITIATED, self.FAILED), fields, order_update)
+
+    def mark_failed(self, reason: str | None = None, save_order: bool = True) -> bool:
+        """INITIATED → FAILED y cancela el Order si aún no está pagado."""
+        order_update = ("paid", {"status": "cancelled", "paid_at": None}) if save_order else None
+        return self._transition(self.FAILED, (self.INITIATED,), {"completed_at": None}, order_update, reason or "")
+
+    def mark_initiated(self) -> bool:
+        """FAILED → INITIATED (p. ej. Pi aprueba tras un fallo previo)."""
+        return self._transition(self.INITIATED, (self.FAILED,), {})
+
+
+class PaymentEvent(models.Model):
+    """
+    Log append-only de eventos de un pago (webhooks, motivos de fallo...).
+    Sustituye a las listas raw_payload["webhooks"] / ["fail_reasons"]:
+    cada evento es un INSERT y la fila de Payment no crece.
+    """
+    WEBHOOK = "webhook"
+    FAILED  = "failed"
+    KIND_CHOICES = [
+        (WEBHOOK, "Webhook"),
+        (FAILED,  "Failed"),
+    ]
+
+    payment    = models.ForeignKey(Payment, related_name="events", on_delete=models.CASCADE)
+    kind       = models.CharField(max_length=20, choices=KIND_CHOICES)
+    reason     = models.CharField(max_length=255, blank=True, default="")
+    data       = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ("created_at", "id")
+        indexes = [
+            models.Index(fields=["payment", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_kind_display()} · {self.created_at:%Y-%m-%d %H:%M}"  # type: ignore[attr-defined]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("PaymentEvent es append-only; no se puede modificar.")
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def record(cls, payment: Payment, kind: str, reason: str = "", data: dict | None = None) -> "PaymentEvent":
+        return cls.objects.create(payment=payment, kind=kind, reason=(reason or "")[:255], data=data or {})
+
+
+class PiWebhookEvent(models.Model):
+    """
+    Bandeja de entrada de webhooks de Pi. El endpoint solo inserta aquí y responde
+    204; `manage.py process_pi_events` aplica los eventos en orden por pago.
+    (pid, event) es único: los reenvíos del mismo evento se descartan en el INSERT.
+    """
+    pid          = models.CharField(max_length=100)
+    event        = models.CharField(max_length=32, blank=True, default="")
+    payload      = models.JSONField(default=dict, blank=True)
+    received_at  = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease del worker que lo procesa
+    attempts     = models.PositiveSmallIntegerField(default=0)
+    last_error   = models.CharField(max_length=255, blank=True, default="")
+
+    class Meta:
+        ordering = ("received_at", "id")
+        constraints = [
+            models.UniqueConstraint(fields=["pid", "event"], name="uniq_pi_webhook_pid_event"),
+        ]
+        indexes = [
+            models.Index(fields=["processed_at", "received_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.pid} · {self.event or '-'}"
+
+
+class PiSyncJob(models.Model):
+    """
+    Sincronización masiva con Pi lanzada desde el admin. Las selecciones grandes
+    se procesan en segundo plano; `done` es a la vez progreso y punto de reanudación.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE    = "done"
+    FAILED  = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE,    "Done"),
+        (FAILED,  "Failed"),
+    ]
+
+    created_by  = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    status      = models.CharField(max_length=12, choices=STATUS_CHOICES, default=PENDING)
+    payment_ids = models.JSONField(default=list, blank=True)
+    total       = models.PositiveIntegerField(default=0)
+    done        = models.PositiveIntegerField(default=0)
+    ok          = models.PositiveIntegerField(default=0)
+    errors      = models.PositiveIntegerField(default=0)
+    last_error  = models.CharField(max_length=255, blank=True, default="")
+    created_at  = models.DateTimeField(auto_now_add=True)
+    started_at  = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # último lote guardado
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-created_at",)
+
+    def __str__(self) -> str:
+        return f"Sync #{self.pk} · {self.done}/{self.total}"
+
+    @property
+    def progress(self) -> int:
+        return int(self.done * 100 / self.total) if self.total else 100
+
+
+class ReconcileCheckpoint(models.Model):
+    """Último pk procesado por `reconcile_pi_payments` (uno por shard) para poder reanudar."""
+    name       = models.CharField(max_length=64, unique=True)
+    last_pk    = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} @ {self.last_pk}"
+
+
+class ExchangeRate(models.Model):
+    """
+    Histórico del tipo EUR/π. Cada cambio de tipo es una fila nueva con la versión
+    siguiente (ver pi_payments.rates); la versión única impide que dos procesos creen
+    la misma.
+    """
+    version    = models.PositiveIntegerField(unique=True)
+    eur_per_pi = models.DecimalField(max_digits=18, decimal_places=8)
+    source     = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-version"]
+
+    def __str__(self) -> str:
+        return f"v{self.version} · {self.eur_per_pi} €/π"
+
+
+class ServicePiPrice(models.Model):
+    """Precio en π de un servicio, precalculado para una versión del tipo EUR/π."""
+    service      = models.OneToOneField("services.Service", related_name="pi_price", on_delete=models.CASCADE)
+    rate_version = models.PositiveIntegerField()
+    eur_per_pi   = models.DecimalField(max_digits=18, decimal_places=8)
+    amount_pi    = models.DecimalField(max_digits=18, decimal_places=4)
+    updated_at   = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.service_id} · {self.amount_pi} π (v{self.rate_version})"
+
+
+class PaymentDailyRollup(models.Model):
+    """Pagos por día de creación, estado actual y tipo de fallo; ver orders/rollups.py."""
+    # Conjunto cerrado: el motivo real es texto libre (lo manda el cliente en pi_cancel)
+    # y no puede ser clave del resumen. orders.rollups.REASON_BUCKETS lo clasifica.
+    USER_CANCELLED = "user_cancelled"
+    INSUFFICIENT   = "insufficient_balance"
+    PI_REJECTED    = "pi_rejected"
+    PI_CANCELLED   = "pi_cancelled"
+    SERVER_CHECK   = "server_check"
+    OTHER          = "other"
+    REASON_CHOICES = [
+        ("", "-"),
+        (USER_CANCELLED, "User cancelled"),
+        (INSUFFICIENT,   "Insufficient balance"),
+        (PI_REJECTED,    "Rejected by Pi"),
+        (PI_CANCELLED,   "Cancelled/failed on Pi"),
+        (SERVER_CHECK,   "Server-side check failed"),
+        (OTHER,          "Other"),
+    ]
+
+    day       = models.DateField()
+    status    = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+    reason    = models.CharField(max_length=20, choices=REASON_CHOICES, blank=True, default="")
+    payments  = models.IntegerField(default=0)
+    amount    = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_pi = models.DecimalField(max_digits=20, decimal_places=6, default=0)
+
+    class Meta:
+        ordering = ("-day", "status", "reason")
+        constraints = [
+            models.UniqueConstraint(fields=["day", "status", "reason"], name="uniq_payment_rollup_day_status_reason"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.day} · {self.status}{' · ' + self.reason if self.reason else ''}: {self.payments}"
@@ -0,0 +1,221 @@
+"""
+Tipo de cambio EUR/π versionado.
+
+- get_rate(): tipo vigente como Rate(version, eur_per_pi), cacheado en memoria del
+  proceso PI_RATE_TTL segundos. Al caducar se sigue sirviendo el valor anterior y
+  se refresca en un hilo de fondo (uno por proceso). En frío solo lee la BD: la
+  primera versión la crea `manage.py refresh_pi_rate`.
+- refresh_rate(): consulta la fuente (PI_RATE_SOURCE) y, si el tipo cambió, crea
+  una versión nueva (ExchangeRate) y precalcula en bloque los precios en π de los
+  servicios activos (ServicePiPrice), todo en la misma transacción y bajo un
+  bloqueo de la versión vigente. La versión es única: si dos procesos crean la
+  misma a la vez (p. ej. la primera, cuando no hay fila que bloquear), uno falla
+  y devuelve la del otro.
+- pi_price(service): precio en π con el tipo vigente; usa el precalculado si es de
+  la versión actual (haz select_related("pi_price") en la consulta).
+
+Una fuente es cualquier callable sin argumentos que devuelve € por π (Decimal).
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils.module_loading import import_string
+
+from pi_payments.models import ExchangeRate, ServicePiPrice
+
+log = logging.getLogger(__name__)
+
+PI_QUANT = Decimal("0.0001")
+RATE_QUANT = Decimal("0.00000001")
+CHUNK = 500
+
+
+@dataclass(frozen=True)
+class Rate:
+    version: int
+    eur_per_pi: Decimal
+
+
+def to_pi(euros, eur_per_pi: Decimal) -> Decimal | None:
+    """Convierte € a π con 4 decimales (como el checkout)."""
+    if not eur_per_pi or eur_per_pi <= 0:
+        return None
+    euros = euros if isinstance(euros, Decimal) else Decimal(str(euros))
+    return (euros / eur_per_pi).quantize(PI_QUANT, rounding=ROUND_HALF_UP)
+
+
+# ---------- fuentes ----------
+def settings_source() -> Decimal:
+    """Tipo fijo de settings.PI_EUR_PER_PI (por defecto)."""
+    return Decimal(str(getattr(settings, "PI_EUR_PER_PI", "0")))
+
+
+def url_source() -> Decimal:
+    """GET a PI_RATE_URL, que devuelve JSON con la clave "eur_per_pi"."""
+    r = requests.get(settings.PI_RATE_URL, timeout=(3.05, 5))
+    r.raise_for_status()
+    return Decimal(str(r.json()["eur_per_pi"]))
+
+
+def _source_name() -> str:
+    return getattr(settings, "PI_RATE_SOURCE", "pi_payments.rates.settings_source")
+
+
+# ---------- versiones y precios precalculados ----------
+def precompute_prices(rate: ExchangeRate, services=None) -> int:
+    """Upsert en bloque de ServicePiPrice para los servicios dados (por defecto, los activos)."""
+    from services.models import Service
+
+    if services is None:
+        services = Service.objects.filter(is_active=True).only("id", "price")
+    rows = [
+        ServicePiPrice(
+            service_id=s.pk,
+            rate_version=rate.version,
+            eur_per_pi=rate.eur_per_pi,
+            amount_pi=to_pi(s.price or 0, rate.eur_per_pi),
+        )
+        for s in services
+    ]
+    ServicePiPrice.objects.bulk_create(
+        rows,
+        batch_size=CHUNK,
+        update_conflicts=True,
+        unique_fields=["service"],
+        update_fields=["rate_version", "eur_per_pi", "amount_pi", "updated_at"],
+    )
+    return len(rows)
+
+
+def refresh_rate(source=None) -> ExchangeRate | None:
+    """Lee la fuente; si el tipo cambió crea versión nueva y recalcula precios. Devuelve la vigente."""
+    name = source or _source_name()
+    value = import_string(name)()
+    value = Decimal(str(value)).quantize(RATE_QUANT)
+    latest = ExchangeRate.objects.first()
+    if value <= 0:
+        log.warning("Tipo EUR/π no válido desde %s: %s", name, value)
+        return latest
+    if latest and latest.eur_per_pi == value:
+        return latest
+
+    with transaction.atomic():
+        # Serializa a quienes refrescan a la vez (cron + hilos de varios workers): bloquea la
+        # versión vigente y vuelve a leerla; si otro ya creó la nueva, no se duplica.
+        list(ExchangeRate.objects.select_for_update()[:1])
+        latest = ExchangeRate.objects.first()
+        if latest and latest.eur_per_pi == value:
+            return latest
+        try:
+            with transaction.atomic():
+                rate = ExchangeRate.objects.create(
+                    version=(latest.version if latest else 0) + 1,
+                    eur_per_pi=value, source=name.rsplit(".", 1)[-1][:64],
+                )
+        except IntegrityError:
+            # Otro proceso acaba de crear esa versión (lectura con bloqueo: ve su commit)
+            return ExchangeRate.objects.select_for_update().first()
+        n = precompute_prices(rate)
+    log.info("Tipo EUR/π v%s = %s (%s precios recalculados)", rate.version, value, n)
+    _set(Rate(rate.version, rate.eur_per_pi))
+    return rate
+
+
+# ---------- caché de proceso ----------
+_lock = threading.Lock()
+_current: Rate | None = None
+_expires = 0.0
+_refreshing = False
+
+
+def _ttl() -> float:
+    return float(getattr(settings, "PI_RATE_TTL", 300))
+
+
+def _set(rate: Rate | None) -> None:
+    global _current, _expires
+    with _lock:
+        _current = rate
+        _expires = time.monotonic() + _ttl()
+
+
+def _load() -> Rate | None:
+    # Nunca consulta la fuente (HTTP) dentro de una request: la primera versión la
+    # crea `manage.py refresh_pi_rate` (Procfile); hasta entonces, PI_EUR_PER_PI.
+    row = ExchangeRate.objects.first()
+    if row is None:
+        log.warning("No hay ExchangeRate; ejecuta refresh_pi_rate. Uso PI_EUR_PER_PI")
+        return Rate(0, settings_source())
+    return Rate(row.version, row.eur_per_pi)
+
+
+def _refresh_in_background() -> None:
+    global _refreshing
+    try:
+        close_old_connections()
+        refresh_rate()
+        _set(_load())
+    except Exception:
+        log.exception("No se pudo refrescar el tipo EUR/π")
+        _set(_current)  # reintenta tras otro TTL
+    finally:
+        _refreshing = False
+        connection.close()
+
+
+def get_rate() -> Rate | None:
+    """Tipo vigente. Solo la primera llamada del proceso toca la BD de forma síncrona."""
+    global _refreshing
+    current = _current
+    if current is not None and time.monotonic() < _expires:
+        return current
+
+    if current is None:
+        try:
+            _set(_load())
+        except Exception:
+            log.exception("No se pudo cargar el tipo EUR/π; uso PI_EUR_PER_PI")
+            return Rate(0, settings_source())
+        return _current
+
+    # Caducado: sirve el anterior y refresca en segundo plano
+    with _lock:
+        start = not _refreshing
+        _refreshing = True
+    if start:
+        threading.Thread(target=_refresh_in_background, name="pi-rate-refresh", daemon=True).start()
+    return current
+
+
+def pi_price(service, rate: Rate | None = None) -> Decimal | None:
+    """Precio en π del servicio con el tipo vigente."""
+    rate = rate or get_rate()
+    if rate is None:
+        return None
+    try:
+        pre = service.pi_price
+    except ServicePiPrice.DoesNotExist:
+        pre = None
+    if pre is not None and pre.rate_version == rate.version:
+        return pre.amount_pi
+    return to_pi(service.price or 0, rate.eur_per_pi)
+
+
+def update_service_prices(services) -> None:
+    """Recalcula el precio en π de unos servicios (p. ej. al cambiar precio o activarlos)."""
+    rate = ExchangeRate.objects.first()
+    if rate is None:
+        return
+    services = list(services)
+    precompute_prices(rate, [s for s in services if s.is_active])
+    inactive = [s.pk for s in services if not s.is_active]
+    if inactive:
+        ServicePiPrice.objects.filter(service_id__in=inactive).delete()
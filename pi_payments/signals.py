@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Se emite (vía transaction.on_commit) solo cuando un Payment cambia de estado
+# de verdad. kwargs: payment, status (nuevo estado), reason (opcional).
+payment_transitioned = Signal()
@@ -0,0 +1,270 @@
+"""
+Servidor local que imita la API de Pi Network (solo para desarrollo y pruebas de carga).
+
+Implementa lo que usa el proyecto:
+- GET  /v2/me                       (Bearer <accessToken>; un token que empiece por "bad" es inválido)
+- GET  /v2/payments/<pid>
+- POST /v2/payments/<pid>/approve
+- POST /v2/payments/<pid>/complete  {"txid": ...}
+
+Y unos endpoints auxiliares que en la vida real hace el Pi SDK/la wallet del usuario:
+- POST /_stub/payments              {"amount", "memo", "metadata", "uid"} → crea el pago
+- POST /_stub/payments/<pid>/submit → el usuario firma: genera txid
+- POST /_stub/payments/<pid>/cancel → el usuario cancela
+- GET  /_stub/stats                 → contadores
+
+Latencia, tasa de errores 5xx y webhooks hacia la app son configurables (StubConfig).
+Arranque: `python manage.py pi_stub_server` y `PI_API_BASE=http://127.0.0.1:8765`.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+_PAYMENT_RE = re.compile(r"^/v2/payments/(?P<pid>[\w-]+)(?:/(?P<action>approve|complete))?/?$")
+_STUB_RE = re.compile(r"^/_stub/payments/(?P<pid>[\w-]+)/(?P<action>submit|cancel)/?$")
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0.0       # latencia base por petición
+    jitter_ms: float = 0.0        # + uniforme(0, jitter)
+    error_rate: float = 0.0       # probabilidad de responder 503 (sin aplicar nada)
+    webhook_url: str = ""         # si se indica, envía approved/completed/cancelled aquí
+    webhook_delay_ms: float = 0.0
+    webhook_duplicate_rate: float = 0.0  # reenvía el mismo webhook (Pi lo hace a veces)
+
+
+class StubState:
+    """Pagos en memoria, protegidos por un lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.payments: dict[str, dict] = {}
+        self.stats: dict[str, int] = {}
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def create(self, amount, memo: str, metadata: dict, uid: str) -> dict:
+        pid = secrets.token_hex(12)
+        payment = {
+            "identifier": pid,
+            "user_uid": uid,
+            "amount": amount,
+            "memo": memo,
+            "metadata": metadata or {},
+            "from_address": "",
+            "to_address": "",
+            "direction": "user_to_app",
+            "network": "Pi Testnet",
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "status": {
+                "developer_approved": False,
+                "transaction_verified": False,
+                "developer_completed": False,
+                "cancelled": False,
+                "user_cancelled": False,
+            },
+            "transaction": None,
+        }
+        with self.lock:
+            self.payments[pid] = payment
+        return payment
+
+    def get(self, pid: str) -> dict | None:
+        with self.lock:
+            p = self.payments.get(pid)
+            return json.loads(json.dumps(p)) if p else None  # copia
+
+    def update(self, pid: str, fn) -> tuple[int, dict]:
+        """Aplica fn(payment) -> (status_http, error|None) bajo el lock."""
+        with self.lock:
+            p = self.payments.get(pid)
+            if p is None:
+                return 404, {"error": "payment_not_found"}
+            code, error = fn(p)
+            return code, (error or json.loads(json.dumps(p)))
+
+
+def _approve(p: dict):
+    st = p["status"]
+    if st["cancelled"] or st["user_cancelled"]:
+        return 400, {"error": "payment_cancelled"}
+    st["developer_approved"] = True
+    return 200, None
+
+
+def _submit(p: dict):
+    st = p["status"]
+    if not st["developer_approved"] or st["cancelled"] or st["user_cancelled"]:
+        return 400, {"error": "payment_not_approved"}
+    if not p["transaction"]:
+        txid = secrets.token_hex(32)
+        p["transaction"] = {"txid": txid, "verified": True, "_link": f"https://stub.local/tx/{txid}"}
+        st["transaction_verified"] = True
+    return 200, None
+
+
+def _complete(txid: str):
+    def fn(p: dict):
+        st = p["status"]
+        tx = p["transaction"] or {}
+        if st["cancelled"] or st["user_cancelled"]:
+            return 400, {"error": "payment_cancelled"}
+        if not tx or tx.get("txid") != txid:
+            return 400, {"error": "txid_mismatch"}
+        st["developer_completed"] = True
+        return 200, None
+    return fn
+
+
+def _cancel(p: dict):
+    st = p["status"]
+    if st["developer_completed"]:
+        return 400, {"error": "already_completed"}
+    st["user_cancelled"] = st["cancelled"] = True
+    return 200, None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "PiStub/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+    # Se rellenan en make_server()
+    config: StubConfig
+    state: StubState
+
+    def log_message(self, format, *args):  # silencio: con carga genera demasiado ruido
+        pass
+
+    # ---------- helpers ----------
+    def _send(self, code: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return {}
+        try:
+            return json.loads(self.rfile.read(n)) or {}
+        except ValueError:
+            return {}
+
+    def _delay_or_fail(self) -> bool:
+        """Simula latencia y errores. Devuelve True si ya respondió con 503."""
+        cfg = self.config
+        if cfg.latency_ms or cfg.jitter_ms:
+            time.sleep((cfg.latency_ms + random.uniform(0, cfg.jitter_ms)) / 1000)
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self.state.count("injected_errors")
+            self._send(503, {"error": "service_unavailable"})
+            return True
+        return False
+
+    def _key_ok(self) -> bool:
+        if (self.headers.get("Authorization") or "").startswith("Key "):
+            return True
+        self._send(401, {"error": "invalid_key"})
+        return False
+
+    def _webhook(self, event: str, payment: dict) -> None:
+        cfg = self.config
+        if not cfg.webhook_url:
+            return
+        body = {"event": event, "paymentId": payment["identifier"],
+                "txid": (payment.get("transaction") or {}).get("txid")}
+        copies = 2 if random.random() < cfg.webhook_duplicate_rate else 1
+
+        def send():
+            time.sleep(cfg.webhook_delay_ms / 1000)
+            for _ in range(copies):
+                try:
+                    requests.post(cfg.webhook_url, json=body, timeout=5)
+                    self.state.count("webhooks_sent")
+                except requests.RequestException:
+                    self.state.count("webhooks_failed")
+
+        threading.Thread(target=send, daemon=True).start()
+
+    # ---------- rutas ----------
+    def do_GET(self):
+        self.state.count("requests")
+        if self.path.rstrip("/") == "/_stub/stats":
+            with self.state.lock:
+                return self._send(200, dict(self.state.stats, payments=len(self.state.payments)))
+        if self._delay_or_fail():
+            return
+
+        if self.path.rstrip("/") == "/v2/me":
+            auth = self.headers.get("Authorization") or ""
+            token = auth[7:] if auth.startswith("Bearer ") else ""
+            if not token or token.startswith("bad"):
+                return self._send(401, {"error": "invalid_token"})
+            uid = hashlib.sha256(token.encode()).hexdigest()[:24]
+            return self._send(200, {"uid": uid, "username": f"stub_{uid[:8]}"})
+
+        m = _PAYMENT_RE.match(self.path)
+        if m and not m.group("action"):
+            if not self._key_ok():
+                return
+            p = self.state.get(m.group("pid"))
+            return self._send(200, p) if p else self._send(404, {"error": "payment_not_found"})
+
+        self._send(404, {"error": "not_found"})
+
+    def do_POST(self):
+        self.state.count("requests")
+        body = self._body()
+
+        # Lo que haría el SDK/wallet: sin latencia ni errores inyectados
+        if self.path.rstrip("/") == "/_stub/payments":
+            p = self.state.create(body.get("amount"), body.get("memo") or "",
+                                  body.get("metadata") or {}, body.get("uid") or "")
+            return self._send(201, p)
+        m = _STUB_RE.match(self.path)
+        if m:
+            fn = _submit if m.group("action") == "submit" else _cancel
+            code, p = self.state.update(m.group("pid"), fn)
+            if code == 200 and m.group("action") == "cancel":
+                self._webhook("cancelled", p)
+            return self._send(code, p)
+
+        if self._delay_or_fail():
+            return
+        m = _PAYMENT_RE.match(self.path)
+        if m and m.group("action"):
+            if not self._key_ok():
+                return
+            action = m.group("action")
+            fn = _approve if action == "approve" else _complete(body.get("txid") or "")
+            code, p = self.state.update(m.group("pid"), fn)
+            self.state.count(f"{action}_{code}")
+            if code == 200:
+                self._webhook("approved" if action == "approve" else "completed", p)
+            return self._send(code, p)
+
+        self._send(404, {"error": "not_found"})
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, config: StubConfig | None = None) -> ThreadingHTTPServer:
+    handler = type("BoundStubHandler", (StubHandler,), {"config": config or StubConfig(), "state": StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,217 @@
+"""
+Sincronización masiva con la API de Pi.
+
+- fetch_many(): GET /v2/payments/<pid> en paralelo con un pool acotado y
+  un límite de peticiones por segundo (PI_SYNC_WORKERS / PI_SYNC_RATE).
+- sync_payments(): aplica los resultados con bulk_update y confirma vía
+  Payment.mark_confirmed() (que sincroniza el Order); los pagos con txid que Pi
+  aún no da por completados se completan antes con /complete; opcionalmente marca
+  como fallidos los cancelados en Pi (lo usa reconcile_pi_payments).
+- start_job()/run_job(): ejecución en segundo plano con progreso en PiSyncJob.
+  Es un hilo daemon dentro del worker web: si gunicorn recicla el worker, el job
+  se queda RUNNING sin progreso y se puede reanudar pasado PI_SYNC_JOB_STALE s.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from pi_payments.client import PiClient, get_client
+from pi_payments.models import Payment, PiSyncJob
+
+CHUNK = 100
+
+
+class RateLimiter:
+    """Reparte las llamadas a un ritmo máximo de `rate` por segundo (0 = sin límite). Thread-safe."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_many(pids, workers: int | None = None, rate: float | None = None, client: PiClient | None = None):
+    """
+    Lee varios pagos de Pi en paralelo. Genera (pid, ok, info) en el mismo orden.
+    Las tareas solo hacen HTTP; el ORM se queda en el hilo que llama.
+    """
+    client = client or get_client()
+    workers = workers or int(getattr(settings, "PI_SYNC_WORKERS", 8))
+    limiter = RateLimiter(rate if rate is not None else float(getattr(settings, "PI_SYNC_RATE", 10)))
+
+    def one(pid):
+        limiter.wait()
+        try:
+            r = client.get_payment(pid)
+            return pid, r.ok, (r.json() if r.ok else {"status_code": r.status_code, "text": r.text[:500]})
+        except (requests.RequestException, ValueError) as e:
+            return pid, False, {"error": repr(e)}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pi-sync") as ex:
+        yield from ex.map(one, pids)
+
+
+def sync_payments(
+    payments: list[Payment],
+    *,
+    fail_cancelled: bool = False,
+    stats: dict | None = None,
+    **fetch_opts,
+) -> tuple[int, int]:
+    """
+    Sincroniza una lista de Payment con Pi. Devuelve (ok, errores).
+    `stats` (opcional) acumula cuántos se confirmaron/fallaron/no existen en Pi.
+    """
+    by_pid = {p.provider_payment_id: p for p in payments if p.provider_payment_id}
+    fail_n = len(payments) - len(by_pid)
+    stats = stats if stats is not None else {}
+
+    changed, to_confirm, to_complete, to_fail = [], [], [], []
+    for pid, ok, info in fetch_many(list(by_pid), **fetch_opts):
+        if not ok:
+            fail_n += 1
+            if info.get("status_code") == 404:
+                stats["not_found"] = stats.get("not_found", 0) + 1
+            continue
+        p = by_pid[pid]
+        # auditoría: se añade al payload existente (webhooks, approve, complete), como en utils.py
+        raw = p.raw_payload or {}
+        raw["pi_last_info"] = info
+        p.raw_payload = raw
+        p.pi_status = Payment.pi_status_from_info(info)
+        changed.append(p)
+
+        txid = Payment.txid_from_info(info)
+        if p.pi_status == "completed":
+            to_confirm.append((p, txid))
+        elif txid and p.pi_status != "cancelled":
+            to_complete.append((p, txid, info))
+        elif fail_cancelled and p.pi_status == "cancelled":
+            to_fail.append(p)
+
+    # Con txid pero sin developer_completed: el pago sigue abierto en Pi hasta que lo
+    # completemos nosotros. Solo se confirma en local si Pi acepta el /complete.
+    client = fetch_opts.get("client") or get_client()
+    incomplete = 0  # leídos bien pero sin poder completarlos: cuentan como error, no como ok
+    for p, txid, info in to_complete:
+        if not _amount_matches(p, info):
+            stats["amount_mismatch"] = stats.get("amount_mismatch", 0) + 1
+            incomplete += 1
+            continue
+        try:
+            r = client.complete(p.provider_payment_id, txid)
+        except requests.RequestException:
+            r = None
+        client.invalidate_payment(p.provider_payment_id)
+        if r is None or not r.ok:
+            stats["complete_failed"] = stats.get("complete_failed", 0) + 1
+            incomplete += 1
+            continue
+        p.pi_status = "completed"
+        to_confirm.append((p, txid))
+
+    Payment.objects.bulk_update(changed, ["raw_payload", "pi_status"], batch_size=CHUNK)
+    # Las transiciones son CAS: si otro proceso ya lo movió, no hacen nada
+    for p, txid in to_confirm:
+        if p.mark_confirmed(txid=txid):
+            stats["confirmed"] = stats.get("confirmed", 0) + 1
+    for p in to_fail:
+        if p.mark_failed("cancelled on Pi (reconcile)"):
+            stats["failed"] = stats.get("failed", 0) + 1
+    return len(changed) - incomplete, fail_n + incomplete
+
+
+def _amount_matches(p: Payment, info: dict) -> bool:
+    """Mismo criterio que pi_complete: el importe en π de Pi debe coincidir con el snapshot."""
+    try:
+        remote = Decimal(str(info.get("amount", "0")))
+    except InvalidOperation:
+        return False
+    return not (p.amount_pi and remote and p.amount_pi != remote)
+
+
+def resumable() -> Q:
+    """Jobs pendientes, fallidos o RUNNING sin progreso en PI_SYNC_JOB_STALE s (su hilo murió con el worker)."""
+    stale = timezone.now() - timedelta(seconds=int(getattr(settings, "PI_SYNC_JOB_STALE", 300)))
+    running = Q(status=PiSyncJob.RUNNING)
+    return (
+        Q(status__in=[PiSyncJob.PENDING, PiSyncJob.FAILED])
+        | running & Q(heartbeat_at__lt=stale)
+        | running & Q(heartbeat_at__isnull=True)
+    )
+
+
+def claim_job(job_id: int) -> bool:
+    """Pasa el job a RUNNING con un UPDATE condicional; False si no es reanudable (otro lo procesa)."""
+    now = timezone.now()
+    return bool(
+        PiSyncJob.objects
+        .filter(resumable(), pk=job_id)
+        .update(status=PiSyncJob.RUNNING, heartbeat_at=now, last_error="",
+                started_at=Coalesce("started_at", Value(now)), finished_at=None)
+    )
+
+
+def run_job(job_id: int) -> None:
+    """Procesa (o reanuda desde `done`) un PiSyncJob por lotes, guardando el progreso."""
+    if not claim_job(job_id):
+        return  # ya lo está procesando otro hilo/proceso
+    job = PiSyncJob.objects.get(pk=job_id)
+    ids = job.payment_ids or []
+    try:
+        for start in range(job.done, len(ids), CHUNK):
+            chunk = ids[start:start + CHUNK]
+            payments = list(Payment.objects.filter(pk__in=chunk))  # raw_payload se fusiona, no se sustituye
+            ok_n, fail_n = sync_payments(payments)
+            fail_n += len(chunk) - len(payments)  # borrados entre medias
+            # CAS sobre `done`: si otro ejecutor retomó el job, este se retira sin contar dos veces
+            if not PiSyncJob.objects.filter(pk=job_id, done=start, status=PiSyncJob.RUNNING).update(
+                done=start + len(chunk), ok=F("ok") + ok_n, errors=F("errors") + fail_n,
+                heartbeat_at=timezone.now(),
+            ):
+                return
+        PiSyncJob.objects.filter(pk=job_id).update(status=PiSyncJob.DONE, finished_at=timezone.now())
+    except Exception as e:
+        PiSyncJob.objects.filter(pk=job_id).update(
+            status=PiSyncJob.FAILED, last_error=repr(e)[:255], finished_at=timezone.now()
+        )
+        raise
+
+
+def _run_in_thread(job_id: int) -> None:
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception:
+        pass  # ya queda registrado en el job
+    finally:
+        connection.close()
+
+
+def start_job(job: PiSyncJob) -> None:
+    """Lanza el job en un hilo de fondo cuando la transacción actual haga commit."""
+    transaction.on_commit(
+        lambda: threading.Thread(target=_run_in_thread, args=(job.pk,), name=f"pi-sync-{job.pk}", daemon=True).start()
+    )
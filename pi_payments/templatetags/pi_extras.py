@@ -1,15 +1,23 @@
 from django import template
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
+
+from pi_payments import rates
 
 register = template.Library()
 
 @register.filter
 def to_pi(euros, eur_per_pi):
+    """€ → π con un tipo dado (p. ej. el snapshot de un Payment)."""
     try:
-        euros = Decimal(str(euros))
-        eur_per_pi = Decimal(str(eur_per_pi))
-        if eur_per_pi <= 0:
-            return ""
-        return (euros / eur_per_pi).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+        if not isinstance(eur_per_pi, Decimal):
+            eur_per_pi = Decimal(str(eur_per_pi))
+        value = rates.to_pi(euros, eur_per_pi)
+        return "" if value is None else value
     except Exception:
         return ""
+
+@register.filter
+def pi_price(service):
+    """Precio en π precalculado del servicio con el tipo vigente."""
+    value = rates.pi_price(service)
+    return "" if value is None else value
@@ -1,3 +1,486 @@
-from django.test import TestCase
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from orders.models import Order
+
+from . import rates
+from .client import PiClient, SingleFlightCache
+from .models import ExchangeRate, Payment, PaymentEvent, PiSyncJob, PiWebhookEvent
+from .signals import payment_transitioned
+from .stub import StubConfig, make_server
+from .sync import claim_job, resumable, run_job, sync_payments
+
+
+def make_payment(user, n=0, **fields) -> Payment:
+    order = Order.objects.create(user=user, status=Order.AWAITING, total=Decimal("10.00"))
+    fields.setdefault("provider_payment_id", f"pid-{order.pk}")
+    return Payment.objects.create(order=order, amount=order.total, nonce=f"nonce-{order.pk}-{n}", **fields)
+
+
+class FakePiClient:
+    """Cliente de Pi en memoria: el mismo pago para todos los pid, /complete configurable."""
+
+    def __init__(self, info: dict, complete_ok: bool = True):
+        self.info = info
+        self.complete_ok = complete_ok
+        self.completed = []
+
+    def get_payment(self, pid):
+        return SimpleNamespace(ok=True, json=lambda: self.info)
+
+    def complete(self, pid, txid):
+        self.completed.append(pid)
+        return SimpleNamespace(ok=self.complete_ok)
+
+    def invalidate_payment(self, pid):
+        pass
+
+
+class BackfillHotColumnsTests(TransactionTestCase):
+    """0003 copia txid / estado Pi / snapshot de precio de raw_payload a sus columnas."""
+
+    before = [("pi_payments", "0002_payment_hot_columns"), ("orders", "0002_initial")]
+    after = [("pi_payments", "0003_backfill_payment_hot_columns"), ("orders", "0002_initial")]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.addCleanup(self._migrate_to_latest)
+
+    def _migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_hot_columns_are_filled_from_the_payload(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        user = apps.get_model(settings.AUTH_USER_MODEL).objects.create(username="buyer")
+        Order = apps.get_model("orders", "Order")
+        Payment = apps.get_model("pi_payments", "Payment")
+        completed = Payment.objects.create(order=Order.objects.create(user_id=user.pk), nonce="a", raw_payload={
+            "pricing": {"eur_per_pi": "0.5", "amount_pi": "20"},
+            "pi_info_at_complete": {"status": {"developer_completed": True}, "transaction": {"txid": "tx1"}},
+        })
+        empty = Payment.objects.create(order=Order.objects.create(user_id=user.pk), nonce="b")
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        Payment = executor.loader.project_state(self.after).apps.get_model("pi_payments", "Payment")
+
+        row = Payment.objects.get(pk=completed.pk)
+        self.assertEqual((row.txid, row.pi_status), ("tx1", "completed"))
+        self.assertEqual((row.eur_per_pi, row.amount_pi), (Decimal("0.5"), Decimal("20")))
+        row = Payment.objects.get(pk=empty.pk)
+        self.assertEqual((row.txid, row.pi_status, row.amount_pi), (None, "", None))
+
+
+class SyncPayloadTests(TestCase):
+    def test_sync_keeps_the_payload_collected_earlier(self):
+        user = get_user_model().objects.create_user("buyer")
+        pay = make_payment(user, raw_payload={"pricing": {"amount_pi": "2"}, "pi_info_at_complete": {"x": 1}})
+        info = {"status": {"developer_approved": True}}
+
+        sync_payments([pay], client=FakePiClient(info))
+
+        raw = Payment.objects.get(pk=pay.pk).raw_payload
+        self.assertEqual(raw, {"pricing": {"amount_pi": "2"}, "pi_info_at_complete": {"x": 1}, "pi_last_info": info})
+
+
+class PiClientTests(TestCase):
+    def setUp(self):
+        self.pi = PiClient(base="https://pi.test/", api_key="k", pool_size=3, retries=2, timeout=(1, 2))
+
+    def test_only_gets_are_retried(self):
+        adapter = self.pi.session.get_adapter("https://pi.test")
+        retry = adapter.max_retries
+        self.assertEqual((retry.total, retry.allowed_methods), (2, frozenset({"GET"})))
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_session_is_reused_and_rebuilt_after_fork(self):
+        session = self.pi.session
+        self.assertIs(self.pi.session, session)
+        with mock.patch("pi_payments.client.os.getpid", return_value=-1):
+            self.assertIsNot(self.pi.session, session)
+
+    def test_requests_carry_key_timeout_and_metrics(self):
+        with mock.patch.object(self.pi.session, "request",
+                               side_effect=[SimpleNamespace(ok=True), SimpleNamespace(ok=False)]) as request:
+            self.pi.get_payment("p1")
+            self.pi.approve("p1", timeout=5)
+
+        first, second = request.call_args_list
+        self.assertEqual(first.args, ("GET", "https://pi.test/v2/payments/p1"))
+        self.assertEqual((first.kwargs["timeout"], first.kwargs["headers"]["Authorization"]), ((1, 2), "Key k"))
+        self.assertEqual((second.args[0], second.kwargs["timeout"]), ("POST", 5))
+        metrics = self.pi.metrics()
+        self.assertEqual((metrics["get_payment"]["count"], metrics["get_payment"]["errors"]), (1, 0))
+        self.assertEqual(metrics["approve"]["errors"], 1)
+
+
+class SingleFlightCacheTests(TestCase):
+    def test_concurrent_gets_share_one_load(self):
+        cache, release, calls = SingleFlightCache(ttl=60), threading.Event(), []
+
+        def loader():
+            calls.append(1)
+            release.wait(5)
+            return "v"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("k", loader))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        while not cache._inflight:
+            threading.Event().wait(0.01)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        self.assertEqual((len(calls), results), (1, ["v"] * 5))
+        self.assertEqual(cache.get("k", lambda: "other"), "v")  # dentro del TTL
+
+    def test_invalidate_discards_value_and_inflight_load(self):
+        cache = SingleFlightCache(ttl=60)
+        cache.get("k", lambda: "old")
+        cache.invalidate("k")
+        self.assertEqual(cache.get("k", lambda: "new"), "new")
+
+        def loader():
+            cache.invalidate("j")  # p. ej. un approve mientras se leía
+            return "stale"
+
+        cache.get("j", loader)
+        self.assertEqual(cache.get("j", lambda: "fresh"), "fresh")
+
+    def test_errors_and_uncacheable_values_are_not_stored(self):
+        cache = SingleFlightCache(ttl=60)
+        with self.assertRaises(ValueError):
+            cache.get("k", mock.Mock(side_effect=ValueError))
+        self.assertEqual(cache.get("k", lambda: 1, cacheable=lambda v: False), 1)
+        self.assertEqual(cache.get("k", lambda: 2), 2)
+
+    def test_fetch_payment_only_caches_ok_responses(self):
+        pi = PiClient(base="https://pi.test", api_key="k")
+        pi._payments.ttl = 60
+        responses = [SimpleNamespace(ok=False), SimpleNamespace(ok=True), SimpleNamespace(ok=False)]
+        with mock.patch.object(pi, "get_payment", side_effect=responses) as get_payment:
+            self.assertFalse(pi.fetch_payment("p").ok)
+            self.assertTrue(pi.fetch_payment("p").ok)
+            self.assertTrue(pi.fetch_payment("p").ok)
+        self.assertEqual(get_payment.call_count, 2)
+
+
+class WebhookViewTests(TestCase):
+    def post(self, data):
+        return self.client.post(reverse("pi:webhook"), json.dumps(data), content_type="application/json")
+
+    def test_ack_only_queues_the_event(self):
+        with mock.patch("pi_payments.views.get_client") as get_client:
+            self.assertEqual(self.post({"paymentId": "p1", "event": "Completed"}).status_code, 204)
+            self.assertEqual(self.post({"paymentId": "p1", "event": "completed"}).status_code, 204)  # reenvío
+        get_client.assert_not_called()
+
+        event = PiWebhookEvent.objects.get()
+        self.assertEqual((event.pid, event.event, event.processed_at), ("p1", "completed", None))
+
+    def test_missing_payment_id_is_rejected(self):
+        self.assertEqual(self.post({"event": "completed"}).status_code, 400)
+        self.assertFalse(PiWebhookEvent.objects.exists())
+
+
+class WebhookWorkerTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("buyer")
+        self.pay = make_payment(self.user)
+        self.info = {"metadata": {"order_number": self.pay.order.number}, "transaction": {"txid": "tx9"}}
+
+    def _run(self, info):
+        target = "pi_payments.management.commands.process_pi_events.fetch_pi_payment"
+        with mock.patch(target, return_value=(None, info)) as fetch:
+            call_command("process_pi_events", "--once", stdout=mock.Mock())
+        return fetch
+
+    def test_completed_event_confirms_payment(self):
+        PiWebhookEvent.objects.create(pid=self.pay.provider_payment_id, event="completed", payload={})
+        fetch = self._run(self.info)
+
+        fetch.assert_called_once_with(self.pay.provider_payment_id)
+        event = PiWebhookEvent.objects.get()
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.CONFIRMED)
+
+    def test_unknown_payment_is_retried_later(self):
+        PiWebhookEvent.objects.create(pid="pid-unknown", event="completed", payload={})
+        self._run({})
+
+        event = PiWebhookEvent.objects.get()
+        self.assertIsNone(event.processed_at)
+        self.assertEqual((event.attempts, event.last_error), (1, "local payment not found"))
+        self.assertGreater(event.locked_until, timezone.now())
+
+
+class TransitionTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("buyer")
+        self.pay = make_payment(self.user)
+
+    def test_confirm_is_compare_and_set_and_signals_once(self):
+        sent = []
+        handler = lambda sender, **kw: sent.append(kw["status"])  # noqa: E731
+        payment_transitioned.connect(handler)
+        self.addCleanup(payment_transitioned.disconnect, handler)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.pay.mark_confirmed(txid="tx1"))
+        stale = Payment.objects.get(pk=self.pay.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertFalse(stale.mark_confirmed(txid="tx1"))
+
+        self.assertEqual(sent, [Payment.CONFIRMED])
+        self.pay.refresh_from_db()
+        self.assertEqual((self.pay.status, self.pay.txid), (Payment.CONFIRMED, "tx1"))
+        self.assertEqual(Order.objects.get(pk=self.pay.order_id).status, Order.PAID)
+
+    def test_failed_does_not_undo_a_paid_order(self):
+        self.pay.mark_confirmed(txid="tx1")
+        self.assertFalse(Payment.objects.get(pk=self.pay.pk).mark_failed("late cancel"))
+        self.assertEqual(Order.objects.get(pk=self.pay.order_id).status, Order.PAID)
+
+    def test_failure_cancels_order_and_records_reason(self):
+        self.assertTrue(self.pay.mark_failed("user_cancelled"))
+        self.assertEqual(Order.objects.get(pk=self.pay.order_id).status, Order.CANCELLED)
+        event = PaymentEvent.objects.get(payment=self.pay)
+        self.assertEqual((event.kind, event.reason), (PaymentEvent.FAILED, "user_cancelled"))
+
+
+class OverlapClient:
+    """approve/complete en un pool real; avisa cuando Pi ya ha recibido la llamada."""
+
+    def __init__(self, ok: bool = True):
+        self.ok = ok
+        self.called = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, fn, *args):
+        return self.pool.submit(fn, *args)
+
+    def _call(self, *args):
+        self.called.set()
+        return SimpleNamespace(ok=self.ok, status_code=200 if self.ok else 500, content=b"")
+
+    approve = complete = _call
+
+    def invalidate_payment(self, pid):
+        pass
+
+
+class PiRoundTripOverlapTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("buyer")
+        self.pay = make_payment(self.user, amount_pi=Decimal("2"))
+        self.info = {"amount": "2", "metadata": {"order_number": self.pay.order.number}}
+
+    def post(self, name, client, **data):
+        overlapped = []
+
+        def fetch(pid):
+            # Si la llamada a Pi no se lanzara antes de esta lectura, aquí no llegaría nunca
+            overlapped.append(client.called.wait(5))
+            return SimpleNamespace(ok=True), self.info
+
+        with mock.patch("pi_payments.views.get_client", return_value=client), \
+                mock.patch("pi_payments.views._fetch_pi_payment", side_effect=fetch):
+            response = self.client.post(reverse(f"pi:{name}"), json.dumps(data), content_type="application/json")
+        client.pool.shutdown()
+        self.assertEqual(overlapped, [True])
+        return response
+
+    def test_approve_runs_alongside_the_payment_read(self):
+        response = self.post("approve", OverlapClient(), paymentId=self.pay.provider_payment_id)
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejected_approve_fails_the_payment(self):
+        response = self.post("approve", OverlapClient(ok=False), paymentId=self.pay.provider_payment_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.FAILED)
+
+    def test_complete_uses_the_approve_snapshot_and_overlaps_the_read(self):
+        Payment.objects.filter(pk=self.pay.pk).update(raw_payload={"pi_last_info": self.info})
+        response = self.post("complete", OverlapClient(), paymentId=self.pay.provider_payment_id, txid="tx1")
+
+        self.assertEqual(response.status_code, 200)
+        pay = Payment.objects.get(pk=self.pay.pk)
+        self.assertEqual((pay.status, pay.txid), (Payment.CONFIRMED, "tx1"))
+        self.assertEqual(pay.raw_payload["pi_info_at_complete"], self.info)
+
+
+class SyncJobTests(TestCase):
+    def setUp(self):
+        self.job = PiSyncJob.objects.create(payment_ids=[1, 2, 3], total=3)
+
+    def test_claim_is_compare_and_set(self):
+        self.assertTrue(claim_job(self.job.pk))
+        self.assertFalse(claim_job(self.job.pk))
+        self.assertFalse(PiSyncJob.objects.filter(resumable(), pk=self.job.pk).exists())
+
+    @override_settings(PI_SYNC_JOB_STALE=60)
+    def test_running_job_without_progress_becomes_resumable(self):
+        claim_job(self.job.pk)
+        PiSyncJob.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+        self.assertTrue(claim_job(self.job.pk))
+
+    def test_run_counts_each_chunk_once(self):
+        with mock.patch("pi_payments.sync.sync_payments", return_value=(0, 0)):
+            run_job(self.job.pk)
+            run_job(self.job.pk)  # ya DONE: no se reclama ni se vuelve a contar
+
+        job = PiSyncJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.status, job.done, job.errors), (PiSyncJob.DONE, 3, 3))
+
+
+class SyncPaymentsTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user("buyer")
+        self.pay = make_payment(self.user, amount_pi=Decimal("2.5"))
+
+    def _info(self, **status):
+        return {"amount": "2.5", "status": status, "transaction": {"txid": "tx1"}}
+
+    def test_txid_without_developer_completed_is_completed_on_pi_first(self):
+        client = FakePiClient(self._info(developer_approved=True, transaction_verified=True))
+        stats = {}
+        self.assertEqual(sync_payments([self.pay], stats=stats, client=client), (1, 0))
+
+        self.assertEqual(client.completed, [self.pay.provider_payment_id])
+        self.assertEqual(stats, {"confirmed": 1})
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.CONFIRMED)
+
+    def test_rejected_complete_does_not_confirm(self):
+        client = FakePiClient(self._info(developer_approved=True, transaction_verified=True), complete_ok=False)
+        stats = {}
+        self.assertEqual(sync_payments([self.pay], stats=stats, client=client), (0, 1))
+
+        self.assertEqual(stats, {"complete_failed": 1})
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.INITIATED)
+
+    def test_developer_completed_confirms_without_calling_complete(self):
+        client = FakePiClient(self._info(developer_approved=True, developer_completed=True))
+        sync_payments([self.pay], client=client)
+
+        self.assertEqual(client.completed, [])
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.CONFIRMED)
+
+    def test_amount_mismatch_is_not_completed(self):
+        client = FakePiClient({**self._info(transaction_verified=True), "amount": "9"})
+        sync_payments([self.pay], client=client)
+
+        self.assertEqual(client.completed, [])
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.INITIATED)
+
+    def test_cancelled_on_pi_fails_only_when_asked(self):
+        client = FakePiClient({"status": {"cancelled": True}})
+        sync_payments([self.pay], client=client)
+        self.assertEqual(Payment.objects.get(pk=self.pay.pk).status, Payment.INITIATED)
+
+        stats = {}
+        sync_payments([self.pay], fail_cancelled=True, stats=stats, client=client)
+        self.assertEqual((stats, Payment.objects.get(pk=self.pay.pk).status), ({"failed": 1}, Payment.FAILED))
+
+
+class ReconcileShardTests(TestCase):
+    def test_shards_split_stale_payments_in_sql(self):
+        user = get_user_model().objects.create_user("buyer")
+        pays = [make_payment(user, i) for i in range(7)]
+        Payment.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        seen = []
+
+        def fake_sync(rows, **kwargs):
+            seen.append([p.pk for p in rows])
+            return len(rows), 0
+
+        target = "pi_payments.management.commands.reconcile_pi_payments.sync_payments"
+        with mock.patch(target, side_effect=fake_sync):
+            for shard in range(3):
+                call_command("reconcile_pi_payments", "--shard", shard, "--shards", 3, stdout=mock.Mock())
+
+        self.assertEqual(len(seen), 3)
+        for shard, pks in enumerate(seen):
+            self.assertTrue(pks and all(pk % 3 == shard for pk in pks))
+        self.assertEqual(sorted(pk for pks in seen for pk in pks), [p.pk for p in pays])
+
+
+class StubServerTests(SimpleTestCase):
+    def start(self, **config):
+        server = make_server(port=0, config=StubConfig(**config))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_port}"
+        return base, PiClient(base=base, api_key="k", retries=0)
+
+    def test_payment_flow_matches_the_pi_api(self):
+        base, pi = self.start()
+        created = pi.session.post(f"{base}/_stub/payments", json={"amount": 2, "metadata": {"order_number": "X"}})
+        pid = created.json()["identifier"]
+
+        self.assertTrue(pi.approve(pid).ok)
+        txid = pi.session.post(f"{base}/_stub/payments/{pid}/submit").json()["transaction"]["txid"]
+        info = pi.get_payment(pid).json()
+        self.assertEqual((Payment.pi_status_from_info(info), Payment.txid_from_info(info)), ("verified", txid))
+        self.assertEqual(info["metadata"], {"order_number": "X"})
+
+        self.assertEqual(pi.complete(pid, "other").status_code, 400)
+        self.assertTrue(pi.complete(pid, txid).ok)
+        self.assertEqual(Payment.pi_status_from_info(pi.get_payment(pid).json()), "completed")
+        self.assertEqual(pi.session.post(f"{base}/_stub/payments/{pid}/cancel").status_code, 400)
+
+    def test_me_and_injected_errors(self):
+        _, pi = self.start()
+        self.assertEqual(pi.me("good").json()["uid"], pi.me("good").json()["uid"])
+        self.assertEqual(pi.me("bad-token").status_code, 401)
+        self.assertEqual(pi.get_payment("missing").status_code, 404)
+
+        _, failing = self.start(error_rate=1)
+        self.assertEqual(failing.get_payment("missing").status_code, 503)
+
+
+@override_settings(PI_RATE_SOURCE="pi_payments.rates.settings_source", PI_EUR_PER_PI="0.5")
+class RateTests(TestCase):
+    def setUp(self):
+        rates._set(None)
+        self.addCleanup(rates._set, None)
+
+    def test_same_rate_does_not_create_a_version(self):
+        first = rates.refresh_rate()
+        self.assertEqual(rates.refresh_rate().pk, first.pk)
+        with self.settings(PI_EUR_PER_PI="0.6"):
+            self.assertEqual(rates.refresh_rate().version, 2)
+        self.assertEqual(rates.get_rate(), rates.Rate(2, Decimal("0.6")))
+
+    def test_concurrent_first_refresh_keeps_one_version(self):
+        # Otro proceso creó la v1 después de que este viera la tabla vacía
+        other = ExchangeRate.objects.create(version=1, eur_per_pi=Decimal("0.5"))
+        with mock.patch.object(ExchangeRate.objects, "first", return_value=None):
+            rate = rates.refresh_rate()
+        self.assertEqual((rate.pk, ExchangeRate.objects.count()), (other.pk, 1))
+
+    def test_cold_get_rate_never_calls_the_source(self):
+        with mock.patch("pi_payments.rates.refresh_rate") as refresh:
+            rate = rates.get_rate()
+        refresh.assert_not_called()
+        self.assertEqual((rate.version, rate.eur_per_pi), (0, Decimal("0.5")))
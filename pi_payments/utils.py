@@ -0,0 +1,135 @@
+import logging
+
+from pi_payments.client import get_client
+from pi_payments.models import Payment, PaymentEvent
+
+
+class LocalPaymentNotFound(LookupError):
+    """No hay Payment local para el pid (aún); el evento se reintenta más tarde."""
+
+
+events_log = logging.getLogger("pi_payments.events")
+
+
+def log_event(event: str, payload, level: int = logging.INFO) -> None:
+    """
+    Registra un evento de Pi como JSON (ver portfolio.logs): el payload se recorta
+    y se escribe desde el hilo del listener, nunca en el de la request.
+    """
+    if events_log.isEnabledFor(level):
+        events_log.log(level, event, extra={"event": event, "data": payload})
+
+
+def fetch_pi_payment(pid: str):
+    """Lee el pago desde la API de Pi para obtener metadata (order_number, nonce, etc.)."""
+    r = get_client().fetch_payment(pid)  # caché corta compartida entre callbacks
+    try:
+        data = r.json() if r.ok else {}
+    except Exception:
+        data = {}
+    return r, data
+
+
+def attach_local_payment_from_info(pid: str, info: dict) -> Payment | None:
+    """
+    Conecta el pago de Pi (por pid) con nuestro Payment (por order_number en metadata).
+    Guarda pid/raw y devuelve el objeto Payment o None si no se encontró.
+    """
+    meta = (info or {}).get("metadata") or {}
+    order_number = meta.get("order_number")
+    if not order_number:
+        log_event("link.missing_order_number", {"pid": pid, "meta": meta}, logging.WARNING)
+        return None
+
+    try:
+        pay = Payment.objects.select_related("order").get(order__number=order_number)
+    except Payment.DoesNotExist:
+        log_event("link.local_payment_not_found", {"pid": pid, "order_number": order_number}, logging.WARNING)
+        return None
+
+    # Guarda pid si no estaba y snapshot bruto
+    changed = False
+    if not pay.provider_payment_id:
+        pay.provider_payment_id = pid
+        changed = True
+
+    raw = pay.raw_payload or {}
+    raw.setdefault("pi_last_info", info)  # snapshot último conocido
+    pay.raw_payload = raw
+    pay.pi_status = Payment.pi_status_from_info(info) or pay.pi_status
+
+    fields = ["raw_payload", "pi_status"]
+    if changed:
+        fields.append("provider_payment_id")
+    pay.save(update_fields=fields)
+
+    return pay
+
+
+def apply_webhook(pid: str, event: str, reason: str, data: dict, info: dict | None = None) -> str:
+    """
+    Aplica un evento de webhook de Pi sobre el Payment local.
+    Devuelve una etiqueta corta con el resultado; lanza LocalPaymentNotFound
+    si no hay pago local al que vincularlo.
+
+    `info`: el pago ya leído de Pi con fetch_pi_payment(). Quien aplica dentro de una
+    transacción debe pasarlo para no bloquear filas durante la llamada HTTP.
+    """
+    # Intenta leer info fresca de Pi y vincular el Payment local
+    if info is None:
+        _, info = fetch_pi_payment(pid)
+    pay = attach_local_payment_from_info(pid, info) or Payment.objects.filter(provider_payment_id=pid).first()
+
+    if not pay:
+        # Como último recurso, intenta por order_number del webhook directo (si viene)
+        order_number = (data.get("metadata") or {}).get("order_number")
+        if order_number:
+            pay = Payment.objects.select_related("order").filter(order__number=order_number).first()
+
+    if not pay:
+        log_event("webhook.local_payment_not_found", {"pid": pid, "event": event or "(none)"}, logging.WARNING)
+        raise LocalPaymentNotFound(pid)
+
+    # Idempotencia: si ya está confirmado y vuelve a llegar "completed", no hacemos nada
+    if event in {"completed", "confirmed"} and pay.status == Payment.CONFIRMED:
+        log_event("webhook.completed_ignored_idempotent", {"pid": pid})
+        return "ignored"
+
+    # Registra el webhook en el log append-only (la fila de Payment no crece)
+    PaymentEvent.record(pay, PaymentEvent.WEBHOOK, reason=event, data=data)
+    pay.pi_status = (event or Payment.pi_status_from_info(info) or pay.pi_status)[:32]
+    fields = ["pi_status"]
+    if info:
+        raw = pay.raw_payload or {}
+        raw["pi_last_info"] = info
+        pay.raw_payload = raw
+        fields.append("raw_payload")
+    pay.save(update_fields=fields)
+
+    # Enruta por tipo de evento/estado
+    if event in {"cancelled", "failed", "rejected", "declined"}:
+        # Motivo si existe; si no, usa el propio event
+        pay.mark_failed(reason or event)
+        log_event("webhook.mark_failed", {"pid": pid, "reason": reason or event})
+        return "failed"
+
+    if event in {"approved"}:
+        # Considera approved como iniciado si aún no está
+        pay.mark_initiated()
+        log_event("webhook.mark_initiated", {"pid": pid})
+        return "initiated"
+
+    if event in {"completed", "confirmed"}:
+        # Usa txid del webhook o de la info
+        # Si no hay txid pero el estado dice completed, aún confirmamos para no quedarnos colgados
+        txid = data.get("txid") or Payment.txid_from_info(info)
+        pay.mark_confirmed(save_order=True, txid=txid, extra={
+            "provider_payment_id": pay.provider_payment_id or pid,
+        })
+
+        log_event("webhook.mark_confirmed", {"pid": pid})
+        return "confirmed"
+
+    # Desconocido o no soportado: solo log
+    log_event("webhook.unhandled_event", {"pid": pid, "event": event or "(none)"}, logging.WARNING)
+    return "unhandled"
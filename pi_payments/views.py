@@ -1,21 +1,18 @@
-import os, json, requests
+import json
+import logging
+import requests
 from decimal import Decimal
 from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from django.utils.timezone import now
 
-from orders.models import Order
-from pi_payments.models import Payment
-
-PI_API_BASE = "https://api.minepi.com"
-PI_API_KEY  = os.environ.get("PI_API_KEY")
-
-def _auth_headers():
-    return {"Authorization": f"Key {PI_API_KEY}", "Content-Type": "application/json"}
-
-def _log(event, payload):  # cámbialo por logging si quieres
-    print(f"[PI] {event} {now().isoformat()} :: {payload}")
+from pi_payments.client import get_client
+from pi_payments.models import Payment, PiWebhookEvent
+from pi_payments.utils import (
+    attach_local_payment_from_info as _attach_local_payment_from_info,
+    fetch_pi_payment as _fetch_pi_payment,
+    log_event as _log,
+)
 
 def _json(body: bytes | str) -> dict:
     try:
@@ -23,49 +20,6 @@ def _json(body: bytes | str) -> dict:
     except Exception:
         return {}
 
-def _fetch_pi_payment(pid: str):
-    """Lee el pago desde la API de Pi para obtener metadata (order_number, nonce, etc.)."""
-    r = requests.get(f"{PI_API_BASE}/v2/payments/{pid}", headers=_auth_headers(), timeout=20)
-    try:
-        data = r.json() if r.ok else {}
-    except Exception:
-        data = {}
-    return r, data
-
-def _attach_local_payment_from_info(pid: str, info: dict) -> Payment | None:
-    """
-    Conecta el pago de Pi (por pid) con nuestro Payment (por order_number en metadata).
-    Guarda pid/raw y devuelve el objeto Payment o None si no se encontró.
-    """
-    meta = (info or {}).get("metadata") or {}
-    order_number = meta.get("order_number")
-    if not order_number:
-        _log("link.missing_order_number", {"pid": pid, "meta": meta})
-        return None
-
-    try:
-        pay = Payment.objects.select_related("order").get(order__number=order_number)
-    except Payment.DoesNotExist:
-        _log("link.local_payment_not_found", {"pid": pid, "order_number": order_number})
-        return None
-
-    # Guarda pid si no estaba y snapshot bruto
-    changed = False
-    if not pay.provider_payment_id:
-        pay.provider_payment_id = pid
-        changed = True
-
-    raw = pay.raw_payload or {}
-    raw.setdefault("pi_last_info", info)  # snapshot último conocido
-    pay.raw_payload = raw
-
-    if changed:
-        pay.save(update_fields=["provider_payment_id", "raw_payload"])
-    else:
-        pay.save(update_fields=["raw_payload"])
-
-    return pay
-
 @require_POST
 def pi_approve(request):
     data = _json(request.body)
@@ -73,16 +27,25 @@ def pi_approve(request):
     if not pid:
         return HttpResponseBadRequest("paymentId required")
 
-    # 1) Lee info del pago para vincular a nuestro Payment
-    r_info, info = _fetch_pi_payment(pid)
-    if not r_info.ok:
-        _log("approve.fetch_fail", {"pid": pid, "status": r_info.status_code, "body": r_info.text})
+    client = get_client()
+    # 1) Lanza la aprobación en Pi en segundo plano...
+    approve_f = client.submit(client.approve, pid)
+
+    # 2) ...y mientras tanto lee info del pago y vincula nuestro Payment
+    try:
+        r_info, info = _fetch_pi_payment(pid)
+        if not r_info.ok:
+            _log("approve.fetch_fail", {"pid": pid, "status": r_info.status_code, "body": r_info.content[:1000]}, logging.WARNING)
+    except requests.RequestException as e:
+        _log("approve.fetch_error", {"pid": pid, "error": repr(e)}, logging.WARNING)
+        info = {}
 
     pay = _attach_local_payment_from_info(pid, info)
 
-    # 2) Aprueba en Pi
-    r = requests.post(f"{PI_API_BASE}/v2/payments/{pid}/approve", headers=_auth_headers(), timeout=20)
-    _log("approve.api", {"pid": pid, "status": r.status_code, "body": r.text})
+    r = approve_f.result()
+    client.invalidate_payment(pid)  # la lectura pudo ser anterior al approve
+    _log("approve.api", {"pid": pid, "status": r.status_code, "body": r.content[:1000]},
+         logging.INFO if r.ok else logging.WARNING)
 
     if not r.ok:
         # Si Pi rechaza la aprobación, marcamos el pago como fallido y cancelamos la orden
@@ -92,9 +55,7 @@ def pi_approve(request):
 
     if pay:
         # Marca como iniciado si no lo estaba
-        if pay.status != Payment.INITIATED:
-            pay.status = Payment.INITIATED
-            pay.save(update_fields=["status"])
+        pay.mark_initiated()
         _log("approve.local_linked", {"pid": pid, "order": pay.order.number})
 
     return JsonResponse({"ok": True})
@@ -107,10 +68,28 @@ def pi_complete(request):
     if not pid or not txid:
         return HttpResponseBadRequest("paymentId and txid required")
 
+    client = get_client()
+
+    # Vía rápida: si approve ya vinculó el pago y guardó la info de Pi, el importe
+    # se valida contra ese snapshot y el complete se solapa con la lectura fresca.
+    pay = Payment.objects.select_related("order").filter(provider_payment_id=pid).first()
+    known = ((pay.raw_payload or {}).get("pi_last_info") or {}) if pay else {}
+    if pay and known.get("amount") is not None:
+        if _amount_mismatch(pid, pay, known):
+            return JsonResponse({"ok": False, "error": "amount mismatch"}, status=400)
+        complete_f = client.submit(client.complete, pid, txid)
+        try:
+            _r_info, info = _fetch_pi_payment(pid)  # solo auditoría
+        except requests.RequestException:
+            info = {}
+        r = complete_f.result()
+        client.invalidate_payment(pid)
+        return _finish_complete(pid, txid, pay, info, r)
+
     # 1) Lee info del pago y vincula con nuestro Payment
     r_info, info = _fetch_pi_payment(pid)
     if not r_info.ok:
-        _log("complete.fetch_fail", {"pid": pid, "status": r_info.status_code, "body": r_info.text})
+        _log("complete.fetch_fail", {"pid": pid, "status": r_info.status_code, "body": r_info.content[:1000]}, logging.WARNING)
         # Si ni siquiera podemos leer la info, intenta marcar fallido si existe el Payment
         pay = Payment.objects.filter(provider_payment_id=pid).first()
         if pay:
@@ -122,44 +101,44 @@ def pi_complete(request):
         # Si no encontramos el pago local, no seguimos (preferible a marcar sin orden)
         return JsonResponse({"ok": False, "error": "local payment not found"}, status=404)
 
-    # (Opcional) Validación de importe en π contra snapshot guardado en el checkout
+    if _amount_mismatch(pid, pay, info):
+        return JsonResponse({"ok": False, "error": "amount mismatch"}, status=400)
+
+    # 2) Completa en Pi
+    r = client.complete(pid, txid)
+    return _finish_complete(pid, txid, pay, info, r)
+
+def _amount_mismatch(pid: str, pay: Payment, info: dict) -> bool:
+    """(Opcional) Validación de importe en π contra snapshot guardado en el checkout."""
     try:
         amount_pi = Decimal(str(info.get("amount", "0")))
-        snap = (pay.raw_payload or {}).get("pricing", {})
-        snap_amount_pi = Decimal(str(snap.get("amount_pi") or "0"))
+        snap_amount_pi = pay.amount_pi or Decimal("0")
         if snap_amount_pi and amount_pi and snap_amount_pi != amount_pi:
-            _log("complete.amount_mismatch", {"pid": pid, "snap": str(snap_amount_pi), "pi": str(amount_pi)})
+            _log("complete.amount_mismatch", {"pid": pid, "snap": str(snap_amount_pi), "pi": str(amount_pi)}, logging.WARNING)
             # Marca como fallido y corta
             pay.mark_failed("amount mismatch")
-            return JsonResponse({"ok": False, "error": "amount mismatch"}, status=400)
+            return True
     except Exception:
         pass  # si no hubiera snapshot/decimal, no bloqueamos
+    return False
 
-    # 2) Completa en Pi
-    r = requests.post(
-        f"{PI_API_BASE}/v2/payments/{pid}/complete",
-        headers=_auth_headers(),
-        json={"txid": txid},
-        timeout=20
-    )
-    _log("complete.api", {"pid": pid, "status": r.status_code, "body": r.text})
+def _finish_complete(pid: str, txid: str, pay: Payment, info: dict, r):
+    _log("complete.api", {"pid": pid, "status": r.status_code, "body": r.content[:1000]},
+         logging.INFO if r.ok else logging.WARNING)
     if not r.ok:
         # Si Pi rechaza el complete, fallido
         pay.mark_failed("complete rejected by Pi")
         return JsonResponse({"ok": False}, status=400)
 
-    # 3) Marca como pagado en tu BD
+    # 3) Marca como pagado en tu BD: un UPDATE condicional sobre Payment + otro sobre Order.
+    # Si el webhook ganó la carrera, no hace nada (idempotente).
     raw = pay.raw_payload or {}
     raw["pi_info_at_complete"] = info
-    raw["txid"] = txid
-    pay.raw_payload = raw
-    # usa helper para sincronizar orden
-    pay.mark_confirmed(save_order=True)
-
-    # Asegura provider_payment_id por si faltaba
-    if not pay.provider_payment_id:
-        pay.provider_payment_id = pid
-        pay.save(update_fields=["provider_payment_id"])
+    pay.mark_confirmed(save_order=True, txid=txid, extra={
+        "raw_payload": raw,
+        "pi_status": "completed",
+        "provider_payment_id": pay.provider_payment_id or pid,
+    })
 
     return JsonResponse({"ok": True})
 
@@ -192,76 +171,15 @@ def pi_webhook(request):  # opcional
     data = _json(request.body)
     pid = data.get("paymentId") or data.get("payment_id")
     event = (data.get("event") or data.get("status") or "").strip().lower()
-    reason = (data.get("reason") or data.get("error") or "").strip()
 
     if not pid:
-        _log("webhook.missing_pid", data)
+        _log("webhook.missing_pid", data, logging.WARNING)
         return HttpResponseBadRequest("paymentId required")
 
-    # Intenta leer info fresca de Pi y vincular el Payment local
-    r_info, info = _fetch_pi_payment(pid)
-    pay = _attach_local_payment_from_info(pid, info) or Payment.objects.filter(provider_payment_id=pid).first()
-
-    if not pay:
-        # Como último recurso, intenta por order_number del webhook directo (si viene)
-        order_number = (data.get("metadata") or {}).get("order_number")
-        if order_number:
-            pay = Payment.objects.select_related("order").filter(order__number=order_number).first()
-
-    if not pay:
-        _log("webhook.local_payment_not_found", {"pid": pid, "event": event or "(none)"})
-        return JsonResponse({"ok": False, "error": "local payment not found"}, status=404)
-
-    # Idempotencia: si ya está confirmado y vuelve a llegar "completed", no hacemos nada
-    if event in {"completed", "confirmed"} and pay.status == Payment.CONFIRMED:
-        _log("webhook.completed_ignored_idempotent", {"pid": pid})
-        return HttpResponse(status=204)
-
-    # Guarda snapshot del último payload del webhook
-    raw = pay.raw_payload or {}
-    raw.setdefault("webhooks", []).append({"at": now().isoformat(), "data": data})
-    if info:
-        raw["pi_last_info"] = info
-    pay.raw_payload = raw
-    pay.save(update_fields=["raw_payload"])
-
-    # Enruta por tipo de evento/estado
-    if event in {"cancelled", "failed", "rejected", "declined"}:
-        # Motivo si existe; si no, usa el propio event
-        pay.mark_failed(reason or event)
-        _log("webhook.mark_failed", {"pid": pid, "reason": reason or event})
-        return HttpResponse(status=204)
-
-    if event in {"approved"}:
-        # Considera approved como iniciado si aún no está
-        if pay.status != Payment.INITIATED:
-            pay.status = Payment.INITIATED
-            pay.save(update_fields=["status"])
-        _log("webhook.mark_initiated", {"pid": pid})
-        return HttpResponse(status=204)
-
-    if event in {"completed", "confirmed"}:
-        # Usa txid del webhook o de la info
-        txid = data.get("txid") or (info.get("transaction") or {}).get("txid") or info.get("txid")
-        if not txid:
-            # Si no hay txid pero el estado dice completed, aún confirmamos para no quedarnos colgados
-            pay.mark_confirmed(save_order=True)
-        else:
-            # Marca confirmado y deja txid en raw
-            raw = pay.raw_payload or {}
-            raw["txid"] = txid
-            pay.raw_payload = raw
-            pay.save(update_fields=["raw_payload"])
-            pay.mark_confirmed(save_order=True)
-
-        if not pay.provider_payment_id:
-            pay.provider_payment_id = pid
-            pay.save(update_fields=["provider_payment_id"])
-
-        _log("webhook.mark_confirmed", {"pid": pid})
-        return HttpResponse(status=204)
-
-    # Desconocido o no soportado: log y 204 para no reintentar indefinidamente
-    _log("webhook.unhandled_event", {"pid": pid, "event": event or "(none)"})
+    # Fast-ack: inserta el evento en la bandeja (dedupe por pid+event) y responde ya.
+    # `manage.py process_pi_events` lo aplica fuera del ciclo de la request.
+    PiWebhookEvent.objects.bulk_create(
+        [PiWebhookEvent(pid=str(pid)[:100], event=event[:32], payload=data)],
+        ignore_conflicts=True,
+    )
     return HttpResponse(status=204)
-
@@ -1,45 +1,143 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.cache import cache
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum
 from django.urls import reverse
+from django.utils import timezone
 from blog.models import Post
+from orders.models import Order, OrderDailyRollup
+from pi_payments.models import Payment, PaymentDailyRollup
 from projects.models import Project
 from services.models import Service
 
+KPI_KEY = "admin_kpis:v5"
+LOCK_TIMEOUT = 30        # s: si quien recalcula muere, otro lo intentará pasado este tiempo
+CHART_DAYS = 30
+TOP_REASONS = 5
+# Importes: se ponen a 0 si no hay filas y solo los ve un superusuario
+MONEY_KEYS = ("kpi_services_sum_price", "kpi_revenue_total", "kpi_revenue_30d")
+
+
+def compute_kpis() -> dict:
+    """
+    Servicios/posts/proyectos/usuarios: una consulta por tabla. Pedidos y pagos salen de
+    los resúmenes diarios (orders/rollups.py, al día según el cron de rebuild_rollups).
+    Las ventanas de 30 días son por día de creación.
+    """
+    today = timezone.localdate()
+    since = today - timedelta(days=CHART_DAYS - 1)
+    paid = Q(status=Order.PAID)
+    services = Service.objects.aggregate(
+        kpi_services=Count("id"),
+        kpi_services_active=Count("id", filter=Q(is_active=True)),
+        kpi_services_inactive=Count("id", filter=Q(is_active=False)),
+        kpi_services_sum_price=Sum("price"),
+    )
+    orders = OrderDailyRollup.objects.aggregate(
+        kpi_orders=Sum("orders"),
+        kpi_orders_paid=Sum("orders", filter=paid),
+        kpi_orders_30d=Sum("orders", filter=Q(day__gte=since)),
+        kpi_revenue_total=Sum("total", filter=paid),
+        kpi_revenue_30d=Sum("total", filter=paid & Q(day__gte=since)),
+    )
+    payments = PaymentDailyRollup.objects.aggregate(
+        kpi_payments_confirmed=Sum("payments", filter=Q(status=Payment.CONFIRMED)),
+        kpi_payments_initiated=Sum("payments", filter=Q(status=Payment.INITIATED)),
+        kpi_payments_failed=Sum("payments", filter=Q(status=Payment.FAILED)),
+    )
+    data = {
+        "kpi_posts": Post.objects.count(),
+        "kpi_projects": Project.objects.count(),
+        "kpi_users": get_user_model().objects.count(),
+        **services, **orders, **payments,
+    }
+    for key in (*orders, *payments, *MONEY_KEYS):
+        data[key] = data[key] or 0
+
+    # Tipos de fallo más frecuentes (30 días)
+    labels = dict(PaymentDailyRollup.REASON_CHOICES)
+    data["kpi_fail_reasons"] = [
+        {"reason": labels.get(row["reason"], row["reason"]), "n": row["n"]}
+        for row in PaymentDailyRollup.objects.filter(status=Payment.FAILED, day__gte=since)
+        .values("reason").annotate(n=Sum("payments")).filter(n__gt=0).order_by("-n", "reason")[:TOP_REASONS]
+    ]
+
+    # Gráfico: pedidos creados y pagados por día (30 días)
+    per_day = {
+        row["day"]: row
+        for row in OrderDailyRollup.objects.filter(day__gte=since).values("day")
+        .annotate(n=Sum("orders"), n_paid=Sum("orders", filter=paid)).order_by()
+    }
+    days = [since + timedelta(days=i) for i in range(CHART_DAYS)]
+    data["kpi_chart"] = json.dumps({
+        "labels": [d.strftime("%d/%m") for d in days],
+        "datasets": [
+            {"label": "Orders", "data": [per_day.get(d, {}).get("n") or 0 for d in days]},
+            {"label": "Paid", "data": [per_day.get(d, {}).get("n_paid") or 0 for d in days]},
+        ],
+    })
+    return data
+
+
+def placeholder_kpis() -> dict:
+    """Lo que ve quien llega en frío mientras otro calcula: sin cifras (la plantilla pone 0)."""
+    return {
+        "kpi_pending": True,
+        "kpi_fail_reasons": [],
+        "kpi_chart": json.dumps({"labels": [], "datasets": []}),
+    }
+
+
+def get_kpis() -> dict:
+    """
+    Stale-while-revalidate: el valor vale ADMIN_KPI_TTL s y se conserva ADMIN_KPI_STALE s más.
+    Al caducar, solo quien consigue el lock (cache.add) recalcula; el resto sirve el
+    valor anterior o, en frío, placeholder_kpis() (nunca recalculan a la vez).
+    El lock vive en la caché: con LocMemCache es por proceso (un cálculo por worker);
+    con CACHE_URL (caché compartida) es uno para todos.
+    """
+    entry = cache.get(KPI_KEY)
+    if entry and entry["fresh_until"] > time.time():
+        return entry["data"]
+
+    lock_key = f"{KPI_KEY}:lock"
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            data = compute_kpis()
+            ttl = int(getattr(settings, "ADMIN_KPI_TTL", 60))
+            stale = int(getattr(settings, "ADMIN_KPI_STALE", 600))
+            cache.set(KPI_KEY, {"data": data, "fresh_until": time.time() + ttl}, ttl + stale)
+            return data
+        finally:
+            cache.delete(lock_key)
+
+    if entry:
+        return entry["data"]
+    # En frío y sin el lock: otro está calculando; no se espera ni se repite la consulta
+    return placeholder_kpis()
 
 
 def dashboard_callback(request, context):
-    key = "admin_kpis:v3" 
-    data = cache.get(key)
-    if data is None:
-        User = get_user_model()
-        app_label = User._meta.app_label    
-        model_name = User._meta.model_name  
-
-        data = {
-            "kpi_posts": Post.objects.count(),
-            "kpi_projects": Project.objects.count(),
-            "kpi_services": Service.objects.count(),
-            "kpi_services_active": Service.objects.filter(is_active=True).count(),
-            "kpi_services_inactive": Service.objects.filter(is_active=False).count(),
-            "kpi_services_sum_price": Service.objects.aggregate(total=Sum("price"))["total"] or 0,
-            "kpi_users": User.objects.count(),
-
-            # URLs del admin (dinámicas, válidas con custom user):
-            "admin_user_list_url":  reverse(f"admin:{app_label}_{model_name}_changelist"),
-            "admin_user_change_url": reverse(f"admin:{app_label}_{model_name}_change",
-                                             args=[request.user.pk]),
-        }
-        cache.set(key, data, 60)
+    User = get_user_model()
+    app_label = User._meta.app_label
+    model_name = User._meta.model_name
 
     # Copia y filtra métricas sensibles
-    data_out = dict(data)
+    data_out = dict(get_kpis())
     if not request.user.is_superuser:
-        data_out.pop("kpi_services_sum_price", None)
+        for key in MONEY_KEYS:
+            data_out.pop(key, None)
+
+    # URLs del admin (dinámicas, válidas con custom user); por usuario, fuera de la caché
+    data_out["admin_user_list_url"] = reverse(f"admin:{app_label}_{model_name}_changelist")
+    data_out["admin_user_change_url"] = reverse(f"admin:{app_label}_{model_name}_change", args=[request.user.pk])
 
     # (permiso change sobre el modelo)
-    User = get_user_model()
-    perm_codename = f"{User._meta.app_label}.change_{User._meta.model_name}"
+    perm_codename = f"{app_label}.change_{model_name}"
     data_out["can_edit_self"] = request.user.has_perm(perm_codename)
 
     context.update(data_out)
@@ -0,0 +1,198 @@
+"""
+Logging no bloqueante.
+
+configure() sustituye a logging.config.dictConfig (settings.LOGGING_CONFIG):
+aplica LOGGING y después cambia los handlers de cada logger configurado por un
+único QueueHandler. Un hilo listener por proceso (QueueListener) es el que
+escribe en fichero/consola/email, así que un disco lento o una rotación nunca
+se notan en la request. Si la cola se llena, el registro se descarta (y se
+cuenta) en vez de bloquear.
+
+JsonFormatter emite una línea JSON por registro, con `event`/`data` (extra) y
+cadenas/listas recortadas. SamplingFilter deja pasar solo una fracción de los
+eventos INFO de alto volumen; WARNING y superiores nunca se muestrean.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+MAX_STR = 500
+MAX_ITEMS = 20
+MAX_DEPTH = 4
+
+
+def truncate(value, max_str: int = MAX_STR, max_items: int = MAX_ITEMS, depth: int = MAX_DEPTH):
+    """Copia JSON-serializable de `value` con textos y colecciones recortados."""
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8", "replace")
+    if isinstance(value, str):
+        return value if len(value) <= max_str else f"{value[:max_str]}…(+{len(value) - max_str})"
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if depth <= 0:
+        return truncate(repr(value), max_str)
+    if isinstance(value, dict):
+        items = list(value.items())
+        out = {str(k): truncate(v, max_str, max_items, depth - 1) for k, v in items[:max_items]}
+        if len(items) > max_items:
+            out["…"] = f"+{len(items) - max_items} keys"
+        return out
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        out = [truncate(v, max_str, max_items, depth - 1) for v in items[:max_items]]
+        if len(items) > max_items:
+            out.append(f"…(+{len(items) - max_items})")
+        return out
+    return truncate(str(value), max_str)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, *args, max_str: int = MAX_STR, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_str = max_str
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.max_str),
+        }
+        for key in ("event", "clientip"):
+            value = getattr(record, key, None)
+            if value:
+                out[key] = value
+        if hasattr(record, "data"):
+            out["data"] = truncate(record.data, self.max_str)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Muestreo por evento: rates = {"approve.api": 0.1, ...} deja pasar ~10 %.
+    El evento es record.event (extra) o, si no hay, el mensaje sin formatear.
+    """
+
+    def __init__(self, rates: dict[str, float] | None = None, default: float = 1.0):
+        super().__init__()
+        self.rates = rates or {}
+        self.default = default
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None) or str(record.msg), self.default)
+        return rate >= 1 or random.random() < rate
+
+
+# ---------- cola + listener ----------
+class _RoutingQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro junto con los handlers reales del logger que lo emitió."""
+
+    dropped = 0
+
+    def __init__(self, q, targets: tuple[logging.Handler, ...]):
+        super().__init__(q)
+        self.targets = targets
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resuelve el mensaje ya (los args pueden cambiar después), pero conserva
+        # exc_info/extra: la cola es en memoria, no hace falta serializar.
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        record.log_targets = self.targets
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _RoutingQueueHandler.dropped += 1
+
+
+class _RoutingListener(logging.handlers.QueueListener):
+    def handle(self, record: logging.LogRecord) -> None:
+        for handler in record.log_targets:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+
+_queue: queue.Queue | None = None
+_listener: _RoutingListener | None = None
+
+
+def _start_listener() -> None:
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+    _listener = _RoutingListener(_queue)
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    # Tras fork (gunicorn --preload) el hilo del padre no existe en el hijo
+    global _queue, _listener
+    if _queue is None:
+        return
+    _queue = queue.Queue(_queue.maxsize)
+    for h in _queue_handlers():
+        h.queue = _queue
+    _listener = None
+    _start_listener()
+
+
+def _queue_handlers():
+    for lg in [logging.getLogger()] + [
+        l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)
+    ]:
+        for h in lg.handlers:
+            if isinstance(h, _RoutingQueueHandler):
+                yield h
+
+
+def configure(config: dict) -> None:
+    """LOGGING_CONFIG: dictConfig + cada logger configurado pasa a escribir vía cola."""
+    global _queue
+    config = dict(config)
+    use_queue = config.pop("queue", True)
+    maxsize = int(config.pop("queue_size", 10000))
+    logging.config.dictConfig(config)
+    if not use_queue:
+        return
+
+    if _queue is None:
+        _queue = queue.Queue(maxsize)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(lambda: _listener and _listener.stop())
+
+    names = list(config.get("loggers", {}))
+    if "root" in config:
+        names.append("")
+    for name in names:
+        lg = logging.getLogger(name)
+        targets = tuple(h for h in lg.handlers if not isinstance(h, _RoutingQueueHandler))
+        if not targets:
+            continue
+        for h in list(lg.handlers):
+            lg.removeHandler(h)
+        lg.addHandler(_RoutingQueueHandler(_queue, targets))
+
+    _start_listener()
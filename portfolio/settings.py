@@ -44,6 +44,24 @@ CSRF_TRUSTED_ORIGINS = env.list("CSRF_TRUSTED_ORIGINS", default=[])
 
 # Pi Payments
 PI_API_KEY = env("PI_API_KEY", default="")
+PI_API_BASE = env("PI_API_BASE", default="https://api.minepi.com")
+
+# Pi HTTP client: pool sized to the threads running sync views, bounded retries (GET only), timeouts
+PI_HTTP_POOL_SIZE = env.int("PI_HTTP_POOL_SIZE", default=env.int("GUNICORN_THREADS", default=4))
+PI_HTTP_RETRIES = env.int("PI_HTTP_RETRIES", default=2)
+PI_HTTP_CONNECT_TIMEOUT = env.float("PI_HTTP_CONNECT_TIMEOUT", default=3.05)
+PI_HTTP_READ_TIMEOUT = env.float("PI_HTTP_READ_TIMEOUT", default=20)
+# Seconds a fetched Pi payment is shared between approve/complete/webhook callbacks
+PI_PAYMENT_CACHE_TTL = env.float("PI_PAYMENT_CACHE_TTL", default=3)
+
+# Bulk "Sync from Pi": parallel fetches, rate limit (req/s), selections above
+# PI_SYNC_INLINE_MAX run as a background PiSyncJob
+PI_SYNC_WORKERS = env.int("PI_SYNC_WORKERS", default=8)
+PI_SYNC_RATE = env.float("PI_SYNC_RATE", default=10)
+PI_SYNC_INLINE_MAX = env.int("PI_SYNC_INLINE_MAX", default=25)
+# A running job with no progress for this many seconds is considered dead (e.g. its
+# gunicorn worker was recycled) and may be resumed from the admin
+PI_SYNC_JOB_STALE = env.int("PI_SYNC_JOB_STALE", default=300)
 
 # Behind proxy (Railway / dev tunnels)
 USE_X_FORWARDED_HOST = True
@@ -51,10 +69,25 @@ SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
 # Pi ↔ EUR conversion (EUR per π)
 PI_EUR_PER_PI = Decimal(str(env("PI_EUR_PER_PI", default="0.30")))
+# Versioned rate provider (pi_payments.rates): a source is a dotted path to a
+# callable returning EUR per π; the current rate is cached PI_RATE_TTL seconds
+# per process and refreshed in the background. url_source reads PI_RATE_URL.
+PI_RATE_SOURCE = env("PI_RATE_SOURCE", default="pi_payments.rates.settings_source")
+PI_RATE_URL = env("PI_RATE_URL", default="")
+PI_RATE_TTL = env.int("PI_RATE_TTL", default=300)
 
 # Optional: force Pi-only login flows in your app if you use it
 PI_ONLY_LOGIN = env("PI_ONLY_LOGIN", default=False)
 
+# Pi Login: verified access tokens are cached by SHA-256 for PI_LOGIN_TOKEN_TTL
+# seconds; /v2/me is tried once (no PI_HTTP_RETRIES) and if it fails or exceeds
+# PI_LOGIN_TIMEOUT, a verification younger than PI_LOGIN_TOKEN_GRACE is still
+# accepted. uid -> user id is cached too.
+PI_LOGIN_TIMEOUT = env.float("PI_LOGIN_TIMEOUT", default=5)
+PI_LOGIN_TOKEN_TTL = env.int("PI_LOGIN_TOKEN_TTL", default=60)
+PI_LOGIN_TOKEN_GRACE = env.int("PI_LOGIN_TOKEN_GRACE", default=600)
+PI_LOGIN_UID_TTL = env.int("PI_LOGIN_UID_TTL", default=86400)
+
 # --- Apps ---
 INSTALLED_APPS = [
     "unfold",
@@ -123,8 +156,22 @@ TEMPLATES = [
 
 AUTHENTICATION_BACKENDS = [
     "axes.backends.AxesStandaloneBackend",
-    "django.contrib.auth.backends.ModelBackend",
+    # ModelBackend + request.user cacheado (users/user_cache.py); only with SHARED_CACHE
+    "users.backends.CachedModelBackend",
 ]
+USER_CACHE_TTL = env.int("USER_CACHE_TTL", default=60)
+
+# Inbox: messages per page in thread_detail ("load older" fetches the rest)
+INBOX_PAGE_SIZE = env.int("INBOX_PAGE_SIZE", default=50)
+# Inbox in real time (/inbox/stream/, /inbox/poll/). REQUIRES the ASGI server (gunicorn with
+# uvicorn workers on portfolio.asgi, as in the Procfile): under WSGI every open stream would
+# hold a whole worker, so the endpoints answer 503 there. Keep it off on WSGI.
+INBOX_STREAM = env.bool("INBOX_STREAM", default=False)
+INBOX_POLL_INTERVAL = env.float("INBOX_POLL_INTERVAL", default=2)  # DB fallback, one query per process
+INBOX_STREAM_KEEPALIVE = env.int("INBOX_STREAM_KEEPALIVE", default=25)  # also the long-poll timeout
+INBOX_STREAM_MAX_SECONDS = env.int("INBOX_STREAM_MAX_SECONDS", default=300)  # then the browser reconnects
+# manage.py archive_inbox: read messages of paid/closed orders older than this move to the archive table
+INBOX_RETENTION_DAYS = env.int("INBOX_RETENTION_DAYS", default=365)
 
 WSGI_APPLICATION = "portfolio.wsgi.application"
 
@@ -164,6 +211,15 @@ else:
         }
     }
 
+# --- Cache ---
+# CACHE_URL (e.g. redis://host:6379/1) gives every worker the same cache. Without it each
+# process has its own LocMemCache: invalidations only reach the writing process, so the
+# cached request.user is disabled and shared counters use short TTLs (SHARED_CACHE=False).
+CACHE_URL = env("CACHE_URL", default="")
+if CACHE_URL:
+    CACHES = {"default": env.cache_url("CACHE_URL")}
+SHARED_CACHE = bool(CACHE_URL)
+
 # --- Password validation ---
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -175,6 +231,12 @@ AUTH_PASSWORD_VALIDATORS = [
 # Email backend (console in development)
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# Admin dashboard KPIs: fresh for ADMIN_KPI_TTL s, then served stale (up to ADMIN_KPI_STALE s more)
+# while a single request recomputes them (one per process, or one overall with CACHE_URL).
+# On a cold cache the other requests get an empty placeholder instead of recomputing.
+ADMIN_KPI_TTL = env.int("ADMIN_KPI_TTL", default=60)
+ADMIN_KPI_STALE = env.int("ADMIN_KPI_STALE", default=600)
+
 # --- UNFOLD ADMIN CONFIG ---
 UNFOLD = {
     "SITE_TITLE": "Portfolio Admin",
@@ -246,18 +308,32 @@ UNFOLD = {
 LOG_DIR = BASE_DIR / "logs"
 LOG_DIR.mkdir(exist_ok=True)
 
+# Logging: every configured logger writes through one in-process queue; a
+# listener thread does the file/console/email I/O (portfolio/logs.py).
+# LOG_SAMPLE_RATES keeps only a fraction of high-volume INFO Pi events.
+LOGGING_CONFIG = "portfolio.logs.configure"
+LOG_SAMPLE_RATES = {
+    "approve.api": env.float("LOG_SAMPLE_PI_API", default=1.0),
+    "complete.api": env.float("LOG_SAMPLE_PI_API", default=1.0),
+    "webhook.processed": env.float("LOG_SAMPLE_PI_WEBHOOK", default=0.1),
+}
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "queue": env.bool("LOG_QUEUE", default=True),
+    "queue_size": 10000,
     "formatters": {
         "verbose": {"format": "%(asctime)s [%(levelname)s] %(name)s %(clientip)s %(message)s"},
         "simple": {"format": "%(levelname)s: %(message)s"},
+        "json": {"()": "portfolio.logs.JsonFormatter", "max_str": 500},
     },
     "filters": {
         "client_ip": {
             "()": "django.utils.log.CallbackFilter",
             "callback": lambda record: setattr(record, "clientip", getattr(record, "clientip", "")) or True,
         },
+        "sample_pi_events": {"()": "portfolio.logs.SamplingFilter", "rates": LOG_SAMPLE_RATES},
     },
     "handlers": {
         "console": {"class": "logging.StreamHandler", "level": "INFO" if DEBUG else "WARNING", "formatter": "simple"},
@@ -267,9 +343,17 @@ LOGGING = {
             "filename": str(LOG_DIR / "security.log"),
             "maxBytes": 1024 * 1024 * 5,
             "backupCount": 5,
-            "formatter": "verbose",
+            "formatter": "json",
             "filters": ["client_ip"],
         },
+        "pi_file": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "level": "INFO",
+            "filename": str(LOG_DIR / "pi.log"),
+            "maxBytes": 1024 * 1024 * 10,
+            "backupCount": 5,
+            "formatter": "json",
+        },
         "mail_admins": {"class": "django.utils.log.AdminEmailHandler", "level": "ERROR"},
     },
     "loggers": {
@@ -282,6 +366,8 @@ LOGGING = {
         },
         "django.contrib.auth": {"handlers": ["security_file", "console"], "level": "INFO", "propagate": False},
         "users": {"handlers": ["security_file", "console"], "level": "INFO", "propagate": False},
+        "pi_payments": {"handlers": ["pi_file", "console"], "level": "INFO", "propagate": False},
+        "pi_payments.events": {"filters": ["sample_pi_events"]},
     },
 }
 
@@ -382,6 +468,14 @@ LOGOUT_REDIRECT_URL = "/"
 RECAPTCHA_SITE_KEY = env("RECAPTCHA_SITE_KEY", default="")
 RECAPTCHA_SECRET_KEY = env("RECAPTCHA_SECRET_KEY", default="")
 RECAPTCHA_MIN_SCORE = env.float("RECAPTCHA_MIN_SCORE", default=0.5)
+# Verify client: pooled session, circuit breaker and outage policy
+# (fail-closed by default). RECAPTCHA_VERIFY_URL can point at a local stand-in.
+RECAPTCHA_VERIFY_URL = env("RECAPTCHA_VERIFY_URL", default="https://www.google.com/recaptcha/api/siteverify")
+RECAPTCHA_TIMEOUT = env.float("RECAPTCHA_TIMEOUT", default=3)
+RECAPTCHA_POOL_SIZE = env.int("RECAPTCHA_POOL_SIZE", default=4)
+RECAPTCHA_FAIL_OPEN = env.bool("RECAPTCHA_FAIL_OPEN", default=False)
+RECAPTCHA_BREAKER_FAILURES = env.int("RECAPTCHA_BREAKER_FAILURES", default=5)
+RECAPTCHA_BREAKER_COOLDOWN = env.float("RECAPTCHA_BREAKER_COOLDOWN", default=30)
 
 # --- django-axes basic config ---
 AXES_FAILURE_LIMIT = 5
@@ -17,6 +17,8 @@ import subprocess
 import shutil
 import logging
 
+from pi_payments.rates import update_service_prices
+
 from .models import Service, ServiceFAQ, ServiceFeature
 
 logger = logging.getLogger(__name__)
@@ -134,6 +136,7 @@ class ServiceAdmin(ModelAdmin):
     @action(description="Activate selected")
     def activate_selected(self, request: HttpRequest, queryset: QuerySet):
         updated = queryset.update(is_active=True)
+        update_service_prices(queryset.only("id", "price", "is_active"))  # update() no lanza post_save
         self.message_user(request, f"Activated {updated} service(s).")
 
     @action(description="Deactivate selected")
@@ -200,6 +203,7 @@ class ServiceAdmin(ModelAdmin):
     @action(description="Activate", icon="check_circle", variant=ActionVariant.SUCCESS)
     def activate_row(self, request: HttpRequest, object_id: int):
         Service.objects.filter(pk=object_id).update(is_active=True)
+        update_service_prices(Service.objects.filter(pk=object_id).only("id", "price", "is_active"))
         return redirect(reverse("admin:services_service_changelist"))
 
     @action(description="Deactivate", icon="cancel", variant=ActionVariant.DANGER)
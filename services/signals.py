@@ -161,3 +161,12 @@ def compress_and_clean_service_preview(sender, instance, **kwargs):
             os.remove(src_abs)
     except OSError:
         pass
+
+
+@receiver(post_save, sender=Service)
+def refresh_service_pi_price(sender, instance, update_fields=None, **kwargs):
+    """Mantiene el precio en π precalculado al crear/cambiar precio o activar/desactivar."""
+    if update_fields is not None and not {"price", "is_active"} & set(update_fields):
+        return
+    from pi_payments.rates import update_service_prices  # import perezoso
+    update_service_prices([instance])
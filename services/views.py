@@ -6,12 +6,12 @@ from orders.models import Order
 from .models import Service
 
 def service_list(request):
-    services = Service.objects.filter(is_active=True)
+    services = Service.objects.filter(is_active=True).select_related("pi_price")
     return render(request, 'services/service_list.html', {'services': services})
 
 @ensure_csrf_cookie
 def service_detail(request, slug):
-    service = get_object_or_404(Service, slug=slug, is_active=True)
+    service = get_object_or_404(Service.objects.select_related("pi_price"), slug=slug, is_active=True)
     return render(request, "services/service_detail.html", {"service": service})
 
 def payment_success(request):
@@ -25,25 +25,28 @@ def payment_success(request):
         payment = (
             Payment.objects
             .select_related("order", "order__user")
+            .defer("raw_payload")
             .filter(provider_payment_id=pid)
             .first()
         )
         if payment:
             order = payment.order
-            txid = (payment.raw_payload or {}).get("txid")
+            txid = payment.txid
 
     # Fallback: si no hay pid o no encontramos el Payment, usamos el último pedido del usuario
     if not order and request.user.is_authenticated:
         order = (
             Order.objects
             .filter(user=request.user)
+            .select_related("payment")
+            .defer("payment__raw_payload")
             .order_by("-id")
             .first()
         )
         if order:
             payment = getattr(order, "payment", None)
             if payment and not txid:
-                txid = (payment.raw_payload or {}).get("txid")
+                txid = payment.txid
 
     ctx = {
         "payment_id": pid,
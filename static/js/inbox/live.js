@@ -0,0 +1,34 @@
+(function () {
+  'use strict';
+
+  // Inbox en tiempo real: un EventSource por pestaña contra /inbox/stream/.
+  // Actualiza el badge y emite "inbox:message" en document para que la página
+  // (p. ej. thread_detail) pinte los mensajes nuevos.
+  var script = document.currentScript;
+  if (!script || !window.EventSource) return;
+
+  var url = script.dataset.url;
+  var holder = document.querySelector('[data-inbox-after]');
+  if (holder && holder.dataset.inboxAfter) {
+    url += '?after=' + encodeURIComponent(holder.dataset.inboxAfter);
+  }
+
+  var source = new EventSource(url, { withCredentials: true });
+
+  source.addEventListener('message', function (ev) {
+    var data;
+    try { data = JSON.parse(ev.data); } catch (e) { return; }
+    document.dispatchEvent(new CustomEvent('inbox:message', { detail: data }));
+  });
+
+  source.addEventListener('unread', function (ev) {
+    var data;
+    try { data = JSON.parse(ev.data); } catch (e) { return; }
+    document.querySelectorAll('.js-inbox-badge').forEach(function (badge) {
+      badge.textContent = data.count;
+      badge.classList.toggle('d-none', !(data.count > 0));
+    });
+  });
+
+  window.addEventListener('pagehide', function () { source.close(); });
+})();
@@ -0,0 +1,17 @@
+from django.contrib.auth.backends import ModelBackend
+
+from . import user_cache
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend que carga request.user desde users.user_cache (fila completa, sin
+    tocar la BD en un acierto). Solo con caché compartida (settings.SHARED_CACHE):
+    sin ella se comporta como ModelBackend. El login (authenticate) no cambia.
+    """
+
+    def get_user(self, user_id):
+        if not user_cache.enabled():
+            return super().get_user(user_id)
+        user = user_cache.get_cached_user(user_id)
+        return user if self.user_can_authenticate(user) else None
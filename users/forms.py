@@ -7,7 +7,7 @@ from django.contrib.auth.forms import (
 )
 
 from .models import AVATAR_CHOICES
-from .utils.recaptcha import verify_recaptcha 
+from .utils.recaptcha import verify_recaptcha_async, wait_recaptcha
 
 User = get_user_model()
 
@@ -17,14 +17,17 @@ class RecaptchaV3Mixin(forms.Form):
     """
     Añade un campo hidden 'recaptcha_token' y valida reCAPTCHA v3 en clean().
     Sobrescribe 'recaptcha_action' en cada form que lo use.
+    La llamada a Google se solapa con el clean() del form base (en el login,
+    authenticate() y su hash PBKDF2): la latencia es el máximo, no la suma.
     """
     recaptcha_token = forms.CharField(widget=forms.HiddenInput, required=False)
     recaptcha_action = "generic"
 
     def clean(self):
-        cleaned = super().clean()
         token = self.data.get("recaptcha_token", "")
-        ok, payload = verify_recaptcha(token, expected_action=self.recaptcha_action)
+        pending = verify_recaptcha_async(token, expected_action=self.recaptcha_action)
+        cleaned = super().clean()
+        ok, payload = wait_recaptcha(pending)
         if not ok:
             raise forms.ValidationError("Verificación reCAPTCHA fallida. Inténtalo de nuevo.")
         return cleaned
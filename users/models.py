@@ -36,7 +36,11 @@ class User(AbstractUser):
         1) avatar subido
         2) avatar_choice => /static/avatars/presets/<choice>.png
         3) default => /static/images/default-avatar.png
+        (ya resuelto si el usuario viene de users.user_cache)
         """
+        cached = self.__dict__.get("_avatar_url")
+        if cached:
+            return cached
         if self.avatar:
             try:
                 return self.avatar.url
@@ -46,5 +50,9 @@ class User(AbstractUser):
             return static(f"avatars/presets/{self.avatar_choice}.png")
         return static("images/default-avatar.png")
 
+    def save(self, *args, **kwargs):
+        self.__dict__.pop("_avatar_url", None)  # el avatar puede haber cambiado
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return self.display_name
@@ -1,3 +1,161 @@
-from django.test import TestCase
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from pi_payments.client import PiClient
+
+from .backends import CachedModelBackend
+from .utils.pi_auth import _token_key, verify_pi_token
+from .utils.recaptcha import CircuitBreaker, RecaptchaClient
+
+User = get_user_model()
+
+
+@override_settings(PI_LOGIN_TOKEN_TTL=60, PI_LOGIN_TOKEN_GRACE=600)
+class PiLoginTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("users.utils.pi_auth.get_client")
+        self.me = patcher.start().return_value.me
+        self.addCleanup(patcher.stop)
+
+    def remember(self, token, age):
+        info = {"uid": "u1", "username": "ana", "verified_at": time.time() - age}
+        cache.set(_token_key(token), info)
+        return info
+
+    def login(self, token):
+        return self.client.post(reverse("users:pi_login"), json.dumps({"accessToken": token}),
+                                content_type="application/json")
+
+    def test_me_is_a_single_attempt(self):
+        pi = PiClient(base="https://pi.test", retries=2)
+        session = pi._session_for(retry=False)
+        self.assertEqual(session.get_adapter("https://pi.test").max_retries.total, 0)
+        with mock.patch.object(session, "request", return_value=SimpleNamespace(ok=True)) as request:
+            pi.me("t")
+        request.assert_called_once()
+
+    def test_recent_verification_skips_pi(self):
+        info = self.remember("t", age=10)
+        self.assertEqual(verify_pi_token("t"), info)
+        self.me.assert_not_called()
+
+    def test_pi_down_falls_back_to_an_older_verification(self):
+        info = self.remember("t", age=120)  # fuera del TTL, dentro del margen de gracia
+        for side_effect in (requests.Timeout(), [SimpleNamespace(status_code=503)]):
+            self.me.reset_mock()
+            self.me.side_effect = side_effect
+            self.assertEqual(verify_pi_token("t"), info)
+            self.me.assert_called_once()
+
+    def test_pi_down_without_verification_is_503(self):
+        self.me.side_effect = requests.ConnectionError()
+        self.assertEqual(self.login("t").status_code, 503)
+
+    def test_invalid_token_is_forgotten(self):
+        self.remember("t", age=120)
+        self.me.return_value = SimpleNamespace(status_code=401, ok=False)
+        self.assertEqual(self.login("t").status_code, 401)
+        self.assertIsNone(cache.get(_token_key("t")))
+
+    def test_login_creates_the_user_once(self):
+        self.me.return_value = SimpleNamespace(status_code=200, ok=True, json=lambda: {"uid": "u9", "username": "bo"})
+        self.assertEqual(self.login("t").status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.login("t").status_code, 200)
+        self.me.assert_called_once()  # la segunda vez, token ya verificado
+        self.assertTrue(self.client.session.get("_auth_user_id"))
+
+
+@override_settings(RECAPTCHA_SECRET_KEY="s", RECAPTCHA_MIN_SCORE=0.5, RECAPTCHA_FAIL_OPEN=False,
+                   RECAPTCHA_BREAKER_FAILURES=2, RECAPTCHA_BREAKER_COOLDOWN=30)
+class RecaptchaTests(TestCase):
+    def setUp(self):
+        self.recaptcha = RecaptchaClient(url="https://captcha.test", pool_size=1, timeout=1)
+        self.recaptcha._ensure()
+        patcher = mock.patch.object(self.recaptcha._session, "post")
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def answer(self, **payload):
+        return SimpleNamespace(status_code=200, json=lambda: payload)
+
+    def test_breaker_opens_after_repeated_failures_and_probes_once(self):
+        breaker = CircuitBreaker(failures=2, cooldown=30)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+        breaker._opened_at -= 31  # pasado el cooldown
+        self.assertTrue(breaker.allow())   # una sola llamada de prueba…
+        self.assertFalse(breaker.allow())  # …mientras está en vuelo
+        breaker.success()
+        self.assertTrue(breaker.allow())
+
+    def test_google_down_stops_calls_and_applies_the_policy(self):
+        self.post.side_effect = requests.ConnectionError()
+        for _ in range(2):
+            self.assertEqual(self.recaptcha.verify("t")[0], False)
+        self.assertEqual(self.recaptcha.verify("t"), (False, {"error": "circuit-open", "fallback": "closed"}))
+        self.assertEqual(self.post.call_count, 2)
+
+        with self.settings(RECAPTCHA_FAIL_OPEN=True):
+            self.assertTrue(self.recaptcha.verify("t")[0])
+
+    def test_score_and_action_are_checked(self):
+        self.post.return_value = self.answer(success=True, action="login", score=0.9)
+        self.assertTrue(self.recaptcha.verify("t")[0])
+        self.assertFalse(self.recaptcha.verify("t", expected_action="register")[0])
+        self.post.return_value = self.answer(success=True, action="login", score=0.1)
+        self.assertFalse(self.recaptcha.verify("t")[0])
+
+    def test_submit_runs_in_the_pool(self):
+        self.post.return_value = self.answer(success=True, action="login", score=0.9)
+        ok, payload = self.recaptcha.wait(self.recaptcha.submit("t"))
+        self.assertTrue(ok)
+        self.assertEqual(self.post.call_args.kwargs["data"]["response"], "t")
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("ana", "ana@example.com", "vieja-123")
+        self.backend = CachedModelBackend()
+
+    @override_settings(SHARED_CACHE=True)
+    def test_hit_serves_whole_record_without_queries(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.user.pk)
+        self.assertEqual(user.username, "ana")
+        self.assertTrue(user.check_password("vieja-123"))
+
+    @override_settings(SHARED_CACHE=True)
+    def test_password_change_and_deactivation_invalidate(self):
+        self.backend.get_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("nueva-456")
+            self.user.save()
+        self.assertTrue(self.backend.get_user(self.user.pk).check_password("nueva-456"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertIsNone(self.backend.get_user(self.user.pk))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_without_shared_cache_reads_the_db(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertIsNone(self.backend.get_user(self.user.pk))
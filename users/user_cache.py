@@ -0,0 +1,116 @@
+"""
+Caché del usuario autenticado (ver users.backends.CachedModelBackend).
+
+Cada petición con sesión carga el User para request.user; aquí se guarda su fila
+serializada completa (campos concretos + avatar_url ya resuelto) bajo
+"auth_user:<gen>:<id>", con TTL corto (USER_CACHE_TTL). Un acierto no toca la BD.
+
+Invalidación:
+- post_save / post_delete de User → borra la entrada de ese usuario. Un cambio de
+  contraseña (set_password + save) o una desactivación (admin) pasan por aquí.
+- Cambios en grupos o permisos del usuario (m2m) → ídem.
+- Cambios en los permisos de un Group → sube la generación global <gen>,
+  lo que descarta todas las entradas de golpe.
+
+Solo tiene sentido con una caché compartida (CACHE_URL → settings.SHARED_CACHE): con
+LocMemCache cada proceso invalidaría solo la suya y otro worker seguiría aceptando una
+contraseña cambiada o un usuario desactivado hasta el TTL. Sin ella,
+CachedModelBackend lee el usuario de la BD como ModelBackend.
+Un UPDATE directo sobre User (sin save) no invalida: úsese save() o invalidate().
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+User = get_user_model()
+
+GEN_KEY = "auth_user:gen"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "USER_CACHE_TTL", 60))
+
+
+def _gen() -> int:
+    return cache.get_or_set(GEN_KEY, 1, None)
+
+
+def _key(user_id, gen=None) -> str:
+    return f"auth_user:{gen or _gen()}:{user_id}"
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "SHARED_CACHE", False))
+
+
+def dump(user) -> dict:
+    row = {f.attname: getattr(user, f.attname) for f in User._meta.concrete_fields}
+    row["_avatar_url"] = user.avatar_url
+    return row
+
+
+def load(row: dict):
+    row = dict(row)
+    avatar_url = row.pop("_avatar_url", None)
+    names = [f.attname for f in User._meta.concrete_fields]
+    user = User.from_db(router.db_for_read(User), names, [row[n] for n in names])
+    if avatar_url:
+        user._avatar_url = avatar_url
+    return user
+
+
+def get_cached_user(user_id):
+    """Devuelve el User (desde caché si está) o None si no existe."""
+    key = _key(user_id)
+    row = cache.get(key)
+    if row is not None:
+        return load(row)
+    user = User._default_manager.filter(pk=user_id).first()
+    if user is not None:
+        cache.set(key, dump(user), _ttl())
+    return user
+
+
+def invalidate(user_id) -> None:
+    cache.delete(_key(user_id))
+
+
+def invalidate_all() -> None:
+    try:
+        cache.incr(GEN_KEY)
+    except ValueError:
+        cache.set(GEN_KEY, 2, None)
+
+
+@receiver(post_save, sender=User, dispatch_uid="user_cache_on_save")
+@receiver(post_delete, sender=User, dispatch_uid="user_cache_on_delete")
+def _on_user_change(sender, instance, **kwargs):
+    # Otra vez tras el commit: una petición concurrente pudo volver a cachear la fila vieja
+    pk = instance.pk
+    invalidate(pk)
+    transaction.on_commit(lambda: invalidate(pk))
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid="user_cache_on_groups")
+@receiver(m2m_changed, sender=User.user_permissions.through, dispatch_uid="user_cache_on_perms")
+def _on_user_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, User):
+        invalidate(instance.pk)
+    else:
+        # Cambio desde el otro lado (group.user_set / permission.user_set)
+        for pk in pk_set or ():
+            invalidate(pk)
+        if action == "post_clear":
+            invalidate_all()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid="user_cache_on_group_perms")
+def _on_group_perms(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_all()
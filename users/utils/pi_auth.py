@@ -0,0 +1,82 @@
+import hashlib
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from pi_payments.client import get_client
+
+log = logging.getLogger(__name__)
+
+
+class PiAuthUnavailable(Exception):
+    """La API de Pi no respondió a tiempo y no hay verificación previa utilizable."""
+
+
+def _token_key(token: str) -> str:
+    # Nunca guardamos el token en claro: solo su hash
+    return "pi_token:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+def _uid_key(uid: str) -> str:
+    return f"pi_uid:{uid}"
+
+
+def verify_pi_token(token: str) -> Optional[Dict[str, Any]]:
+    """
+    Verifica un accessToken de Pi vía GET /v2/me. Devuelve {"uid", "username"} o None si es inválido.
+
+    - Token verificado hace menos de PI_LOGIN_TOKEN_TTL s → se reutiliza sin llamar a Pi.
+    - Un solo intento, sin reintentos (PiClient.me), con timeout PI_LOGIN_TIMEOUT. Si Pi
+      falla o tarda, se acepta una verificación anterior de menos de
+      PI_LOGIN_TOKEN_GRACE s; si no la hay, lanza PiAuthUnavailable.
+    """
+    key = _token_key(token)
+    cached = cache.get(key)
+    ttl = int(getattr(settings, "PI_LOGIN_TOKEN_TTL", 60))
+    if cached and time.time() - cached["verified_at"] < ttl:
+        return cached
+
+    timeout = float(getattr(settings, "PI_LOGIN_TIMEOUT", 5))
+    try:
+        r = get_client().me(token, timeout=(min(3.05, timeout), timeout))
+    except requests.RequestException as e:
+        if cached:
+            log.warning("pi_login: Pi API no disponible (%s); uso verificación en caché", e)
+            return cached
+        raise PiAuthUnavailable(str(e)) from e
+
+    if r.status_code >= 500 and cached:
+        log.warning("pi_login: Pi API respondió %s; uso verificación en caché", r.status_code)
+        return cached
+    if r.status_code >= 500:
+        raise PiAuthUnavailable(f"HTTP {r.status_code}")
+    if not r.ok:
+        cache.delete(key)
+        return None
+
+    try:
+        me = r.json()
+    except ValueError:
+        raise PiAuthUnavailable("respuesta no JSON")
+    uid = (me.get("uid") or "").strip()
+    if not uid:
+        return None
+    info = {
+        "uid": uid,
+        "username": (me.get("username") or "pi_user").strip() or "pi_user",
+        "verified_at": time.time(),
+    }
+    cache.set(key, info, int(getattr(settings, "PI_LOGIN_TOKEN_GRACE", 600)))
+    return info
+
+
+def cached_user_id(uid: str) -> Optional[int]:
+    return cache.get(_uid_key(uid))
+
+
+def remember_user_id(uid: str, user_id: int) -> None:
+    cache.set(_uid_key(uid), user_id, int(getattr(settings, "PI_LOGIN_UID_TTL", 86400)))
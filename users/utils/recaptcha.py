@@ -1,47 +1,183 @@
+"""
+Verificación de reCAPTCHA v3.
+
+- Un cliente por proceso con requests.Session (keep-alive hacia Google) y un
+  pequeño pool de hilos para lanzar la verificación en paralelo con otro trabajo
+  (p. ej. el hash PBKDF2 del login): ver verify_recaptcha_async().
+- Circuit breaker: tras RECAPTCHA_BREAKER_FAILURES fallos de red/5xx seguidos deja
+  de llamar a Google durante RECAPTCHA_BREAKER_COOLDOWN s; luego prueba una vez.
+- Con Google caído (o el breaker abierto) manda RECAPTCHA_FAIL_OPEN:
+  False (por defecto) rechaza; True deja pasar.
+- RECAPTCHA_VERIFY_URL permite apuntar a un servidor local de pruebas.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Dict, Tuple
+
 import requests
-from typing import Tuple, Dict, Any
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
 
 VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
 
 
+class CircuitBreaker:
+    """closed → (N fallos seguidos) → open → (cooldown) → half-open: una llamada de prueba."""
+
+    def __init__(self, failures: int, cooldown: float):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._failures < self.max_failures:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True  # half-open
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.max_failures:
+                self._opened_at = time.monotonic()
+
+
+class RecaptchaClient:
+    def __init__(self, url: str | None = None, pool_size: int | None = None, timeout: float | None = None):
+        self.url = url or getattr(settings, "RECAPTCHA_VERIFY_URL", "") or VERIFY_URL
+        self.pool_size = pool_size or int(getattr(settings, "RECAPTCHA_POOL_SIZE", 4))
+        self.timeout = timeout or float(getattr(settings, "RECAPTCHA_TIMEOUT", 3))
+        self.breaker = CircuitBreaker(
+            int(getattr(settings, "RECAPTCHA_BREAKER_FAILURES", 5)),
+            float(getattr(settings, "RECAPTCHA_BREAKER_COOLDOWN", 30)),
+        )
+        self._session: requests.Session | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+
+    def _ensure(self) -> None:
+        # Tras un fork cada worker necesita su propio pool y sus hilos
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                s = requests.Session()
+                # Sin reintentos: un token de reCAPTCHA solo se puede verificar una vez
+                s.mount("https://", HTTPAdapter(pool_maxsize=self.pool_size, max_retries=0))
+                s.mount("http://", HTTPAdapter(pool_maxsize=self.pool_size, max_retries=0))
+                self._session = s
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="recaptcha")
+                self._pid = pid
+
+    def _fallback(self, reason: str) -> Tuple[bool, Dict[str, Any]]:
+        fail_open = bool(getattr(settings, "RECAPTCHA_FAIL_OPEN", False))
+        log.warning("reCAPTCHA no disponible (%s); fail-%s", reason, "open" if fail_open else "closed")
+        return fail_open, {"error": reason, "fallback": "open" if fail_open else "closed"}
+
+    def verify(self, token: str, expected_action: str = "login", remoteip: str | None = None) -> Tuple[bool, Dict[str, Any]]:
+        data = {
+            "secret": getattr(settings, "RECAPTCHA_SECRET_KEY", ""),
+            "response": token or "",
+        }
+        if remoteip:
+            data["remoteip"] = remoteip
+
+        # Validaciones básicas locales
+        if not data["secret"]:
+            return False, {"error": "missing-secret"}
+        if not data["response"]:
+            return False, {"error": "missing-token"}
+
+        if not self.breaker.allow():
+            return self._fallback("circuit-open")
+
+        self._ensure()
+        try:
+            r = self._session.post(self.url, data=data, timeout=self.timeout)
+            if r.status_code >= 500:
+                raise requests.HTTPError(f"HTTP {r.status_code}")
+            payload = r.json()
+        except (requests.RequestException, ValueError) as e:
+            self.breaker.failure()
+            return self._fallback(f"request-failed: {e}")
+        self.breaker.success()
+
+        # Criterios de validación v3
+        min_score = float(getattr(settings, "RECAPTCHA_MIN_SCORE", 0.5))
+        is_ok = (
+            payload.get("success") is True
+            and payload.get("action") == expected_action
+            and float(payload.get("score", 0)) >= min_score
+        )
+        return is_ok, payload
+
+    def submit(self, *args, **kwargs) -> Future:
+        self._ensure()
+        return self._executor.submit(self.verify, *args, **kwargs)
+
+    def wait(self, future: Future) -> Tuple[bool, Dict[str, Any]]:
+        """Resultado de submit(); si el pool va tan cargado que no llega a tiempo, aplica la política."""
+        try:
+            return future.result(timeout=self.timeout + 1)
+        except FutureTimeout:
+            future.cancel()
+            return self._fallback("queue-timeout")
+
+
+_client: RecaptchaClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> RecaptchaClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RecaptchaClient()
+    return _client
+
+
 def verify_recaptcha(token: str, expected_action: str = "login", remoteip: str | None = None) -> Tuple[bool, Dict[str, Any]]:
     """
     Verifica un token de reCAPTCHA v3 contra la API de Google.
 
     Devuelve: (is_valid, payload_json)
       - is_valid: True si success==True, action coincide y score >= umbral
+        (o la política RECAPTCHA_FAIL_OPEN si Google no responde)
       - payload_json: respuesta completa de Google (útil para logs/depuración)
 
     Requisitos en settings.py:
       RECAPTCHA_SECRET_KEY (str)
       RECAPTCHA_MIN_SCORE (float, por defecto 0.5 opcional)
     """
-    data = {
-        "secret": getattr(settings, "RECAPTCHA_SECRET_KEY", ""),
-        "response": token or "",
-    }
-    if remoteip:
-        data["remoteip"] = remoteip
-
-    # Validaciones básicas locales
-    if not data["secret"]:
-        return False, {"error": "missing-secret"}
-    if not data["response"]:
-        return False, {"error": "missing-token"}
-
-    try:
-        r = requests.post(VERIFY_URL, data=data, timeout=5)
-        payload = r.json()
-    except Exception as e:
-        return False, {"error": f"request-failed: {e}"}
-
-    # Criterios de validación v3
-    min_score = float(getattr(settings, "RECAPTCHA_MIN_SCORE", 0.5))
-    is_ok = (
-        payload.get("success") is True
-        and payload.get("action") == expected_action
-        and float(payload.get("score", 0)) >= min_score
-    )
-
-    return is_ok, payload
+    return get_client().verify(token, expected_action, remoteip)
+
+
+def verify_recaptcha_async(token: str, expected_action: str = "login", remoteip: str | None = None) -> Future:
+    """Como verify_recaptcha() pero en segundo plano; recoge el resultado con wait_recaptcha()."""
+    return get_client().submit(token, expected_action, remoteip)
+
+
+def wait_recaptcha(future: Future) -> Tuple[bool, Dict[str, Any]]:
+    return get_client().wait(future)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pathlib import Path
-import json, requests
+import json, logging
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login, logout, get_user_model
@@ -20,9 +20,10 @@ from .forms import (
     StyledAuthenticationForm,
 )
 from .models import AVATAR_CHOICES
+from .utils.pi_auth import PiAuthUnavailable, cached_user_id, remember_user_id, verify_pi_token
 
-PI_API_BASE = "https://api.minepi.com/v2"
 User = get_user_model()
+log = logging.getLogger(__name__)
 
 
 # ---------- Helpers ----------
@@ -59,22 +60,34 @@ def pi_login(request):
     if not token:
         return HttpResponseBadRequest("Falta accessToken")
 
-    r = requests.get(f"{PI_API_BASE}/me", headers={"Authorization": f"Bearer {token}"})
-    if not r.ok:
+    # Token verificado recientemente (hash en caché) → sin llamada a Pi
+    try:
+        me = verify_pi_token(token)
+    except PiAuthUnavailable as e:
+        log.warning("pi_login: Pi API no disponible (%s)", e)
+        return JsonResponse({"ok": False, "reason": "Pi no disponible"}, status=503)
+    if me is None:
         return JsonResponse({"ok": False, "reason": "token inválido"}, status=401)
 
-    me = r.json()
-    pi_uid = (me.get("uid") or "").strip()
-    pi_username = (me.get("username") or "pi_user").strip() or "pi_user"
-
+    pi_uid = me["uid"]
     username = f"pi_{pi_uid}"
-    user, created = User.objects.get_or_create(
-        username=username,
-        defaults={"email": f"{pi_username}@pi.local"}
-    )
-    if created:
-        user.set_unusable_password()
-        user.save(update_fields=["password"])
+
+    # Re-auth del Pi Browser con la sesión ya abierta para este usuario: nada que hacer
+    user_id = cached_user_id(pi_uid)
+    if user_id and request.user.is_authenticated and request.user.pk == user_id:
+        return JsonResponse({"ok": True})
+
+    user = User.objects.filter(pk=user_id, username=username).first() if user_id else None
+    created = False
+    if user is None:
+        user, created = User.objects.get_or_create(
+            username=username,
+            defaults={"email": f"{me['username']}@pi.local"}
+        )
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=["password"])
+        remember_user_id(pi_uid, user.pk)
 
     login(request, user, backend=_pick_backend())
     if created: